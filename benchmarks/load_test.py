@@ -0,0 +1,271 @@
+"""Drive the real ASGI app through representative scenarios and report per-route latency.
+
+Seeds a scratch database on a local mongod at the requested scale with the
+server's synthetic data generator, then runs each scenario with concurrent
+virtual clients over httpx's in-process ASGI transport, so request handling,
+Motor and MongoDB are real and only the network hop is skipped. The app's
+startup and shutdown handlers run around the scenarios, so the cache sync,
+index reconciliation and other background jobs are live as in production.
+Needs httpx (``pip install -r requirements-dev.txt``).
+
+Scenarios:
+    browse          product listing, filters, keyset paging, search, facets, shelves, detail
+    cart_to_quote   add to cart, view cart, submit a quote
+    admin_dashboard stats, admin product listing, quotes, pending dealers
+    chat_inbox      inbox, thread history, admin reply, user message
+
+Results are printed as JSON: throughput and p50/p99 per route. With
+``--baseline`` each route is compared against a stored run, and anything
+slower (or lower throughput) than the tolerance allows is flagged, with a
+non-zero exit status.
+
+    python benchmarks/load_test.py --scale 10k --concurrency 20 --iterations 25 \\
+        --write-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --scale 10k --skip-seed --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+SCALES = ("10k", "100k", "1m")  # presets in server.SYNTHETIC_SCALES
+SCENARIOS = ("browse", "cart_to_quote", "admin_dashboard", "chat_inbox")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="oeh_loadtest")
+    parser.add_argument("--scale", choices=SCALES, default="10k", help="synthetic data preset (products; other collections scale with it)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for data and request mix")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in --db-name")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual clients per scenario")
+    parser.add_argument("--iterations", type=int, default=25, help="scenario runs per virtual client")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--write-baseline", help="write this run's results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging, e.g. 0.2 = 20%%")
+    return parser.parse_args()
+
+
+# Seeding
+
+async def seed(server, scale: str, seed_value: int) -> None:
+    """Synthetic dataset from the server's generator plus the admin the scenarios log in as"""
+    # Stock is effectively unlimited so cart and quote scenarios measure the
+    # request path rather than running products out of stock
+    spec = server.synthetic_spec(scale, {"seed": seed_value, "replace": True, "stock_min": 1_000_000,
+                                         "stock_max": 1_000_000, "out_of_stock_ratio": 0})
+    report = await server.generate_synthetic_data(spec)
+    print(json.dumps(report["collections"]), file=sys.stderr)
+    await server.db.admins.delete_many({"id": "bench-admin"})
+    await server.db.admins.insert_one({"id": "bench-admin", "email": "bench-admin@example.com", "username": "bench-admin",
+                                       "password": "unused", "is_super_admin": True, "is_active": True,
+                                       "created_at": datetime.now(timezone.utc)})
+
+
+# Load generation
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def request(self, client, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples.setdefault(route, []).append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+
+async def browse(client, recorder: Recorder, ctx: Dict, rng: random.Random):
+    await recorder.request(client, "GET /api/products", "GET", "/api/products", params={"limit": 20})
+    await recorder.request(client, "GET /api/products?category", "GET", "/api/products",
+                           params={"category": rng.choice(ctx["categories"]), "limit": 20})
+    page = await recorder.request(client, "GET /api/products?sort", "GET", "/api/products",
+                                  params={"sort": "price_asc", "limit": 20})
+    if page.headers.get("x-next-cursor"):
+        await recorder.request(client, "GET /api/products?cursor", "GET", "/api/products",
+                               params={"cursor": page.headers["x-next-cursor"], "limit": 20})
+    await recorder.request(client, "GET /api/products?search", "GET", "/api/products",
+                           params={"search": rng.choice(["steel", "tactical", "cordura", "compact"]), "limit": 20})
+    await recorder.request(client, "GET /api/products/facets", "GET", "/api/products/facets",
+                           params={"category": rng.choice(ctx["categories"])})
+    await recorder.request(client, "GET /api/categories/with-counts", "GET", "/api/categories/with-counts")
+    await recorder.request(client, "GET /api/products/featured", "GET", "/api/products/featured")
+    await recorder.request(client, "GET /api/products/{product_id}", "GET", f"/api/products/{rng.choice(ctx['product_ids'])}")
+
+
+async def cart_to_quote(client, recorder: Recorder, ctx: Dict, rng: random.Random):
+    user_id = rng.choice(ctx["user_ids"])
+    headers = {"Authorization": f"Bearer {ctx['server'].create_jwt_token(user_id, 'user')}"}
+    product_ids = rng.sample(ctx["product_ids"], 2)
+    for product_id in product_ids:
+        await recorder.request(client, "POST /api/cart/add", "POST", "/api/cart/add", headers=headers,
+                               json={"product_id": product_id, "quantity": rng.randint(1, 3)})
+    await recorder.request(client, "GET /api/cart", "GET", "/api/cart", headers=headers)
+    await recorder.request(client, "POST /api/quotes", "POST", "/api/quotes", headers=headers, json={
+        "user_id": user_id,
+        "items": [{"product_id": product_id, "quantity": 1, "price": 0} for product_id in product_ids],
+        "project_name": "Load test", "intended_use": "Benchmark",
+        "delivery_address": "1 Street", "billing_address": "1 Street"
+    })
+    await recorder.request(client, "GET /api/quotes", "GET", "/api/quotes", headers=headers)
+
+
+async def admin_dashboard(client, recorder: Recorder, ctx: Dict, rng: random.Random):
+    headers = ctx["admin_headers"]
+    await recorder.request(client, "GET /api/admin/stats", "GET", "/api/admin/stats", headers=headers)
+    await recorder.request(client, "GET /api/admin/products", "GET", "/api/admin/products", headers=headers,
+                           params={"limit": 50, "total": "estimated"})
+    await recorder.request(client, "GET /api/admin/quotes", "GET", "/api/admin/quotes", headers=headers)
+    await recorder.request(client, "GET /api/admin/dealers/pending", "GET", "/api/admin/dealers/pending", headers=headers)
+
+
+async def chat_inbox(client, recorder: Recorder, ctx: Dict, rng: random.Random):
+    headers = ctx["admin_headers"]
+    inbox = await recorder.request(client, "GET /api/admin/chat/conversations", "GET",
+                                   "/api/admin/chat/conversations", headers=headers, params={"limit": 50})
+    conversations = inbox.json() if inbox.status_code == 200 else []
+    if isinstance(conversations, dict):
+        conversations = conversations.get("conversations", [])
+    user_id = rng.choice(conversations)["user_id"] if conversations else rng.choice(ctx["user_ids"])
+    await recorder.request(client, "GET /api/admin/chat/{user_id}/messages", "GET",
+                           f"/api/admin/chat/{user_id}/messages", headers=headers)
+    await recorder.request(client, "POST /api/admin/chat/send", "POST", "/api/admin/chat/send", headers=headers,
+                           json={"user_id": user_id, "sender_type": "admin", "sender_name": "bench", "message": "Load test reply"})
+    user_headers = {"Authorization": f"Bearer {ctx['server'].create_jwt_token(user_id, 'user')}"}
+    await recorder.request(client, "POST /api/chat/send", "POST", "/api/chat/send", headers=user_headers,
+                           json={"user_id": user_id, "sender_type": "user", "sender_name": "bench", "message": "Load test message"})
+    await recorder.request(client, "GET /api/chat/{user_id}", "GET", f"/api/chat/{user_id}", headers=user_headers)
+
+
+SCENARIO_FUNCTIONS = {
+    "browse": browse,
+    "cart_to_quote": cart_to_quote,
+    "admin_dashboard": admin_dashboard,
+    "chat_inbox": chat_inbox
+}
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_scenario(name: str, client, ctx: Dict, args) -> Dict:
+    recorder = Recorder()
+    scenario = SCENARIO_FUNCTIONS[name]
+
+    async def virtual_client(index: int):
+        rng = random.Random(f"{args.seed}-{name}-{index}")
+        for _ in range(args.iterations):
+            await scenario(client, recorder, ctx, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_client(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        routes[route] = {
+            "requests": len(ordered),
+            "errors": recorder.errors.get(route, 0),
+            "throughput_rps": round(len(ordered) / elapsed, 1),
+            "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2)
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {"elapsed_seconds": round(elapsed, 2), "throughput_rps": round(total / elapsed, 1), "routes": routes}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Routes whose p50/p99 grew, or throughput fell, by more than the tolerance"""
+    regressions = []
+    for scenario, result in results["scenarios"].items():
+        baseline_routes = baseline.get("scenarios", {}).get(scenario, {}).get("routes", {})
+        for route, current in result["routes"].items():
+            previous = baseline_routes.get(route)
+            if not previous:
+                continue
+            for metric, worse_when_higher in (("p50_ms", True), ("p99_ms", True), ("throughput_rps", False)):
+                before, after = previous[metric], current[metric]
+                if not before:
+                    continue
+                change = (after - before) / before
+                if (change > tolerance) if worse_when_higher else (change < -tolerance):
+                    regressions.append({
+                        "scenario": scenario, "route": route, "metric": metric,
+                        "baseline": before, "current": after, "change": f"{change:+.0%}"
+                    })
+    return regressions
+
+
+async def run(args):
+    # Imported late so the benchmark database, not the one in .env, is used
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import httpx
+    import server
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        await seed(server, args.scale, args.seed)
+        print(f"Seeded {args.scale} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    ctx = {
+        "server": server,
+        "categories": await server.db.categories.distinct("name"),
+        "product_ids": [doc["id"] for doc in await server.db.products.find({}, {"id": 1}).limit(5000).to_list(None)],
+        "user_ids": [doc["id"] for doc in await server.db.users.find({}, {"id": 1}).limit(5000).to_list(None)],
+        "admin_headers": {"Authorization": f"Bearer {server.create_jwt_token('bench-admin', 'admin')}"}
+    }
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    results = {
+        "scale": args.scale,
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "scenarios": {}
+    }
+    # ASGITransport doesn't send lifespan events, so drive the app's startup
+    # and shutdown here; shutdown also closes the Motor client
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            for name in scenarios:
+                results["scenarios"][name] = await run_scenario(name, client, ctx, args)
+    finally:
+        await server.app.router.shutdown()
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    results = asyncio.run(run(args))
+
+    exit_code = 0
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        results["tolerance"] = args.tolerance
+        results["regressions"] = compare(results, baseline, args.tolerance)
+        exit_code = 1 if results["regressions"] else 0
+    if args.write_baseline:
+        Path(args.write_baseline).write_text(json.dumps(results, indent=2))
+    print(json.dumps(results, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Compare per-request CPU of the default and FAST_JSON_RESPONSES list paths.
+
+Serves synthetic product and quote documents through the same
+``shape_documents``/``list_response`` helpers the list endpoints use, with
+the same ``response_model`` declarations, and drives the app directly over
+ASGI so no network or database is involved. Each scenario is measured with
+the fast path off and on, using process CPU time.
+
+    python benchmarks/serialization.py --products 100 --quotes 50 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100, help="products per page")
+    parser.add_argument("--quotes", type=int, default=50, help="quotes per page")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario and mode")
+    return parser.parse_args()
+
+
+def product_documents(count: int) -> List[dict]:
+    now = datetime.utcnow().replace(microsecond=0)
+    return [
+        {
+            "_id": uuid.uuid4().hex[:24],
+            "id": str(uuid.uuid4()),
+            "sku": f"SKU-{i:06d}",
+            "name": f"Industrial widget {i}",
+            "description": "Heavy duty widget for industrial use. " * 8,
+            "price": 100.0 + i,
+            "original_price": 120.0 + i,
+            "category": "Tools",
+            "subcategory": "Widgets",
+            "brand": "Acme",
+            "image_url": f"https://example.com/images/{i}.jpg",
+            "gallery_images": [f"https://example.com/images/{i}-{n}.jpg" for n in range(4)],
+            "rating": 4.6,
+            "review_count": 120 + i,
+            "in_stock": True,
+            "stock_quantity": 50,
+            "specifications": {"material": "steel", "voltage": "220V", "weight_kg": 2.5, "warranty": "2 years"},
+            "features": ["Durable", "Corrosion resistant", "CE certified"],
+            "tags": ["widget", "industrial", "steel"],
+            "spec_terms": ["steel", "220V", "2 years"],
+            "is_restricted": False,
+            "discount_percent": 16.7,
+            "created_at": now - timedelta(days=i),
+            "updated_at": now
+        }
+        for i in range(count)
+    ]
+
+
+def quote_documents(count: int) -> List[dict]:
+    now = datetime.utcnow().replace(microsecond=0)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_name": "Jane Buyer",
+            "user_email": "jane@example.com",
+            "company_name": "Buyer Co",
+            "items": [
+                {"product_id": str(uuid.uuid4()), "quantity": n + 1, "price": 99.5, "notes": None}
+                for n in range(5)
+            ],
+            "total_amount": 1234.5,
+            "project_name": f"Project {i}",
+            "intended_use": "Plant refit",
+            "delivery_date": now + timedelta(days=30),
+            "delivery_address": "1 Factory Road",
+            "billing_address": "1 Factory Road",
+            "company_size": "50-200",
+            "budget_range": "10k-50k",
+            "additional_requirements": None,
+            "status": "pending",
+            "admin_notes": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        for i in range(count)
+    ]
+
+
+async def call(app, path: str) -> int:
+    """Issue one GET over ASGI and return the response body size"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0),
+        "server": ("bench", 80)
+    }
+    body = bytearray()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return len(body)
+
+
+async def run(args):
+    # Imported late so the benchmark never picks up the database from .env
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+    from fastapi import FastAPI
+
+    products = product_documents(args.products)
+    quotes = quote_documents(args.quotes)
+
+    app = FastAPI()
+
+    @app.get("/products", response_model=List[server.Product])
+    async def list_products():
+        return server.list_response(server.shape_documents(server.Product, products))
+
+    @app.get("/quotes", response_model=List[server.QuoteResponse])
+    async def list_quotes():
+        return server.list_response(server.shape_documents(server.QuoteResponse, quotes))
+
+    results = {}
+    for scenario, path in (("products", "/products"), ("quotes", "/quotes")):
+        results[scenario] = {}
+        for mode, fast in (("default", False), ("fast", True)):
+            server.FAST_JSON_RESPONSES = fast
+            size = await call(app, path)  # warm up
+            started = time.process_time()
+            for _ in range(args.requests):
+                await call(app, path)
+            cpu = time.process_time() - started
+            results[scenario][mode] = {
+                "cpu_ms_per_request": round(cpu / args.requests * 1000, 3),
+                "response_bytes": size
+            }
+        default_cpu = results[scenario]["default"]["cpu_ms_per_request"]
+        fast_cpu = results[scenario]["fast"]["cpu_ms_per_request"]
+        results[scenario]["cpu_saved_ms_per_request"] = round(default_cpu - fast_cpu, 3)
+        results[scenario]["speedup"] = round(default_cpu / fast_cpu, 2) if fast_cpu else None
+
+    server.client.close()
+    return {
+        "products_per_page": args.products,
+        "quotes_per_page": args.quotes,
+        "requests": args.requests,
+        "results": results
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "oeh_benchmark")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
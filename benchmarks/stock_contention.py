@@ -0,0 +1,103 @@
+"""Hammer a single SKU with concurrent stock reservations and check for oversell.
+
+Runs against a real MongoDB (a local mongod is enough) using the same
+``reserve_stock`` the cart and quote endpoints use. The benchmark creates
+one product in a scratch database, lets many coroutines race to reserve
+it, then checks that the units handed out never exceed the starting stock.
+
+    python benchmarks/stock_contention.py --mongo-url mongodb://localhost:27017 \\
+        --stock 1000 --workers 200 --attempts 20 --quantity 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="oeh_benchmark")
+    parser.add_argument("--stock", type=int, default=1000, help="starting stock_quantity of the SKU")
+    parser.add_argument("--workers", type=int, default=200, help="concurrent coroutines")
+    parser.add_argument("--attempts", type=int, default=20, help="reservations attempted per coroutine")
+    parser.add_argument("--quantity", type=int, default=1, help="units per reservation")
+    return parser.parse_args()
+
+
+async def run(args):
+    # Imported late so the benchmark database, not the one in .env, is used
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import server
+
+    product_id = f"bench-{uuid.uuid4()}"
+    await server.db.products.insert_one({
+        "id": product_id,
+        "name": "Contention benchmark SKU",
+        "price": 1.0,
+        "in_stock": True,
+        "stock_quantity": args.stock
+    })
+
+    successes = 0
+    rejections = 0
+
+    async def worker(worker_id: int):
+        nonlocal successes, rejections
+        for _ in range(args.attempts):
+            reservation = await server.reserve_stock(product_id, args.quantity, f"bench-user-{worker_id}", "cart")
+            if reservation is None:
+                rejections += 1
+            else:
+                successes += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.workers)))
+    elapsed = time.perf_counter() - started
+
+    product = await server.db.products.find_one({"id": product_id})
+    held = await server.db.stock_reservations.aggregate([
+        {"$match": {"product_id": product_id, "status": "active"}},
+        {"$group": {"_id": None, "units": {"$sum": "$quantity"}}}
+    ]).to_list(1)
+    reserved_units = held[0]["units"] if held else 0
+
+    await server.db.products.delete_one({"id": product_id})
+    await server.db.stock_reservations.delete_many({"product_id": product_id})
+    server.client.close()
+
+    attempts = args.workers * args.attempts
+    return {
+        "starting_stock": args.stock,
+        "workers": args.workers,
+        "attempts": attempts,
+        "successful_reservations": successes,
+        "rejected_reservations": rejections,
+        "reserved_units": reserved_units,
+        "final_stock": product["stock_quantity"],
+        "oversold_units": max(0, reserved_units - args.stock),
+        "stock_consistent": product["stock_quantity"] + reserved_units == args.stock,
+        "elapsed_seconds": round(elapsed, 3),
+        # Rejections are cheap no-op updates once the SKU sells out, so they're
+        # reported apart from the reservations that actually took stock
+        "attempts_per_second": round(attempts / elapsed, 1) if elapsed else None,
+        "reservations_per_second": round(successes / elapsed, 1) if elapsed else None,
+        "rejections_per_second": round(rejections / elapsed, 1) if elapsed else None
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["oversold_units"] == 0 and result["stock_consistent"] else 1)
+
+
+if __name__ == "__main__":
+    main()
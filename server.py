@@ -1,20 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, status
+from fastapi import FastAPI, APIRouter, File, HTTPException, Header, Query, Depends, Request, Response, UploadFile, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, ValidationError
+from typing import Awaitable, Callable, List, Literal, Optional, Dict, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
 import jwt
 import hashlib
+import hmac
 import secrets
+import threading
 import asyncio
+import base64
+import csv
+import functools
+import io
+import itertools
+import json
 import os
+import random
+import sys
+import time
+import queue
+import traceback
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 
 
 ROOT_DIR = Path(__file__).parent
@@ -22,7 +44,64 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+
+class MongoEventFanout(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Forwards Mongo command and connection checkout events to listeners
+    registered after the client exists"""
+
+    def __init__(self):
+        self.command_listeners: List[monitoring.CommandListener] = []
+        self.pool_listeners: list = []
+
+    def _forward(self, listeners: list, method: str, event):
+        for listener in listeners:
+            getattr(listener, method)(event)
+
+    def started(self, event):
+        self._forward(self.command_listeners, "started", event)
+
+    def succeeded(self, event):
+        self._forward(self.command_listeners, "succeeded", event)
+
+    def failed(self, event):
+        self._forward(self.command_listeners, "failed", event)
+
+    def connection_check_out_started(self, event):
+        self._forward(self.pool_listeners, "connection_check_out_started", event)
+
+    def connection_checked_out(self, event):
+        self._forward(self.pool_listeners, "connection_checked_out", event)
+
+    def connection_check_out_failed(self, event):
+        self._forward(self.pool_listeners, "connection_check_out_failed", event)
+
+    # Pool lifecycle events nobody listens to
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+mongo_events = MongoEventFanout()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_events])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -37,6 +116,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Has-More"],
 )
 
 # Create a router with the /api prefix
@@ -69,6 +149,7 @@ JWT_EXPIRATION_HOURS = 24
 # Enhanced Models
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    sku: Optional[str] = None
     name: str
     description: str
     price: float
@@ -81,17 +162,40 @@ class Product(BaseModel):
     rating: float
     review_count: int
     in_stock: bool
-    stock_quantity: int
+    stock_quantity: int  # available units; active reservations are already taken off
     specifications: dict
     features: List[str]
     tags: List[str]
     is_restricted: bool = False
     weight: Optional[str] = None
     dimensions: Optional[str] = None
+    discount_percent: Optional[float] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProductSummary(BaseModel):
+    """Listing view of a product; fields requested through ``fields=`` ride along as extras"""
+    model_config = ConfigDict(extra="allow")
+    
+    id: str
+    sku: Optional[str] = None
+    name: str
+    price: float
+    original_price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    category: str
+    subcategory: str
+    brand: str
+    image_url: str
+    rating: float
+    review_count: int
+    in_stock: bool
+    stock_quantity: int
+    is_restricted: bool = False
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class ProductCreate(BaseModel):
+    sku: Optional[str] = None
     name: str
     description: str
     price: float
@@ -113,6 +217,7 @@ class ProductCreate(BaseModel):
     dimensions: Optional[str] = None
 
 class ProductUpdate(BaseModel):
+    sku: Optional[str] = None
     name: Optional[str] = None
     description: Optional[str] = None
     price: Optional[float] = None
@@ -125,7 +230,7 @@ class ProductUpdate(BaseModel):
     rating: Optional[float] = None
     review_count: Optional[int] = None
     in_stock: Optional[bool] = None
-    stock_quantity: Optional[int] = None
+    stock_quantity: Optional[int] = None  # available units, not counting what carts and quotes hold
     specifications: Optional[dict] = None
     features: Optional[List[str]] = None
     tags: Optional[List[str]] = None
@@ -133,6 +238,27 @@ class ProductUpdate(BaseModel):
     weight: Optional[str] = None
     dimensions: Optional[str] = None
 
+class ProductPatch(ProductUpdate):
+    id: str
+
+class ProductBulkFilter(BaseModel):
+    ids: Optional[List[str]] = None
+    category: Optional[str] = None
+    brand: Optional[str] = None
+    min_price: Optional[float] = Field(default=None, ge=0)
+    max_price: Optional[float] = Field(default=None, ge=0)
+    in_stock: Optional[bool] = None
+    all: bool = False  # required to target the whole catalog with no other criteria
+
+class PriceChange(BaseModel):
+    mode: str = Field(..., pattern="^(percent|absolute)$")
+    value: float
+
+class ProductBulkUpdateRequest(BaseModel):
+    patches: List[ProductPatch] = []
+    filter: Optional[ProductBulkFilter] = None
+    price_change: Optional[PriceChange] = None
+
 class Category(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -270,9 +396,11 @@ class DealerResponse(BaseModel):
     is_active: bool
 
 # Quote System Models
+QuoteStatus = Literal["pending", "reviewed", "approved", "declined"]
+
 class QuoteItem(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(..., gt=0)
     price: float
     notes: Optional[str] = None
 
@@ -357,14 +485,16 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
             detail="Invalid or expired admin token"
         )
     
-    admin = await db.admins.find_one({"id": token_data["user_id"], "is_active": True})
+    admin = await load_principal("admin", token_data["user_id"], db.admins, Admin)
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Admin not found or inactive"
         )
     
-    return Admin(**admin)
+    return admin
+CHAT_MESSAGE_MAX_LENGTH = int(os.environ.get("CHAT_MESSAGE_MAX_LENGTH", "4000"))
+
 class ChatMessage(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -377,7 +507,7 @@ class ChatMessageCreate(BaseModel):
     user_id: str
     sender_type: str
     sender_name: str
-    message: str
+    message: str = Field(..., min_length=1, max_length=CHAT_MESSAGE_MAX_LENGTH)
 
 # Shopping Cart Models (enhanced for users)
 class CartItem(BaseModel):
@@ -395,14 +525,140 @@ class Cart(BaseModel):
 
 class AddToCartRequest(BaseModel):
     product_id: str
-    quantity: int = 1
+    quantity: int = Field(default=1, gt=0)
+
+class CartQuantity(BaseModel):
+    product_id: str
+    quantity: int = Field(..., ge=0)  # 0 removes the line
+
+class SetCartQuantitiesRequest(BaseModel):
+    items: List[CartQuantity] = Field(..., min_length=1)
+
+# Synthetic Data Models
+class SyntheticDataSpec(BaseModel):
+    seed: int = 42
+    categories: int = Field(default=12, ge=1, le=1000)
+    brands: int = Field(default=60, ge=1, le=100_000)
+    products: int = Field(default=1000, ge=0, le=5_000_000)
+    users: int = Field(default=100, ge=0, le=1_000_000)
+    dealers: int = Field(default=20, ge=0, le=100_000)
+    carts: int = Field(default=25, ge=0, le=1_000_000)
+    quotes: int = Field(default=200, ge=0, le=5_000_000)
+    chat_threads: int = Field(default=50, ge=0, le=1_000_000)
+    mean_thread_length: float = Field(default=10, ge=1, le=1000)
+    stock_min: int = Field(default=0, ge=0)
+    stock_max: int = Field(default=500, ge=0)
+    out_of_stock_ratio: float = Field(default=0.05, ge=0, le=1)
+    replace: bool = False  # wipe the generated collections first
 
 # Utility functions
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
 
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
+# Checked when the account doesn't exist, so an unknown login costs the same
+# scrypt as a wrong password and response times don't reveal which accounts exist
+DUMMY_PASSWORD_HASH = f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${'00' * 16}${'00' * 64}"
+
+def verify_password(password: str, hashed: Optional[str]) -> bool:
+    if hashed is None:
+        verify_password(password, DUMMY_PASSWORD_HASH)
+        return False
+    if hashed.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, expected = hashed.split("$")
+            digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+        except ValueError:
+            # A malformed stored hash is a failed login, not a server error
+            return False
+        return hmac.compare_digest(digest.hex(), expected)
+    # Legacy unsalted SHA-256 hashes
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    return not hashed.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+# Password hashing pool
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "256"))
+
+class PasswordHasher:
+    """Runs password hashing off the event loop on a bounded thread pool.
+
+    scrypt releases the GIL, so at most ``workers`` hashes run in parallel
+    while catalog requests keep being served. Once ``max_queue`` jobs are
+    waiting, new ones are refused with a 503 instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Authentication service busy, please retry"
+                )
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+
+        def job():
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.total_seconds += time.perf_counter() - started
+                    self.in_flight -= 1
+                    self.completed += 1
+
+        return await loop.run_in_executor(self._executor, job)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: Optional[str]) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def upgrade_password_hash(collection, document: Dict, password: str):
+    """Transparently re-hash a legacy password after a successful login"""
+    if password_needs_rehash(document["password"]):
+        new_hash = await password_hasher.hash(password)
+        await collection.update_one(
+            {"id": document["id"], "password": document["password"]},
+            {"$set": {"password": new_hash}}
+        )
 
 def create_jwt_token(user_id: str, user_type: str = "user") -> str:
     payload = {
@@ -432,14 +688,14 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid or expired token"
         )
     
-    user = await db.users.find_one({"id": token_data["user_id"], "is_active": True})
+    user = await load_principal("user", token_data["user_id"], db.users, User)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found or inactive"
         )
     
-    return User(**user)
+    return user
 
 async def get_current_dealer(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dealer:
     token_data = verify_jwt_token(credentials.credentials)
@@ -449,47 +705,2668 @@ async def get_current_dealer(credentials: HTTPAuthorizationCredentials = Depends
             detail="Invalid or expired token"
         )
     
-    dealer = await db.dealers.find_one({"id": token_data["user_id"], "is_active": True})
+    dealer = await load_principal("dealer", token_data["user_id"], db.dealers, Dealer)
     if not dealer:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Dealer not found or inactive"
         )
     
-    return Dealer(**dealer)
+    return dealer
+
+# Request context
+# The matched route template ("GET /api/products/{product_id}") and Mongo
+# usage of the request being served; Motor copies both into the threads that
+# run Mongo commands
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+
+class MongoRequestStats:
+    """Mongo round trips, time and documents accumulated by one request"""
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        self.documents = 0
+        self.pool_wait_seconds = 0.0
+        self.by_command: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    def add(self, command: str, seconds: float, documents: int):
+        with self._lock:
+            self.commands += 1
+            self.seconds += seconds
+            self.documents += documents
+            totals = self.by_command.setdefault(command, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def add_pool_wait(self, seconds: float):
+        with self._lock:
+            self.pool_wait_seconds += seconds
+
+current_mongo_stats: ContextVar[Optional[MongoRequestStats]] = ContextVar("current_mongo_stats", default=None)
+
+ROUTE_TEMPLATE_CACHE_SIZE = int(os.environ.get("ROUTE_TEMPLATE_CACHE_SIZE", "4096"))
+
+def route_template(scope: Dict) -> str:
+    # Needed before routing runs (it labels the in-flight gauge and every Mongo
+    # command), so Starlette's own match can't be reused; repeat paths skip the scan
+    return _route_template(scope["method"], scope["path"])
+
+@functools.lru_cache(maxsize=ROUTE_TEMPLATE_CACHE_SIZE)
+def _route_template(method: str, path: str) -> str:
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{method} {route.path}"
+    return f"{method} unmatched"
+
+class RequestContextMiddleware:
+    """ASGI middleware setting the request context and recording its Mongo usage"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_template(scope)
+        stats = MongoRequestStats()
+        outcome = RequestOutcome()
+        
+        async def send_observed(message):
+            if message["type"] == "http.response.start":
+                outcome.status = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        outcome.streaming = True
+            elif message["type"] == "http.response.body":
+                outcome.size += len(message.get("body", b""))
+            await send(message)
+        
+        route_token = current_route.set(route)
+        stats_token = current_mongo_stats.set(stats)
+        HTTP_REQUESTS_IN_FLIGHT.inc((route,))
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            duration = time.perf_counter() - started
+            current_route.reset(route_token)
+            current_mongo_stats.reset(stats_token)
+            HTTP_REQUESTS_IN_FLIGHT.dec((route,))
+            observe_request(route, outcome, duration, stats)
+
+# Prometheus metrics
+# Hand-rolled counters and histograms rendered in the Prometheus text format
+# on /metrics. Values are per worker process, like any Prometheus target.
+# Route templates and query counts describe the API, so /metrics stays off
+# (404) until METRICS_TOKEN is set and scrapers send it as a bearer token.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+DOCUMENT_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+def format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Counter:
+    metric_type = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        """A consistent copy of every series, safe to iterate while others write"""
+        with self._lock:
+            return dict(self.values)
+
+    def render(self) -> List[str]:
+        values = self.snapshot().items()
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{self.name}{format_labels(self.label_names, labels)} {value}" for labels, value in values)
+        return lines
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [count per bucket (cumulative)..., sum, count]
+        self.values: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value: float, labels: Tuple = ()):
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(series)) for labels, series in self.values.items()]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bucket_names = (*self.label_names, "le")
+        for labels, series in values:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{format_labels(bucket_names, (*labels, bound))} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(bucket_names, (*labels, '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+METRICS: list = []
+
+MONGO_COMMANDS = Counter("mongo_commands_total", "MongoDB commands issued", ("route", "command"))
+MONGO_COMMAND_FAILURES = Counter("mongo_command_failures_total", "MongoDB commands that failed", ("route", "command"))
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round-trip time", ("command",), DURATION_BUCKETS
+)
+MONGO_DOCUMENTS_RETURNED = Counter("mongo_documents_returned_total", "Documents returned by MongoDB", ("route",))
+MONGO_POOL_CHECKOUT_SECONDS = Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time waiting to check a connection out of the pool", (), POOL_WAIT_BUCKETS
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter("mongo_pool_checkout_failures_total", "Failed connection checkouts", ("reason",))
+REQUEST_MONGO_COMMANDS = Histogram(
+    "http_request_mongo_commands", "MongoDB commands per HTTP request", ("route",), COUNT_BUCKETS
+)
+REQUEST_MONGO_SECONDS = Histogram(
+    "http_request_mongo_seconds", "Time spent in MongoDB per HTTP request", ("route",), DURATION_BUCKETS
+)
+REQUEST_MONGO_DOCUMENTS = Histogram(
+    "http_request_mongo_documents", "Documents returned by MongoDB per HTTP request", ("route",), DOCUMENT_BUCKETS
+)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests served", ("route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ("route",))
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency (event streams excluded)", ("route",), DURATION_BUCKETS
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "http_response_size_bytes", "HTTP response body size", ("route",), (100, 1000, 10000, 100000, 1000000, 10000000)
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Delay of a timer on the event loop beyond its deadline", (), DURATION_BUCKETS
+)
+EVENT_LOOP_STALLS = Counter("event_loop_stalls_total", "Event loop stalls over the threshold", ("handler",))
+
+def reply_document_count(command_name: str, reply) -> int:
+    """Number of documents a command reply carries back to the app"""
+    cursor = reply.get("cursor") if reply else None
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name == "findAndModify":
+        return 1 if reply.get("value") else 0
+    return 0
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Attributes every command to the current route and request"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        documents = reply_document_count(event.command_name, event.reply)
+        self._record(event.command_name, event.duration_micros / 1e6, documents)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc((current_route.get(), event.command_name))
+        self._record(event.command_name, event.duration_micros / 1e6, 0)
+
+    def _record(self, command: str, seconds: float, documents: int):
+        route = current_route.get()
+        MONGO_COMMANDS.inc((route, command))
+        MONGO_COMMAND_SECONDS.observe(seconds, (command,))
+        if documents:
+            MONGO_DOCUMENTS_RETURNED.inc((route,), documents)
+        stats = current_mongo_stats.get()
+        if stats is not None:
+            stats.add(command, seconds, documents)
+
+class MongoPoolMetricsListener:
+    """Times connection checkouts; start and finish happen on the same thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is None:
+            return
+        self._local.started = None
+        waited = time.perf_counter() - started
+        MONGO_POOL_CHECKOUT_SECONDS.observe(waited)
+        stats = current_mongo_stats.get()
+        if stats is not None:
+            stats.add_pool_wait(waited)
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        MONGO_POOL_CHECKOUT_FAILURES.inc((str(event.reason),))
+
+mongo_events.command_listeners.append(MongoMetricsListener())
+mongo_events.pool_listeners.append(MongoPoolMetricsListener())
+
+# Request latency
+# Recent latencies per route for exact p50/p95/p99 on /admin/performance, and
+# a log line with the Mongo breakdown for any request over the threshold
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "1.0"))
+LATENCY_SAMPLE_SIZE = int(os.environ.get("LATENCY_SAMPLE_SIZE", "1024"))
+
+route_latencies: Dict[str, deque] = {}
+
+class RequestOutcome:
+    def __init__(self):
+        self.status = 500
+        self.size = 0
+        self.streaming = False
+
+def observe_request(route: str, outcome: RequestOutcome, duration: float, stats: MongoRequestStats):
+    HTTP_REQUESTS.inc((route, str(outcome.status)))
+    HTTP_RESPONSE_BYTES.observe(outcome.size, (route,))
+    REQUEST_MONGO_COMMANDS.observe(stats.commands, (route,))
+    REQUEST_MONGO_SECONDS.observe(stats.seconds, (route,))
+    REQUEST_MONGO_DOCUMENTS.observe(stats.documents, (route,))
+    if outcome.streaming:
+        # An event stream's duration is its connection lifetime, not latency
+        return
+    HTTP_REQUEST_SECONDS.observe(duration, (route,))
+    samples = route_latencies.get(route)
+    if samples is None:
+        samples = route_latencies[route] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+    samples.append(duration)
+    if duration >= SLOW_REQUEST_SECONDS:
+        breakdown = ", ".join(
+            f"{command} x{count} {seconds * 1000:.1f}ms" for command, (count, seconds) in sorted(stats.by_command.items())
+        )
+        logger.warning(
+            f"Slow request: {route} -> {outcome.status} in {duration * 1000:.1f}ms; "
+            f"mongo {stats.commands} commands {stats.seconds * 1000:.1f}ms "
+            f"(pool wait {stats.pool_wait_seconds * 1000:.1f}ms) [{breakdown}]; {outcome.size} bytes"
+        )
+
+def latency_quantiles(samples) -> Dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    
+    def quantile(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+    
+    return {"count": len(ordered), "p50_ms": quantile(0.5), "p95_ms": quantile(0.95), "p99_ms": quantile(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+# Event loop lag monitor
+# A timer task measures how late the loop wakes it up. A watchdog thread
+# notices when that timer stops ticking and captures the loop thread's stack
+# while it is still blocked, naming the endpoint on it.
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.1"))
+EVENT_LOOP_STALL_SECONDS = float(os.environ.get("EVENT_LOOP_STALL_SECONDS", "1.0"))
+# Every stall is counted and kept for /admin/performance, but a handler's
+# stack is logged at most once per interval so a busy worker can't flood the logs
+EVENT_LOOP_STALL_LOG_INTERVAL_SECONDS = float(os.environ.get("EVENT_LOOP_STALL_LOG_INTERVAL_SECONDS", "60"))
+EVENT_LOOP_STACK_DEPTH = 20
+
+_endpoint_routes: Dict = {}
+
+def handler_for_frame(frame) -> Optional[str]:
+    """The route whose endpoint is on this stack, else the innermost function of this module"""
+    if not _endpoint_routes:
+        for route in app.routes:
+            if isinstance(route, APIRoute):
+                _endpoint_routes[route.endpoint.__code__] = f"{','.join(sorted(route.methods))} {route.path}"
+    innermost = None
+    while frame is not None:
+        if frame.f_code in _endpoint_routes:
+            return _endpoint_routes[frame.f_code]
+        if innermost is None and frame.f_code.co_filename == __file__:
+            innermost = f"{frame.f_code.co_name} (line {frame.f_lineno})"
+        frame = frame.f_back
+    return innermost
+
+class EventLoopMonitor:
+    def __init__(self, interval: float, stall_threshold: float):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.heartbeat = time.monotonic()
+        self.running = False
+        self.loop_thread_id: Optional[int] = None
+        self.recent_stalls: deque = deque(maxlen=20)
+        self._watchdog: Optional[threading.Thread] = None
+        # handler -> [monotonic time its stack was last logged, stalls not logged since]
+        self._stall_logs: Dict[str, List] = {}
+
+    async def run(self):
+        """Background job ticking the heartbeat and recording loop lag"""
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.running = True
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+            self._watchdog.start()
+        try:
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                EVENT_LOOP_LAG_SECONDS.observe(max(0.0, now - started - self.interval))
+                self.heartbeat = now
+        finally:
+            self.running = False
+
+    def _watch(self):
+        reported_heartbeat = None
+        while True:
+            time.sleep(self.interval)
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval
+            if not self.running or stalled_for < self.stall_threshold or heartbeat == reported_heartbeat:
+                continue
+            # Report each stall once, while the loop is still stuck in it
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            handler = handler_for_frame(frame) or "unknown"
+            stack = traceback.format_stack(frame)[-EVENT_LOOP_STACK_DEPTH:] if frame is not None else []
+            EVENT_LOOP_STALLS.inc((handler,))
+            self.recent_stalls.append({
+                "detected_at": datetime.now(timezone.utc).isoformat(),
+                "stalled_for_ms": round(stalled_for * 1000, 1),
+                "handler": handler,
+                "stack": stack
+            })
+            self._log_stall(handler, stalled_for, stack)
+
+    def _log_stall(self, handler: str, stalled_for: float, stack: List[str]):
+        now = time.monotonic()
+        logged = self._stall_logs.get(handler)
+        if logged is not None and now - logged[0] < EVENT_LOOP_STALL_LOG_INTERVAL_SECONDS:
+            logged[1] += 1
+            return
+        suppressed = f" ({logged[1]} more since last logged)" if logged and logged[1] else ""
+        self._stall_logs[handler] = [now, 0]
+        logger.warning(f"Event loop blocked for {stalled_for * 1000:.0f}ms+ in {handler}{suppressed}:\n{''.join(stack)}")
+
+event_loop_monitor = EventLoopMonitor(EVENT_LOOP_LAG_INTERVAL_SECONDS, EVENT_LOOP_STALL_SECONDS)
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(default=None)):
+    """Prometheus scrape endpoint, served only with METRICS_TOKEN set and sent as a bearer token"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Query advisor
+# Dev-mode only: explains every distinct query shape per route once and flags
+# winning plans with a COLLSCAN or an in-memory SORT
+QUERY_ADVISOR_ENABLED = os.environ.get("QUERY_ADVISOR", "false").lower() in ("1", "true", "yes")
+QUERY_ADVISOR_MAX_SHAPES = int(os.environ.get("QUERY_ADVISOR_MAX_SHAPES", "2000"))
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Session and transport fields that are not part of the query and cannot be explained
+EXPLAIN_STRIPPED_FIELDS = {
+    "lsid", "$clusterTime", "$db", "$readPreference", "txnNumber", "startTransaction",
+    "autocommit", "readConcern", "writeConcern", "apiVersion", "apiStrict", "apiDeprecationErrors"
+}
+SHAPE_IGNORED_FIELDS = EXPLAIN_STRIPPED_FIELDS | {"cursor", "batchSize", "singleBatch", "limit", "skip", "ordered", "comment", "maxTimeMS"}
+
+def query_shape(value):
+    """Replace literal values with '?' so queries differing only in values compare equal"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return "?"
+
+def winning_plan_stages(explain: Dict) -> set:
+    """Collect stage names from the winning plan(s) of an explain result"""
+    stages = set()
+    
+    def collect(node, in_winning_plan: bool):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "rejectedPlans":
+                    continue
+                if in_winning_plan and key == "stage":
+                    stages.add(value)
+                collect(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                collect(item, in_winning_plan)
+    
+    collect(explain, False)
+    # A $sort the planner could not push down runs in memory inside the pipeline
+    if any(isinstance(stage, dict) and "$sort" in stage for stage in explain.get("stages", [])):
+        stages.add("SORT")
+    return stages
+
+class QueryAdvisor(monitoring.CommandListener):
+    """Command listener recording query shapes per route and explaining each new one.
+
+    Explains run on a separate synchronous client in a worker thread, so they
+    never block the event loop and are not observed by this listener.
+    """
+
+    def __init__(self, max_shapes: int):
+        self.max_shapes = max_shapes
+        self.shapes: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+    def started(self, event):
+        name = event.command_name
+        if name not in EXPLAINABLE_COMMANDS:
+            return
+        command = dict(event.command)
+        if name == "aggregate" and any("$changeStream" in stage for stage in command.get("pipeline", [])):
+            return
+        # Explain the first statement of a bulk write; the rest usually share its shape
+        for statements in ("updates", "deletes"):
+            if statements in command:
+                command[statements] = command[statements][:1]
+        
+        shape = query_shape({k: v for k, v in command.items() if k not in SHAPE_IGNORED_FIELDS})
+        key = (current_route.get(), event.database_name, json.dumps(shape, sort_keys=True))
+        with self._lock:
+            entry = self.shapes.get(key)
+            if entry is not None:
+                entry["count"] += 1
+                return
+            if len(self.shapes) >= self.max_shapes:
+                return
+            entry = self.shapes[key] = {
+                "route": key[0],
+                "collection": command.get(name),
+                "command": name,
+                "shape": shape,
+                "count": 1,
+                "plan": None,
+                "flags": []
+            }
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._explain_loop, name="query-advisor", daemon=True)
+                self._worker.start()
+        explain = {k: v for k, v in command.items() if k not in EXPLAIN_STRIPPED_FIELDS}
+        self._queue.put((entry, event.database_name, explain))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def _explain_loop(self):
+        explain_client = MongoClient(mongo_url)
+        while True:
+            entry, database, command = self._queue.get()
+            try:
+                result = explain_client[database].command({"explain": command, "verbosity": "queryPlanner"})
+            except Exception as e:
+                entry["error"] = str(e)
+                continue
+            stages = winning_plan_stages(result)
+            entry["plan"] = sorted(stages)
+            entry["flags"] = [flag for stage, flag in (("COLLSCAN", "COLLSCAN"), ("SORT", "IN_MEMORY_SORT")) if stage in stages]
+            if entry["flags"]:
+                logger.warning(
+                    f"Query advisor: {entry['route']} runs {entry['command']} on {entry['collection']} "
+                    f"with {', '.join(entry['flags'])}: {json.dumps(entry['shape'])}"
+                )
+
+    def report(self) -> List[Dict]:
+        with self._lock:
+            entries = [dict(entry) for entry in self.shapes.values()]
+        return sorted(entries, key=lambda entry: (not entry["flags"], -entry["count"]))
+
+query_advisor = QueryAdvisor(QUERY_ADVISOR_MAX_SHAPES)
+if QUERY_ADVISOR_ENABLED:
+    mongo_events.command_listeners.append(query_advisor)
+
+# Fast JSON responses
+# When enabled, list endpoints shape stored documents without running them
+# through Pydantic and return an ORJSONResponse, which FastAPI sends as-is
+# instead of validating it against response_model a second time
+FAST_JSON_RESPONSES = os.environ.get("FAST_JSON_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+_trusted_fields: Dict[type, list] = {}
+
+def trusted_dump(model: type, doc: Dict) -> Dict:
+    """Shape a stored document the way ``model(**doc).dict()`` would, without validating it"""
+    fields = _trusted_fields.get(model)
+    if fields is None:
+        fields = _trusted_fields[model] = list(model.model_fields.items())
+    shaped = {}
+    for name, field in fields:
+        if name in doc:
+            shaped[name] = doc[name]
+        elif not field.is_required():
+            shaped[name] = field.get_default(call_default_factory=True)
+    if model.model_config.get("extra") == "allow":
+        for name, value in doc.items():
+            if name not in shaped and name != "_id":
+                shaped[name] = value
+    return shaped
+
+def shape_documents(model: type, docs: List[Dict]) -> list:
+    """Model instances normally, plain dicts on the fast path"""
+    if FAST_JSON_RESPONSES:
+        return [trusted_dump(model, doc) for doc in docs]
+    return [model(**doc) for doc in docs]
+
+def list_response(payload, response: Optional[Response] = None):
+    """Return payload from shape_documents, skipping response_model validation on the fast path
+
+    Headers set on the injected ``response`` are carried over, since FastAPI
+    ignores it once an endpoint returns its own Response.
+    """
+    if not FAST_JSON_RESPONSES:
+        return payload
+    fast_response = ORJSONResponse(payload)
+    if response is not None:
+        for name, value in response.headers.items():
+            if name not in ("content-length", "content-type"):
+                fast_response.headers[name] = value
+    return fast_response
+
+# Catalog read cache
+CATALOG_CACHE_TTL_SECONDS = float(os.environ.get("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_MAX_ENTRIES", "512"))
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after a fixed TTL"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class CatalogCache(TTLCache):
+    """Cache for catalog reads, keyed by the catalog version at load time.
+
+    Admin writes to products, categories or brands call ``bump_version``, so
+    any entry computed against an older catalog is never served again.
+    Concurrent misses for the same key share a single loader call.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        super().__init__(max_entries, ttl_seconds)
+        self.version = 0
+        self.modified_at = time.time()
+        # Cluster-wide catalog version from the meta document, shared by every worker
+        self.shared_version = 0
+        self.shared_modified_at = 0.0
+        self._pending: Dict[object, asyncio.Future] = {}
+
+    def bump_version(self):
+        self.version += 1
+        self.modified_at = time.time()
+        self.clear()
+
+    def observe_shared_version(self, version: int, modified_at: Optional[datetime]):
+        # Only forward: a poll read before this worker's own bump mustn't undo it
+        if version <= self.shared_version:
+            return
+        self.shared_version = version
+        if modified_at is not None:
+            # Motor hands back naive UTC datetimes
+            self.shared_modified_at = modified_at.replace(tzinfo=modified_at.tzinfo or timezone.utc).timestamp()
+
+    async def get_or_load(self, key, loader):
+        versioned_key = (self.version, key)
+        value = self.get(versioned_key)
+        if value is not _MISSING:
+            return value
+
+        pending = self._pending.get(versioned_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[versioned_key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            # A write during the load bumped the version; don't keep stale data
+            if versioned_key[0] == self.version:
+                self.set(versioned_key, value)
+            return value
+        finally:
+            self._pending.pop(versioned_key, None)
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "version": self.version}
+
+catalog_cache = CatalogCache(CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_TTL_SECONDS)
+
+# Authenticated principal cache
+# Upper bound on how long a deactivation made on another worker can go unnoticed
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.environ.get("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+principal_cache = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
+
+async def load_principal(user_type: str, user_id: str, collection, model):
+    """Return the active user, dealer or admin for a token, served from cache when fresh"""
+    key = (user_type, user_id)
+    principal = principal_cache.get(key)
+    if principal is _MISSING:
+        document = await collection.find_one({"id": user_id, "is_active": True})
+        if not document:
+            return None
+        principal = model(**document)
+        principal_cache.set(key, principal)
+    return principal
+
+def invalidate_principal(user_type: str, user_id: str):
+    """Forget a cached principal after its account status changes"""
+    principal_cache.invalidate((user_type, user_id))
+    publish_cache_version("principals")
+
+def invalidate_principals():
+    """Forget every cached principal after accounts are replaced wholesale"""
+    principal_cache.clear()
+    publish_cache_version("principals")
+
+# Batched document loading
+class DocumentLoader:
+    """Request-scoped loader resolving lookups by key with one ``$in`` query.
+
+    Each key is fetched at most once per loader, so handlers that need the
+    same documents again reuse them. Create one loader per collection per
+    request; it is not meant to outlive it.
+    """
+
+    def __init__(self, collection, key: str = "id", projection: Optional[Dict] = None):
+        self.collection = collection
+        self.key = key
+        self.projection = projection
+        self._loaded: Dict[str, Optional[Dict]] = {}
+
+    async def load_many(self, keys: List[str]) -> List[Optional[Dict]]:
+        """Documents in the order of ``keys``, None where missing; one query for unseen keys"""
+        missing = [key for key in dict.fromkeys(keys) if key not in self._loaded]
+        if missing:
+            docs = await self.collection.find(
+                {self.key: {"$in": missing}}, self.projection
+            ).to_list(length=None)
+            found = {doc[self.key]: doc for doc in docs}
+            self._loaded.update((key, found.get(key)) for key in missing)
+        return [self._loaded[key] for key in keys]
+
+def invalidate_catalog():
+    """Drop every cached catalog read after a product, category or brand write"""
+    catalog_cache.bump_version()
+    # Move this worker's validators on right away; until the publish lands the
+    # old shared version would otherwise still earn a stale 304
+    catalog_cache.observe_shared_version(catalog_cache.shared_version + 1, datetime.now(timezone.utc))
+    publish_cache_version("catalog")
+
+# HTTP conditional caching
+# Catalog validators come from the shared catalog version in the meta
+# document, which every worker tracks (see cache coherence below), so a
+# repeat request is answered with 304 before any Mongo work whichever worker
+# it lands on. The TTL window keeps validators from outliving what
+# catalog_cache itself would serve (e.g. stock changes from reservations);
+# with caching off there is no such window and no validators are sent.
+CATALOG_CACHE_CONTROL = {
+    "products": "public, max-age=30",
+    "product": "public, max-age=60",
+    "shelves": "public, max-age=60",
+    "categories": "public, max-age=300",
+    "brands": "public, max-age=300",
+    "with-counts": "public, max-age=60",
+    **json.loads(os.environ.get("CATALOG_CACHE_CONTROL", "{}"))
+}
+
+def catalog_validators(path: str = "") -> Optional[Tuple[str, datetime]]:
+    """ETag and Last-Modified for a catalog URL as the cluster currently serves it
+
+    The ETag names the path too, so one URL's tag can't validate another's
+    (e.g. a product id that doesn't exist).
+    """
+    if CATALOG_CACHE_TTL_SECONDS <= 0:
+        return None
+    window = int(time.time() // CATALOG_CACHE_TTL_SECONDS)
+    modified_at = max(catalog_cache.shared_modified_at, window * CATALOG_CACHE_TTL_SECONDS)
+    resource = hashlib.sha1(path.encode()).hexdigest()[:12]
+    etag = f'W/"{catalog_cache.shared_version}-{window}-{resource}"'
+    return etag, datetime.fromtimestamp(int(modified_at), timezone.utc)
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no ETags were sent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as required for If-None-Match
+        opaque = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def catalog_conditional(route: str):
+    """Dependency adding catalog validators and Cache-Control to a route's response.
+
+    Resolves to a ready 304 response when the client's copy is current,
+    otherwise to None and the endpoint runs as usual.
+    """
+    def dependency(request: Request, response: Response) -> Optional[Response]:
+        validators = catalog_validators(request.url.path)
+        if validators is None:
+            response.headers["Cache-Control"] = CATALOG_CACHE_CONTROL[route]
+            return None
+        etag, last_modified = validators
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            "Cache-Control": CATALOG_CACHE_CONTROL[route]
+        }
+        if is_not_modified(request, etag, last_modified):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+        return None
+    return dependency
+
+# Cross-worker cache coherence
+# Each worker tails a change stream over the cached collections and the
+# shared version counters, which every invalidate_* call bumps, and applies
+# the invalidations locally. Updates that only move stock are skipped, just
+# as they are locally: catalog reads tolerate stock that is a TTL stale, and
+# reserve_stock bumps the version itself when a product sells out. Where
+# change streams are unavailable (standalone mongod) workers poll the
+# version counters instead.
+CACHE_SYNC_MODE = os.environ.get("CACHE_SYNC_MODE", "auto")  # auto | change_stream | poll | off
+CACHE_SYNC_POLL_INTERVAL_SECONDS = float(os.environ.get("CACHE_SYNC_POLL_INTERVAL_SECONDS", "2"))
+CACHE_SYNC_TOKEN_SAVE_SECONDS = float(os.environ.get("CACHE_SYNC_TOKEN_SAVE_SECONDS", "5"))
+CACHE_SYNC_RETRY_SECONDS = 5
+CACHE_VERSIONS_ID = "cache_versions"
+CACHE_SYNC_TOKEN_ID = "cache_sync_resume_token"
+CATALOG_COLLECTIONS = ("products", "categories", "brands")
+PRINCIPAL_COLLECTIONS = {"users": "user", "dealers": "dealer", "admins": "admin"}
+# Fields written by stock reservations; updates touching only these leave cached reads valid
+STOCK_ONLY_FIELDS = {"stock_quantity", "in_stock", "sold_out_by_reservations", "updated_at"}
+# $changeStream on a standalone server; resume token no longer in the oplog
+CHANGE_STREAM_UNSUPPORTED_CODES = {40573}
+CHANGE_STREAM_HISTORY_LOST_CODES = {260, 280, 286}
+
+cache_sync_state = {"mode": "starting", "events": 0, "restarts": 0, "last_event_at": None}
+_cache_version_tasks: set = set()
+
+def publish_cache_version(name: str):
+    """Bump a shared cache version so other workers notice a local invalidation"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_publish_cache_version(name))
+    _cache_version_tasks.add(task)
+    task.add_done_callback(_cache_version_tasks.discard)
+
+async def _publish_cache_version(name: str):
+    try:
+        versions = await db.meta.find_one_and_update(
+            {"_id": CACHE_VERSIONS_ID},
+            {"$inc": {name: 1}, "$set": {f"{name}_modified_at": datetime.now(timezone.utc)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except PyMongoError as e:
+        logger.warning(f"Publishing cache version {name} failed: {e}")
+        return
+    observe_cache_versions(versions or {})
+
+def observe_cache_versions(versions: Dict):
+    """Track the shared catalog version the HTTP validators are built from"""
+    if "catalog" in versions:
+        catalog_cache.observe_shared_version(versions["catalog"], versions.get("catalog_modified_at"))
+
+def invalidate_local_caches():
+    """Drop everything this worker caches, for when invalidations may have been missed"""
+    catalog_cache.bump_version()
+    principal_cache.clear()
+
+def apply_cache_change(change: Dict):
+    """Apply one change stream event to this worker's caches"""
+    cache_sync_state["events"] += 1
+    cache_sync_state["last_event_at"] = datetime.now(timezone.utc)
+    collection = change.get("ns", {}).get("coll")
+    updated_fields = {field.split(".")[0] for field in change.get("updatedFields") or []}
+    if collection == "meta":
+        observe_cache_versions(change.get("versions") or {})
+        if change.get("operationType") == "update":
+            if "catalog" in updated_fields:
+                catalog_cache.bump_version()
+            if "principals" in updated_fields:
+                principal_cache.clear()
+        else:
+            invalidate_local_caches()
+    elif collection in CATALOG_COLLECTIONS:
+        stock_only = (
+            change.get("operationType") == "update"
+            and not change.get("removedFields")
+            and not change.get("truncatedArrays")
+            and updated_fields <= STOCK_ONLY_FIELDS
+        )
+        if not stock_only:
+            catalog_cache.bump_version()
+    elif collection in PRINCIPAL_COLLECTIONS:
+        principal_id = (change.get("fullDocument") or {}).get("id")
+        if principal_id:
+            principal_cache.invalidate((PRINCIPAL_COLLECTIONS[collection], principal_id))
+        else:
+            # Updates and deletes only carry the Mongo _id, not the id the cache is keyed by
+            principal_cache.clear()
+    else:
+        # Invalidate events (dropped database or collection) end the stream
+        invalidate_local_caches()
+
+async def watch_cache_changes():
+    """Tail the change stream until it fails, persisting the resume token as it goes"""
+    saved = await db.meta.find_one({"_id": CACHE_SYNC_TOKEN_ID})
+    pipeline = [
+        {"$match": {"$or": [
+            {"ns.coll": {"$in": [*CATALOG_COLLECTIONS, *PRINCIPAL_COLLECTIONS]}},
+            {"ns.coll": "meta", "documentKey._id": CACHE_VERSIONS_ID}
+        ]}},
+        # Only the names of updated fields travel, never their values
+        {"$project": {
+            "operationType": 1,
+            "ns": 1,
+            "fullDocument.id": 1,
+            "updatedFields": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+                "in": "$$this.k"
+            }},
+            "removedFields": "$updateDescription.removedFields",
+            "truncatedArrays": "$updateDescription.truncatedArrays",
+            # Counter values for the version document; inserts carry the whole (small) document
+            "versions": {"$cond": [
+                {"$eq": ["$ns.coll", "meta"]},
+                {"$ifNull": ["$updateDescription.updatedFields", "$fullDocument"]},
+                "$$REMOVE"
+            ]}
+        }}
+    ]
+    async with db.watch(pipeline, start_after=saved["token"] if saved else None) as stream:
+        cache_sync_state["mode"] = "change_stream"
+        saved_at = time.monotonic()
+        async for change in stream:
+            apply_cache_change(change)
+            # An invalidate event closes the stream; save its token so startAfter skips past it
+            if change.get("operationType") == "invalidate" or time.monotonic() - saved_at >= CACHE_SYNC_TOKEN_SAVE_SECONDS:
+                await db.meta.update_one(
+                    {"_id": CACHE_SYNC_TOKEN_ID},
+                    {"$set": {"token": stream.resume_token, "saved_at": datetime.now(timezone.utc)}},
+                    upsert=True
+                )
+                saved_at = time.monotonic()
+
+async def poll_cache_versions():
+    """Fallback sync: clear local caches whenever a shared version counter moves"""
+    cache_sync_state["mode"] = "poll"
+    seen = None
+    while True:
+        try:
+            versions = await db.meta.find_one({"_id": CACHE_VERSIONS_ID}) or {}
+            observe_cache_versions(versions)
+            current = (versions.get("catalog", 0), versions.get("principals", 0))
+            if seen is not None:
+                if current[0] != seen[0]:
+                    catalog_cache.bump_version()
+                if current[1] != seen[1]:
+                    principal_cache.clear()
+            seen = current
+        except PyMongoError as e:
+            logger.warning(f"Cache version poll failed: {e}")
+        await asyncio.sleep(CACHE_SYNC_POLL_INTERVAL_SECONDS)
+
+async def run_cache_sync():
+    """Background job keeping this worker's caches coherent with writes made elsewhere"""
+    try:
+        observe_cache_versions(await db.meta.find_one({"_id": CACHE_VERSIONS_ID}) or {})
+    except PyMongoError as e:
+        logger.warning(f"Reading shared cache versions failed: {e}")
+    if CACHE_SYNC_MODE == "off":
+        cache_sync_state["mode"] = "off"
+        return
+    if CACHE_SYNC_MODE != "poll":
+        while True:
+            try:
+                await watch_cache_changes()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_HISTORY_LOST_CODES:
+                    logger.warning(f"Cache sync resume token expired, starting from now: {e}")
+                    await db.meta.delete_one({"_id": CACHE_SYNC_TOKEN_ID})
+                elif e.code in CHANGE_STREAM_UNSUPPORTED_CODES and CACHE_SYNC_MODE == "auto":
+                    logger.info("Change streams unavailable, falling back to cache version polling")
+                    break
+                else:
+                    logger.warning(f"Cache sync change stream failed: {e}")
+                    await asyncio.sleep(CACHE_SYNC_RETRY_SECONDS)
+            except Exception as e:
+                logger.warning(f"Cache sync change stream failed: {e}")
+                await asyncio.sleep(CACHE_SYNC_RETRY_SECONDS)
+            # Events may have been missed while the stream was down
+            cache_sync_state["restarts"] += 1
+            invalidate_local_caches()
+    await poll_cache_versions()
+
+# Product search
+PRODUCT_SEARCH_INDEX = "product_search"
+
+def specification_terms(specifications: Optional[dict]) -> List[str]:
+    """Flatten a specifications dict into strings the text index can cover"""
+    return [f"{key} {value}" for key, value in (specifications or {}).items()]
+
+def build_product_filter(
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    in_stock: Optional[bool] = None
+) -> Dict:
+    """Build the Mongo filter shared by the product listing endpoints"""
+    filter_query = {}
+    
+    if category:
+        filter_query["category"] = category
+    if brand:
+        filter_query["brand"] = brand
+    if min_price is not None:
+        filter_query["price"] = {"$gte": min_price}
+    if max_price is not None:
+        if "price" in filter_query:
+            filter_query["price"]["$lte"] = max_price
+        else:
+            filter_query["price"] = {"$lte": max_price}
+    if search:
+        filter_query["$text"] = {"$search": search}
+    if in_stock is not None:
+        filter_query["in_stock"] = in_stock
+    
+    return filter_query
+
+def find_products(filter_query: Dict, projection: Optional[Dict] = None):
+    """Return a products cursor, ranked by relevance when the filter has a text search"""
+    if "$text" in filter_query:
+        # The score does not need projecting to sort on it, so it stays out of listings
+        return db.products.find(filter_query, projection).sort([("score", {"$meta": "textScore"})])
+    return db.products.find(filter_query, projection)
+
+# Listing projection
+# Listings fetch only the ProductSummary fields; fields=a,b adds more and
+# fields=all returns the full document
+PRODUCT_FIELDS_ALL = "all"
+
+def parse_product_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """Validate a ``fields=`` value into a sorted tuple of extra Product fields"""
+    if not fields:
+        return ()
+    if fields == PRODUCT_FIELDS_ALL:
+        return tuple(sorted(set(Product.model_fields) - set(ProductSummary.model_fields)))
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(Product.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown product fields: {', '.join(sorted(unknown))}"
+        )
+    return tuple(sorted(requested - set(ProductSummary.model_fields)))
+
+def product_projection(extra_fields: Tuple[str, ...] = ()) -> Dict:
+    """Mongo projection for ProductSummary plus the given extra fields"""
+    projection = {"_id": 0}
+    for field in (*ProductSummary.model_fields, *extra_fields):
+        projection[field] = 1
+    return projection
+
+# Keyset pagination
+# Sort name -> (field, direction); ties are broken by the unique product id
+PRODUCT_SORTS = {
+    "newest": ("created_at", -1),
+    "oldest": ("created_at", 1),
+    "price_asc": ("price", 1),
+    "price_desc": ("price", -1)
+}
+PRODUCT_SORT_PATTERN = "^(" + "|".join(PRODUCT_SORTS) + ")$"
+ESTIMATED_COUNT_CAP = 10000
+
+def encode_cursor(sort: str, document: Dict, direction: str) -> str:
+    """Build an opaque page token from the sort key of a boundary document"""
+    field, _ = PRODUCT_SORTS[sort]
+    value = document.get(field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    payload = json.dumps({"s": sort, "v": value, "id": document["id"], "d": direction}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["s"] not in PRODUCT_SORTS or payload["d"] not in ("next", "prev"):
+            raise ValueError("unknown sort or direction")
+        if isinstance(payload["v"], dict):
+            payload["v"] = datetime.fromisoformat(payload["v"]["$date"])
+        return payload
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+async def fetch_product_page(
+    filter_query: Dict,
+    sort: Optional[str],
+    cursor: Optional[str],
+    limit: int,
+    projection: Optional[Dict] = None
+) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """Fetch one page of products by keyset on (sort field, id).
+
+    Returns the documents plus next/prev tokens; a token is None when
+    there is no page in that direction. The sort encoded in the cursor
+    wins over the ``sort`` argument so tokens stay self-consistent.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    sort = position["s"] if position else (sort or "newest")
+    field, direction = PRODUCT_SORTS[sort]
+    backwards = position is not None and position["d"] == "prev"
+    if backwards:
+        direction = -direction
+    
+    query = filter_query
+    if position is not None:
+        op = "$gt" if direction == 1 else "$lt"
+        keyset = {"$or": [
+            {field: {op: position["v"]}},
+            {field: position["v"], "id": {op: position["id"]}}
+        ]}
+        query = {"$and": [filter_query, keyset]} if filter_query else keyset
+    
+    products = await db.products.find(query, projection).sort(
+        [(field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(length=None)
+    has_more = len(products) > limit
+    products = products[:limit]
+    if backwards:
+        products.reverse()
+    
+    if not products:
+        return products, None, None
+    # Paging backwards always leaves a page after this one, and vice versa
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else position is not None
+    next_cursor = encode_cursor(sort, products[-1], "next") if has_next else None
+    prev_cursor = encode_cursor(sort, products[0], "prev") if has_prev else None
+    return products, next_cursor, prev_cursor
+
+# Product facets
+PRICE_FACET_BOUNDARIES = [0, 50, 100, 250, 500, 1000, 2500]
+# The open top bucket gets an explicit bound so $bucket's default only
+# collects products without a usable price (missing, null, negative)
+PRICE_FACET_UPPER_BOUND = float("inf")
+PRICE_FACET_UNPRICED = "unpriced"
+
+async def compute_product_facets(filter_query: Dict) -> Dict:
+    """Count categories, brands, subcategories, stock and price buckets in one aggregation"""
+    pipeline = [{"$match": filter_query}] if filter_query else []
+    pipeline.append({
+        "$facet": {
+            "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            "brands": [{"$group": {"_id": "$brand", "count": {"$sum": 1}}}],
+            "subcategories": [
+                {"$group": {"_id": {"category": "$category", "subcategory": "$subcategory"}, "count": {"$sum": 1}}}
+            ],
+            "in_stock": [{"$group": {"_id": "$in_stock", "count": {"$sum": 1}}}],
+            "price_buckets": [
+                {
+                    "$bucket": {
+                        "groupBy": "$price",
+                        "boundaries": PRICE_FACET_BOUNDARIES + [PRICE_FACET_UPPER_BOUND],
+                        "default": PRICE_FACET_UNPRICED,
+                        "output": {"count": {"$sum": 1}}
+                    }
+                }
+            ]
+        }
+    })
+    
+    result = await db.products.aggregate(pipeline).to_list(1)
+    facets = result[0] if result else {}
+    
+    price_buckets = []
+    for bucket in facets.get("price_buckets", []):
+        if bucket["_id"] == PRICE_FACET_UNPRICED:
+            label, min_price, max_price = PRICE_FACET_UNPRICED, None, None
+        elif bucket["_id"] == PRICE_FACET_BOUNDARIES[-1]:
+            label, min_price, max_price = f"{PRICE_FACET_BOUNDARIES[-1]}+", PRICE_FACET_BOUNDARIES[-1], None
+        else:
+            index = PRICE_FACET_BOUNDARIES.index(bucket["_id"])
+            min_price, max_price = PRICE_FACET_BOUNDARIES[index], PRICE_FACET_BOUNDARIES[index + 1]
+            label = f"{min_price}-{max_price}"
+        price_buckets.append({"label": label, "min_price": min_price, "max_price": max_price, "count": bucket["count"]})
+    
+    return {
+        "categories": {row["_id"]: row["count"] for row in facets.get("categories", []) if row["_id"] is not None},
+        "brands": {row["_id"]: row["count"] for row in facets.get("brands", []) if row["_id"] is not None},
+        "subcategories": [
+            {"category": row["_id"].get("category"), "subcategory": row["_id"].get("subcategory"), "count": row["count"]}
+            for row in facets.get("subcategories", [])
+        ],
+        "in_stock": {
+            "in_stock": sum(row["count"] for row in facets.get("in_stock", []) if row["_id"] is True),
+            "out_of_stock": sum(row["count"] for row in facets.get("in_stock", []) if row["_id"] is not True)
+        },
+        "price_buckets": price_buckets
+    }
+
+async def get_product_facets(filter_query: Dict) -> Dict:
+    """Return facet counts for a filter, cached until the catalog changes"""
+    cache_key = ("facets", json.dumps(filter_query, sort_keys=True, default=str))
+    return await catalog_cache.get_or_load(cache_key, lambda: compute_product_facets(filter_query))
+
+# Dashboard counters
+STATS_RECONCILE_INTERVAL_SECONDS = float(os.environ.get("STATS_RECONCILE_INTERVAL_SECONDS", "600"))
+DASHBOARD_STATS_ID = "dashboard"
+TRACKED_QUOTE_STATUSES = {"pending": "pending_quotes", "approved": "approved_quotes"}
+
+# Counter name -> (collection, filter) used to recompute it from scratch
+DASHBOARD_COUNTERS = {
+    "total_users": ("users", {}),
+    "total_dealers": ("dealers", {}),
+    "pending_dealers": ("dealers", {"is_approved": False, "is_active": True}),
+    "approved_dealers": ("dealers", {"is_approved": True, "is_active": True}),
+    "total_quotes": ("quotes", {}),
+    "pending_quotes": ("quotes", {"status": "pending"}),
+    "approved_quotes": ("quotes", {"status": "approved"}),
+    "total_products": ("products", {}),
+    "total_categories": ("categories", {}),
+    "total_brands": ("brands", {}),
+    "chat_messages": ("chat_messages", {})
+}
+
+async def bump_dashboard_stats(**deltas: int):
+    """Apply counter deltas to the materialized dashboard stats document"""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    try:
+        await db.stats.update_one(
+            {"_id": DASHBOARD_STATS_ID},
+            {"$inc": deltas, "$set": {"updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    except Exception as e:
+        # The reconciliation job corrects any drift; never fail the write path over a counter
+        logger.warning(f"Failed to update dashboard stats {deltas}: {e}")
+
+def quote_status_deltas(old_status: Optional[str], new_status: Optional[str]) -> Dict[str, int]:
+    """Counter deltas for a quote moving from one status to another"""
+    deltas: Dict[str, int] = {}
+    if old_status == new_status:
+        return deltas
+    if old_status in TRACKED_QUOTE_STATUSES:
+        deltas[TRACKED_QUOTE_STATUSES[old_status]] = -1
+    if new_status in TRACKED_QUOTE_STATUSES:
+        deltas[TRACKED_QUOTE_STATUSES[new_status]] = 1
+    return deltas
+
+async def reconcile_dashboard_stats() -> Dict:
+    """Recompute every dashboard counter concurrently and overwrite the stats document"""
+    counts = await asyncio.gather(*(
+        db[collection].count_documents(filter_query) for collection, filter_query in DASHBOARD_COUNTERS.values()
+    ))
+    stats = dict(zip(DASHBOARD_COUNTERS, counts))
+    now = datetime.now(timezone.utc)
+    await db.stats.update_one(
+        {"_id": DASHBOARD_STATS_ID},
+        {"$set": {**stats, "updated_at": now, "reconciled_at": now}},
+        upsert=True
+    )
+    return stats
+
+async def run_stats_reconciliation():
+    """Background job that periodically corrects drift in the dashboard counters"""
+    while True:
+        try:
+            await reconcile_dashboard_stats()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Dashboard stats reconciliation failed: {e}")
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL_SECONDS)
+
+# Streaming exports
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_FORMAT_PATTERN = "^(json|ndjson|csv)$"
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def export_projection(fields: List[str]) -> Dict:
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+def _export_json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_export_json_default)
+    return value
+
+async def _export_chunks(cursor, fields: List[str], export_format: str, enrich_batch):
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue()
+    
+    batch = []
+    async for document in cursor.batch_size(EXPORT_BATCH_SIZE):
+        batch.append(document)
+        if len(batch) < EXPORT_BATCH_SIZE:
+            continue
+        yield await _render_export_batch(batch, fields, export_format, enrich_batch)
+        batch = []
+    if batch:
+        yield await _render_export_batch(batch, fields, export_format, enrich_batch)
+
+async def _render_export_batch(batch: List[Dict], fields: List[str], export_format: str, enrich_batch) -> str:
+    if enrich_batch is not None:
+        batch = await enrich_batch(batch)
+    if export_format == "ndjson":
+        return "".join(
+            json.dumps({field: document.get(field) for field in fields}, default=_export_json_default) + "\n"
+            for document in batch
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for document in batch:
+        writer.writerow([_export_value(document.get(field)) for field in fields])
+    return buffer.getvalue()
+
+def streaming_export(
+    cursor,
+    fields: List[str],
+    export_format: str,
+    filename: str,
+    enrich_batch: Optional[Callable[[List[Dict]], Awaitable[List[Dict]]]] = None
+) -> StreamingResponse:
+    """Stream a Motor cursor as NDJSON or CSV, one batch in memory at a time"""
+    return StreamingResponse(
+        _export_chunks(cursor, fields, export_format, enrich_batch),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+# Realtime chat delivery
+CHAT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("CHAT_STREAM_HEARTBEAT_SECONDS", "15"))
+CHAT_STREAM_QUEUE_SIZE = 256
+CHAT_STREAM_BACKFILL_PAGE_SIZE = 500
+
+class ChatBroker:
+    """In-process pub/sub fan-out of new chat messages to streaming subscribers.
+
+    Each subscriber gets a bounded queue. A subscriber that falls too far
+    behind is sent ``None`` and dropped; its client reconnects with
+    ``Last-Event-ID`` and backfills from Mongo instead.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._user_subscribers: Dict[str, set] = {}
+        self._admin_subscribers: set = set()
+
+    def subscribe(self, user_id: Optional[str] = None) -> asyncio.Queue:
+        """Subscribe to one user's conversation, or to all of them when ``user_id`` is None"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if user_id is None:
+            self._admin_subscribers.add(queue)
+        else:
+            self._user_subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, user_id: Optional[str] = None):
+        if user_id is None:
+            self._admin_subscribers.discard(queue)
+            return
+        subscribers = self._user_subscribers.get(user_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._user_subscribers[user_id]
+
+    def publish(self, message: Dict):
+        user_id = message["user_id"]
+        for queue in list(self._user_subscribers.get(user_id, ())):
+            self._deliver(queue, message, user_id)
+        for queue in list(self._admin_subscribers):
+            self._deliver(queue, message, None)
+
+    def _deliver(self, queue: asyncio.Queue, message: Dict, user_id: Optional[str]):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.unsubscribe(queue, user_id)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    def stats(self) -> Dict:
+        return {
+            "user_streams": sum(len(queues) for queues in self._user_subscribers.values()),
+            "admin_streams": len(self._admin_subscribers)
+        }
+
+chat_broker = ChatBroker(CHAT_STREAM_QUEUE_SIZE)
+
+def format_chat_event(message: Dict) -> str:
+    payload = json.dumps({k: v for k, v in message.items() if k != "_id"}, default=_export_json_default)
+    return f"id: {message['id']}\nevent: message\ndata: {payload}\n\n"
+
+async def _chat_messages_from(filter_query: Dict, anchor_id: Optional[str], direction: int, limit: int) -> List[Dict]:
+    """Up to ``limit`` messages after (direction 1) or before (-1) an anchor message,
+    walking the (user_id, created_at, id) index; returned in that walk order"""
+    query = filter_query
+    if anchor_id is not None:
+        anchor = await db.chat_messages.find_one({"id": anchor_id}, {"created_at": 1, "id": 1})
+        if anchor is None:
+            return []
+        op = "$gt" if direction == 1 else "$lt"
+        query = {"$and": [filter_query, {"$or": [
+            {"created_at": {op: anchor["created_at"]}},
+            {"created_at": anchor["created_at"], "id": {op: anchor["id"]}}
+        ]}]}
+    return await db.chat_messages.find(query, {"_id": 0}).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit).to_list(length=None)
+
+async def chat_messages_after(filter_query: Dict, last_event_id: Optional[str], limit: int) -> List[Dict]:
+    """Messages newer than ``last_event_id`` in (created_at, id) order, for stream resumption"""
+    return await _chat_messages_from(filter_query, last_event_id, 1, limit)
+
+async def fetch_chat_history(
+    user_id: str,
+    before: Optional[str],
+    since: Optional[str],
+    limit: int,
+    response: Response
+) -> List[ChatMessage]:
+    """One page of a conversation, oldest first.
+
+    ``since`` fetches messages newer than that message id (incremental
+    polling); otherwise the page ends just before ``before``, or at the
+    latest message. ``X-Has-More`` says whether more exist in that direction.
+    """
+    if since:
+        messages = await _chat_messages_from({"user_id": user_id}, since, 1, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        messages = await _chat_messages_from({"user_id": user_id}, before, -1, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return [ChatMessage(**msg) for msg in messages]
+
+def chat_event_stream(
+    user_id: Optional[str],
+    last_event_id: Optional[str],
+    authorize: Callable[[], Awaitable]
+) -> StreamingResponse:
+    """Server-Sent Events stream of new chat messages, resuming after ``last_event_id``.
+
+    The backfill pages through everything after ``last_event_id`` until it
+    has caught up. When that id is unknown (deleted, or from another
+    conversation) there is nothing to resume from, so a ``reset`` event tells
+    the client to refetch its history instead of silently missing messages.
+    ``authorize`` is the endpoint's auth dependency bound to the request's
+    credentials; it runs again every heartbeat interval and the stream ends
+    once it raises, so an expired token or deactivated account stops
+    receiving messages.
+    """
+    async def still_authorized() -> bool:
+        try:
+            await authorize()
+        except HTTPException:
+            return False
+        return True
+    
+    async def events():
+        # Subscribe before backfilling so nothing published in between is missed
+        queue = chat_broker.subscribe(user_id)
+        try:
+            backfilled = set()
+            if last_event_id:
+                filter_query = {"user_id": user_id} if user_id is not None else {}
+                anchor = await db.chat_messages.find_one({**filter_query, "id": last_event_id}, {"_id": 1})
+                if anchor is None:
+                    yield "event: reset\ndata: {}\n\n"
+                else:
+                    after = last_event_id
+                    while True:
+                        page = await chat_messages_after(filter_query, after, CHAT_STREAM_BACKFILL_PAGE_SIZE)
+                        for message in page:
+                            backfilled.add(message["id"])
+                            yield format_chat_event(message)
+                        if len(page) < CHAT_STREAM_BACKFILL_PAGE_SIZE:
+                            break
+                        after = page[-1]["id"]
+            
+            reauthorize_at = time.monotonic() + CHAT_STREAM_HEARTBEAT_SECONDS
+            while True:
+                if time.monotonic() >= reauthorize_at:
+                    # Served from principal_cache, so this is rarely a Mongo read
+                    if not await still_authorized():
+                        return
+                    reauthorize_at = time.monotonic() + CHAT_STREAM_HEARTBEAT_SECONDS
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=CHAT_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    # Dropped for falling behind; the client resumes with Last-Event-ID
+                    return
+                if message["id"] in backfilled:
+                    continue
+                yield format_chat_event(message)
+        finally:
+            chat_broker.unsubscribe(queue, user_id)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Conversation summaries
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+async def record_conversation_message(message: ChatMessage, user: Optional[Dict] = None):
+    """Fold a new chat message into its conversation summary in one atomic update.
+
+    Last-message fields only move forward in (created_at) order, so
+    concurrent sends can't leave an older message on top of the inbox.
+    """
+    unread_field, other_field = (
+        ("unread_by_admin", "unread_by_user") if message.sender_type == "user"
+        else ("unread_by_user", "unread_by_admin")
+    )
+    is_latest = {"$gte": [message.created_at, {"$ifNull": ["$last_message_time", EPOCH]}]}
+    fields = {
+        "user_id": {"$literal": message.user_id},
+        "message_count": {"$add": [{"$ifNull": ["$message_count", 0]}, 1]},
+        unread_field: {"$add": [{"$ifNull": [f"${unread_field}", 0]}, 1]},
+        other_field: {"$ifNull": [f"${other_field}", 0]},
+        "last_message": {"$cond": [is_latest, {"$literal": message.message}, "$last_message"]},
+        "last_message_id": {"$cond": [is_latest, {"$literal": message.id}, "$last_message_id"]},
+        "last_message_time": {"$cond": [is_latest, message.created_at, "$last_message_time"]},
+        "last_sender": {"$cond": [is_latest, {"$literal": message.sender_type}, "$last_sender"]}
+    }
+    if user:
+        fields.update({
+            "user_name": {"$literal": f"{user['first_name']} {user['last_name']}"},
+            "user_email": {"$literal": user["email"]},
+            "company_name": {"$literal": user.get("company_name") or ""}
+        })
+    await db.conversations.update_one({"user_id": message.user_id}, [{"$set": fields}], upsert=True)
+
+async def rebuild_conversation_summaries():
+    """Recompute every conversation summary from chat_messages (backfill and repair)"""
+    # $merge on user_id requires a unique index on that field
+    await db.conversations.create_index([("user_id", 1)], unique=True)
+    pipeline = [
+        {"$sort": {"created_at": 1, "id": 1}},
+        {
+            "$group": {
+                "_id": "$user_id",
+                "last_message": {"$last": "$message"},
+                "last_message_id": {"$last": "$id"},
+                "last_message_time": {"$last": "$created_at"},
+                "last_sender": {"$last": "$sender_type"},
+                "message_count": {"$sum": 1}
+            }
+        },
+        {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "user"}},
+        {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$_id",
+                "last_message": 1,
+                "last_message_id": 1,
+                "last_message_time": 1,
+                "last_sender": 1,
+                "message_count": 1,
+                "unread_by_admin": {"$literal": 0},
+                "unread_by_user": {"$literal": 0},
+                "user_name": {"$concat": ["$user.first_name", " ", "$user.last_name"]},
+                "user_email": "$user.email",
+                "company_name": {"$ifNull": ["$user.company_name", ""]}
+            }
+        },
+        {"$merge": {"into": "conversations", "on": "user_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+    # The sort and group span every chat message, well past the in-memory stage limit
+    await db.chat_messages.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+# Atomic cart updates
+def _cart_defaults_stage(user_id: str, now: datetime) -> Dict:
+    return {"$set": {
+        "id": {"$ifNull": ["$id", {"$literal": str(uuid.uuid4())}]},
+        "user_id": {"$literal": user_id},
+        "items": {"$ifNull": ["$items", []]},
+        "created_at": {"$ifNull": ["$created_at", now]}
+    }}
+
+def _cart_total_stage(now: datetime) -> Dict:
+    return {"$set": {
+        "total": {"$sum": {"$map": {
+            "input": "$items",
+            "as": "item",
+            "in": {"$multiply": ["$$item.quantity", "$$item.price"]}
+        }}},
+        "updated_at": now
+    }}
+
+async def update_cart(user_id: str, item_stages: List[Dict], upsert: bool = True) -> Optional[Dict]:
+    """Apply item changes and recompute the total in one atomic pipeline update.
+
+    Returns the updated cart, or None when there is no cart and ``upsert``
+    is False. Two first writes racing to create the same cart collide on
+    the unique user_id index; the loser simply retries as an update.
+    """
+    now = datetime.now(timezone.utc)
+    pipeline = [_cart_defaults_stage(user_id, now), *item_stages, _cart_total_stage(now)]
+    for attempt in range(2):
+        try:
+            return await db.carts.find_one_and_update(
+                {"user_id": user_id},
+                pipeline,
+                projection={"_id": 0},
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            if attempt:
+                raise
+
+def cart_add_stage(product_id: str, quantity: int, price: float) -> Dict:
+    """Increment the line for ``product_id`` or append a new one"""
+    return {"$set": {"items": {"$cond": [
+        {"$in": [{"$literal": product_id}, "$items.product_id"]},
+        {"$map": {
+            "input": "$items",
+            "as": "item",
+            "in": {"$cond": [
+                {"$eq": ["$$item.product_id", {"$literal": product_id}]},
+                {"$mergeObjects": ["$$item", {"quantity": {"$add": ["$$item.quantity", quantity]}}]},
+                "$$item"
+            ]}
+        }},
+        {"$concatArrays": ["$items", [{"product_id": {"$literal": product_id}, "quantity": quantity, "price": price}]]}
+    ]}}}
+
+def cart_remove_stage(product_id: str) -> Dict:
+    return {"$set": {"items": {"$filter": {
+        "input": "$items",
+        "as": "item",
+        "cond": {"$ne": ["$$item.product_id", {"$literal": product_id}]}
+    }}}}
+
+def cart_set_quantities_stage(quantities: Dict[str, int], prices: Dict[str, float]) -> Dict:
+    """Set absolute quantities for many lines; new lines take the current price, 0 removes"""
+    updated = {"$map": {
+        "input": "$items",
+        "as": "item",
+        "in": {"$switch": {
+            "branches": [
+                {
+                    "case": {"$eq": ["$$item.product_id", {"$literal": product_id}]},
+                    "then": {"$mergeObjects": ["$$item", {"quantity": quantity}]}
+                }
+                for product_id, quantity in quantities.items()
+            ],
+            "default": "$$item"
+        }}
+    }}
+    added = [
+        {"$cond": [
+            {"$in": [{"$literal": product_id}, "$items.product_id"]},
+            [],
+            [{"product_id": {"$literal": product_id}, "quantity": quantity, "price": prices[product_id]}]
+        ]}
+        for product_id, quantity in quantities.items()
+    ]
+    return {"$set": {"items": {"$filter": {
+        "input": {"$concatArrays": [updated, *added]},
+        "as": "item",
+        "cond": {"$gt": ["$$item.quantity", 0]}
+    }}}}
+
+# Stock reservations
+# stock_quantity is available stock: units held by carts and quotes have
+# already been taken off it and go back on when released. Admin writes set
+# available stock too, so a product with held units shows (and should be
+# given) only what is free to sell. in_stock is flipped back on by a release
+# only when reservations were what sold the product out, never over an
+# admin's own out-of-stock flag.
+CART_RESERVATION_TTL_SECONDS = float(os.environ.get("CART_RESERVATION_TTL_SECONDS", "1800"))
+RESERVATION_SWEEP_INTERVAL_SECONDS = float(os.environ.get("RESERVATION_SWEEP_INTERVAL_SECONDS", "60"))
+
+async def reserve_stock(
+    product_id: str,
+    quantity: int,
+    user_id: str,
+    source: str,
+    quote_id: Optional[str] = None,
+    ttl_seconds: Optional[float] = None
+) -> Optional[Dict]:
+    """Atomically take ``quantity`` units of a product and record who holds them.
+
+    The decrement is conditional on enough stock remaining, so concurrent
+    reservations can never drive stock_quantity below zero. Returns None
+    when there is not enough stock. Reservations with a TTL are handed
+    back by the sweeper once they expire.
+    """
+    if quantity <= 0:
+        # A negative "reservation" would pass the stock check and add stock
+        raise ValueError(f"Reservation quantity must be positive, got {quantity}")
+    product = await db.products.find_one_and_update(
+        {"id": product_id, "in_stock": True, "stock_quantity": {"$gte": quantity}},
+        [{"$set": {
+            "stock_quantity": {"$subtract": ["$stock_quantity", quantity]},
+            "in_stock": {"$gt": ["$stock_quantity", quantity]},
+            "sold_out_by_reservations": {"$lte": ["$stock_quantity", quantity]}
+        }}],
+        projection={"stock_quantity": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if product is None:
+        return None
+    if product["stock_quantity"] == 0:
+        invalidate_catalog()
+    
+    now = datetime.now(timezone.utc)
+    reservation = {
+        "id": str(uuid.uuid4()),
+        "product_id": product_id,
+        "user_id": user_id,
+        "quantity": quantity,
+        "source": source,
+        "quote_id": quote_id,
+        "status": "active",
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+    }
+    await db.stock_reservations.insert_one(reservation)
+    return reservation
+
+async def release_reservations(filter_query: Dict, new_status: str = "released") -> int:
+    """Return the stock held by every active reservation matching ``filter_query``.
+
+    Each reservation is claimed with a status change before its stock is
+    restored, so a reservation is never returned twice even when the
+    sweeper and a request race for it.
+    """
+    released = 0
+    while True:
+        reservation = await db.stock_reservations.find_one_and_update(
+            {**filter_query, "status": "active"},
+            {"$set": {"status": new_status, "released_at": datetime.now(timezone.utc)}},
+            projection={"product_id": 1, "quantity": 1}
+        )
+        if reservation is None:
+            return released
+        await restore_stock(reservation["product_id"], reservation["quantity"])
+        released += 1
+
+async def restore_stock(product_id: str, quantity: int):
+    """Put units from a claimed reservation back on the product"""
+    previous = await db.products.find_one_and_update(
+        {"id": product_id},
+        [{"$set": {
+            "stock_quantity": {"$add": ["$stock_quantity", quantity]},
+            "in_stock": {"$or": ["$in_stock", {"$eq": ["$sold_out_by_reservations", True]}]},
+            "sold_out_by_reservations": False
+        }}],
+        projection={"stock_quantity": 1}
+    )
+    if previous is not None and previous["stock_quantity"] <= 0:
+        invalidate_catalog()
+
+async def release_units(filter_query: Dict, units: int) -> int:
+    """Hand back up to ``units`` held by the active reservations matching ``filter_query``.
+
+    Newest reservations go first, and the last one is shrunk rather than
+    released when it holds more than is needed. Every step is conditional on
+    the reservation being unchanged, so racing the sweeper never returns the
+    same units twice. Returns the number of units handed back.
+    """
+    released = 0
+    while released < units:
+        reservation = await db.stock_reservations.find_one(
+            {**filter_query, "status": "active"},
+            {"id": 1, "product_id": 1, "quantity": 1},
+            sort=[("created_at", -1)]
+        )
+        if reservation is None:
+            break
+        take = min(reservation["quantity"], units - released)
+        unchanged = {"id": reservation["id"], "status": "active", "quantity": reservation["quantity"]}
+        if take == reservation["quantity"]:
+            result = await db.stock_reservations.update_one(
+                unchanged, {"$set": {"status": "released", "released_at": datetime.now(timezone.utc)}}
+            )
+        else:
+            result = await db.stock_reservations.update_one(unchanged, {"$inc": {"quantity": -take}})
+        if result.modified_count:
+            await restore_stock(reservation["product_id"], take)
+            released += take
+    return released
+
+async def reserved_quantities(filter_query: Dict) -> Dict[str, int]:
+    """Units held per product by the active reservations matching ``filter_query``"""
+    reservations = await db.stock_reservations.find(
+        {**filter_query, "status": "active"}, {"product_id": 1, "quantity": 1}
+    ).to_list(length=None)
+    held: Dict[str, int] = {}
+    for reservation in reservations:
+        held[reservation["product_id"]] = held.get(reservation["product_id"], 0) + reservation["quantity"]
+    return held
+
+async def reserved_cart_quantities(user_id: str, product_ids: List[str]) -> Dict[str, int]:
+    return await reserved_quantities({"user_id": user_id, "source": "cart", "product_id": {"$in": product_ids}})
+
+async def reserve_cart_increases(user_id: str, quantities: Dict[str, int], held: Dict[str, int]) -> List[Dict]:
+    """Reserve the growth of every cart line, all or nothing.
+
+    If any line cannot get its extra units, the reservations already taken
+    for earlier lines are handed back before the 400 is raised, so the
+    user's holds are exactly what they were.
+    """
+    taken = []
+    for product_id, quantity in quantities.items():
+        delta = quantity - held.get(product_id, 0)
+        if delta <= 0:
+            continue
+        reservation = await reserve_stock(
+            product_id, delta, user_id, "cart", ttl_seconds=CART_RESERVATION_TTL_SECONDS
+        )
+        if reservation is None:
+            if taken:
+                await release_reservations({"id": {"$in": [taken_reservation["id"] for taken_reservation in taken]}})
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {product_id}")
+        taken.append(reservation)
+    return taken
+
+async def release_cart_surplus(user_id: str, quantities: Dict[str, int], held: Dict[str, int]):
+    """Hand back the units cart lines no longer need after shrinking"""
+    for product_id, quantity in quantities.items():
+        surplus = held.get(product_id, 0) - quantity
+        if surplus > 0:
+            await release_units({"user_id": user_id, "source": "cart", "product_id": product_id}, surplus)
+
+async def move_cart_holds_to_quote(user_id: str, quote_id: str, needed: Dict[str, int]):
+    """Turn the cart's holds into the quote's, reserving only what the cart did not already hold.
+
+    Holds are converted in place, so the cart's units never go back to stock
+    where another buyer could take them. If a shortfall cannot be reserved,
+    the converted holds become cart holds again and the 400 leaves the
+    user's reservations as they were. Cart holds for products left off the
+    quote are released, since the cart is cleared.
+    """
+    cart_filter = {"user_id": user_id, "source": "cart", "status": "active"}
+    await db.stock_reservations.update_many(
+        {**cart_filter, "product_id": {"$in": list(needed)}},
+        {"$set": {"source": "quote", "quote_id": quote_id, "converted_from": "cart"}, "$unset": {"expires_at": ""}}
+    )
+    held = await reserved_quantities({"quote_id": quote_id})
+    for product_id, quantity in needed.items():
+        shortfall = quantity - held.get(product_id, 0)
+        if shortfall <= 0:
+            continue
+        if await reserve_stock(product_id, shortfall, user_id, "quote", quote_id=quote_id) is None:
+            await release_reservations({"quote_id": quote_id, "converted_from": {"$exists": False}})
+            await db.stock_reservations.update_many(
+                {"quote_id": quote_id, "status": "active", "converted_from": "cart"},
+                {
+                    "$set": {
+                        "source": "cart",
+                        "quote_id": None,
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=CART_RESERVATION_TTL_SECONDS)
+                    },
+                    "$unset": {"converted_from": ""}
+                }
+            )
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {product_id}")
+    for product_id, quantity in needed.items():
+        if held.get(product_id, 0) > quantity:
+            await release_units({"quote_id": quote_id, "product_id": product_id}, held[product_id] - quantity)
+    await release_reservations({"user_id": user_id, "source": "cart"})
+
+async def settle_quote_reservations(quote_id: str, quote_status: str):
+    """Return held stock when a quote is declined and keep it for good once approved"""
+    if quote_status == "declined":
+        await release_reservations({"quote_id": quote_id})
+    elif quote_status == "approved":
+        await db.stock_reservations.update_many(
+            {"quote_id": quote_id, "status": "active"},
+            {"$set": {"status": "committed", "committed_at": datetime.now(timezone.utc)}}
+        )
+
+async def run_reservation_sweeper():
+    """Background job that hands back stock from expired cart reservations"""
+    while True:
+        try:
+            await release_reservations({"expires_at": {"$lte": datetime.now(timezone.utc)}}, "expired")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Stock reservation sweep failed: {e}")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL_SECONDS)
+
+# Bulk product import
+PRODUCT_IMPORT_MAX_ERRORS = 1000
+PRODUCT_LIST_FIELDS = ("gallery_images", "features", "tags")
+
+def parse_csv_product_row(row: Dict[str, str]) -> Dict:
+    """Turn a CSV row into ProductCreate input: blank cells are omitted,
+    list columns are ``|``-separated and specifications is a JSON object"""
+    data = {}
+    for key, value in row.items():
+        if key is None or value is None or value.strip() == "":
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key in PRODUCT_LIST_FIELDS:
+            data[key] = [part.strip() for part in value.split("|") if part.strip()]
+        elif key == "specifications":
+            data[key] = json.loads(value)
+        else:
+            data[key] = value
+    return data
+
+def iter_import_rows(upload: UploadFile, import_format: str):
+    """Yield (row number, parsed dict or exception) from an upload without loading it whole"""
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if import_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=2):
+            try:
+                yield row_number, parse_csv_product_row(row)
+            except Exception as e:
+                yield row_number, e
+    else:
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield row_number, json.loads(line)
+            except Exception as e:
+                yield row_number, e
+
+def read_import_chunk(rows, size: int, upsert_key: str, category_names: set, brand_names: set,
+                      now: datetime) -> List[Tuple[int, Optional[UpdateOne], Optional[str]]]:
+    """Read and validate the next ``size`` rows as (row number, upsert, error)
+
+    Reading the spooled upload and validating rows both block, so the import
+    endpoint runs this in a worker thread, one chunk at a time.
+    """
+    chunk = []
+    for row_number, row in itertools.islice(rows, size):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            product = ProductCreate(**row)
+            key_value = row.get(upsert_key)
+            if not key_value:
+                raise ValueError(f"Missing {upsert_key}")
+            if product.category not in category_names:
+                raise ValueError(f"Category '{product.category}' does not exist")
+            if product.brand not in brand_names:
+                raise ValueError(f"Brand '{product.brand}' does not exist")
+        except ValidationError as e:
+            chunk.append((row_number, None, "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )))
+        except Exception as e:
+            chunk.append((row_number, None, str(e)))
+        else:
+            chunk.append((row_number, product_upsert(product, upsert_key, str(key_value), now), None))
+    return chunk
+
+# Derived product fields
+# Pipeline stage recomputing the stored discount from price and original_price,
+# appended to every product write so the two can never drift apart
+PRODUCT_DISCOUNT_STAGE = {"$set": {"discount_percent": {"$cond": [
+    {"$and": [{"$gt": ["$original_price", 0]}, {"$gt": ["$original_price", "$price"]}]},
+    {"$round": [{"$multiply": [
+        {"$divide": [{"$subtract": ["$original_price", "$price"]}, "$original_price"]}, 100
+    ]}, 1]},
+    None
+]}}}
+
+def discount_percent(price: Optional[float], original_price: Optional[float]) -> Optional[float]:
+    """Python twin of PRODUCT_DISCOUNT_STAGE for documents built in memory"""
+    if price is None or not original_price or original_price <= price:
+        return None
+    return round((original_price - price) / original_price * 100, 1)
+
+def admin_stock_fields(fields: Dict) -> Dict:
+    """Stock rules for an admin product write; stock_quantity is available stock (see reserve_stock)"""
+    if "stock_quantity" in fields and "in_stock" not in fields:
+        fields["in_stock"] = fields["stock_quantity"] > 0
+    if "stock_quantity" in fields or "in_stock" in fields:
+        # The admin's stock level replaces whatever reservations did to in_stock
+        fields["sold_out_by_reservations"] = False
+    return fields
+
+def literal_set(fields: Dict) -> Dict:
+    """$set pipeline stage that stores values as-is, even strings starting with '$'"""
+    return {"$set": {key: {"$literal": value} for key, value in fields.items()}}
+
+def product_upsert(product: ProductCreate, upsert_key: str, key_value: str, now: datetime) -> UpdateOne:
+    """Upsert that only overwrites the columns present in the row; defaults apply to new products"""
+    provided = admin_stock_fields(product.dict(exclude_unset=True))
+    provided.pop("id", None)
+    defaults = {k: v for k, v in product.dict().items() if k not in provided}
+    defaults["created_at"] = now
+    if upsert_key == "sku":
+        defaults["id"] = str(uuid.uuid4())
+    defaults.pop(upsert_key, None)
+    if "specifications" in provided:
+        provided["spec_terms"] = specification_terms(provided["specifications"])
+    else:
+        defaults["spec_terms"] = []
+    # Pipeline form so the discount can be recomputed from the stored prices;
+    # $ifNull fills defaults on insert and keeps existing values on update
+    pipeline = [
+        literal_set({**provided, "updated_at": now}),
+        {"$set": {key: {"$ifNull": [f"${key}", {"$literal": value}]} for key, value in defaults.items()}},
+        PRODUCT_DISCOUNT_STAGE
+    ]
+    return UpdateOne({upsert_key: key_value}, pipeline, upsert=True)
+
+# Index manifest
+# Every index the queries in this module rely on. reconcile_indexes creates
+# what is missing at startup and reports indexes that exist but are not
+# listed here; it never drops anything.
+INDEX_RECONCILE_ON_STARTUP = os.environ.get("INDEX_RECONCILE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+INDEX_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+INDEX_MANIFEST: Dict[str, List[IndexModel]] = {
+    "products": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("sku", 1)], unique=True, partialFilterExpression={"sku": {"$type": "string"}}),
+        IndexModel([("category", 1)]),
+        IndexModel([("brand", 1)]),
+        IndexModel([("price", 1)]),
+        IndexModel([("in_stock", 1)]),
+        IndexModel([("rating", 1)]),
+        IndexModel([("review_count", 1)]),
+        IndexModel([("original_price", 1)]),
+        IndexModel([("created_at", 1), ("id", 1)]),
+        IndexModel([("price", 1), ("id", 1)]),
+        IndexModel(
+            [("name", "text"), ("tags", "text"), ("spec_terms", "text"), ("description", "text")],
+            name=PRODUCT_SEARCH_INDEX,
+            weights={"name": 10, "tags": 5, "spec_terms": 2, "description": 1},
+            default_language="english"
+        )
+    ],
+    "categories": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("slug", 1)], unique=True)
+    ],
+    "brands": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("name", 1)], unique=True)
+    ],
+    "users": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("email", 1)], unique=True)
+    ],
+    "dealers": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("email", 1)], unique=True)
+    ],
+    "admins": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("email", 1)], unique=True),
+        IndexModel([("username", 1)], unique=True)
+    ],
+    "quotes": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("user_id", 1), ("created_at", -1)]),
+        IndexModel([("status", 1)]),
+        IndexModel([("created_at", -1)])
+    ],
+    "chat_messages": [
+        IndexModel([("id", 1)], unique=True),
+        IndexModel([("user_id", 1), ("created_at", 1), ("id", 1)])
+    ],
+    "conversations": [
+        IndexModel([("user_id", 1)], unique=True),
+        IndexModel([("last_message_time", -1)])
+    ],
+    "carts": [
+        IndexModel([("user_id", 1)], unique=True)
+    ],
+    "stock_reservations": [
+        IndexModel([("status", 1), ("expires_at", 1)]),
+        IndexModel([("user_id", 1), ("source", 1), ("status", 1), ("product_id", 1)]),
+        IndexModel([("quote_id", 1), ("status", 1)])
+    ]
+}
+
+def index_signature(keys) -> Tuple:
+    """Identify an index by its keys; a collection has at most one text index"""
+    keys = list(keys.items()) if isinstance(keys, dict) else list(keys)
+    if any(field == "_fts" or direction == "text" for field, direction in keys):
+        return ("$text",)
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys)
+
+async def reconcile_indexes(apply: bool = True) -> Dict:
+    """Diff INDEX_MANIFEST against the database, creating missing indexes when ``apply`` is set"""
+    report = {"created": [], "missing": [], "extra": [], "conflicting": [], "failed": []}
+    for collection_name, models in INDEX_MANIFEST.items():
+        collection = db[collection_name]
+        existing = {
+            index_signature(info["key"]): (name, info)
+            for name, info in (await collection.index_information()).items()
+            if name != "_id_"
+        }
+        wanted = set()
+        for model in models:
+            spec = model.document
+            signature = index_signature(spec["key"])
+            wanted.add(signature)
+            if signature in existing:
+                name, info = existing[signature]
+                if any((info.get(option) or None) != (spec.get(option) or None) for option in INDEX_COMPARED_OPTIONS):
+                    report["conflicting"].append(f"{collection_name}.{name}")
+                continue
+            if not apply:
+                report["missing"].append(f"{collection_name}.{spec['name']}")
+                continue
+            try:
+                await collection.create_indexes([model])
+                report["created"].append(f"{collection_name}.{spec['name']}")
+            except OperationFailure as e:
+                report["failed"].append({"index": f"{collection_name}.{spec['name']}", "error": str(e)})
+        report["extra"].extend(
+            f"{collection_name}.{name}" for signature, (name, _) in existing.items() if signature not in wanted
+        )
+    return report
+
+# Synthetic data generation
+# Builds a catalogue, customers and their activity at any scale for capacity
+# testing. Each entity draws from its own RNG keyed on (seed, kind, index), so
+# a document never depends on batch boundaries and related records (a quote
+# line's price, a chat sender's name) are re-derived instead of held in
+# memory. Popularity is Zipf-like: low-index products, categories and brands
+# are picked far more often and a few users place most quotes, while chat
+# thread lengths follow a Pareto tail.
+SYNTHETIC_DATA_ENABLED = os.environ.get("SYNTHETIC_DATA_ENABLED", "false").lower() in ("1", "true", "yes")
+SYNTHETIC_BATCH_SIZE = int(os.environ.get("SYNTHETIC_BATCH_SIZE", "1000"))
+SYNTHETIC_WORKERS = int(os.environ.get("SYNTHETIC_WORKERS", "4"))
+SYNTHETIC_BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+SYNTHETIC_PASSWORD = "password123"
+SYNTHETIC_MAX_THREAD_LENGTH = 2000
+# Databases the admin endpoint may wipe with ``replace``; empty means never
+SYNTHETIC_REPLACE_DATABASES = {name.strip() for name in os.environ.get("SYNTHETIC_REPLACE_DATABASES", "").split(",") if name.strip()}
+SYNTHETIC_COLLECTIONS = ["categories", "brands", "products", "users", "dealers", "carts", "quotes", "chat_messages"]
+
+SYNTHETIC_SCALES = {
+    "1k": {"products": 1_000, "users": 100, "dealers": 20, "carts": 25, "quotes": 200, "chat_threads": 50, "brands": 60},
+    "10k": {"products": 10_000, "users": 1_000, "dealers": 100, "carts": 250, "quotes": 2_000, "chat_threads": 500, "brands": 60},
+    "100k": {"products": 100_000, "users": 10_000, "dealers": 1_000, "carts": 2_500, "quotes": 20_000, "chat_threads": 5_000, "brands": 120},
+    "1m": {"products": 1_000_000, "users": 100_000, "dealers": 10_000, "carts": 25_000, "quotes": 200_000, "chat_threads": 50_000, "brands": 160}
+}
+
+SYNTHETIC_CATEGORIES = [
+    ("Body Armor", ["Plate Carrier", "Armor Plate", "Ballistic Vest", "Ballistic Helmet"]),
+    ("Footwear", ["Duty Boot", "Assault Boot", "Trail Shoe", "Jungle Boot"]),
+    ("Apparel", ["Combat Shirt", "Field Pant", "Softshell Jacket", "Base Layer"]),
+    ("Optics", ["Red Dot Sight", "Rifle Scope", "Binocular", "Thermal Monocular"]),
+    ("Lighting", ["Weapon Light", "Headlamp", "Duty Flashlight", "Lantern"]),
+    ("Bags & Packs", ["Assault Pack", "Range Bag", "Sling Pack", "Deployment Duffel"]),
+    ("Load Bearing", ["Battle Belt", "Chest Rig", "Magazine Pouch", "Drop Leg Panel"]),
+    ("Knives & Tools", ["Fixed Blade", "Folding Knife", "Multitool", "Entrenching Tool"]),
+    ("Communications", ["Tactical Headset", "Radio Pouch", "PTT Switch", "Whip Antenna"]),
+    ("Medical", ["IFAK Kit", "Tourniquet", "Trauma Bag", "Folding Litter"]),
+    ("Training", ["Training Dummy", "Target Stand", "Shot Timer", "Barricade"]),
+    ("Accessories", ["Cleaning Kit", "Shooting Glove", "Eye Protection", "Hearing Protection"])
+]
+SYNTHETIC_SUBCATEGORIES = ["Duty", "Professional", "Training", "Covert", "Heavy", "Essentials"]
+SYNTHETIC_BRAND_PREFIXES = ["Iron", "Ridge", "Vanguard", "Summit", "Falcon", "Granite", "Sentinel", "Apex",
+                            "Patriot", "Titan", "Harbor", "Northstar", "Raven", "Bastion", "Cobalt", "Frontier"]
+SYNTHETIC_BRAND_SUFFIXES = ["Tactical", "Outdoor", "Defense", "Gear", "Supply", "Optics", "Works", "Industries",
+                            "Equipment", "Armory"]
+SYNTHETIC_CATEGORY_NAMES = [name for name, _ in SYNTHETIC_CATEGORIES]
+SYNTHETIC_BRAND_NAMES = [f"{prefix} {suffix}" for suffix in SYNTHETIC_BRAND_SUFFIXES for prefix in SYNTHETIC_BRAND_PREFIXES]
+SYNTHETIC_ADJECTIVES = ["Tactical", "Heavy Duty", "Lightweight", "Compact", "Modular", "Rugged", "Low Profile",
+                        "All Weather", "Pro", "Elite"]
+SYNTHETIC_MATERIALS = ["500D Cordura", "1000D Cordura", "Aluminium", "Polymer", "Stainless Steel",
+                       "Ripstop Cotton", "Aramid", "Full Grain Leather"]
+SYNTHETIC_COLORS = ["Black", "Coyote", "Ranger Green", "MultiCam", "OD Green", "Wolf Grey"]
+SYNTHETIC_TAGS = ["law-enforcement", "military", "security", "outdoor", "training", "duty", "ems", "range"]
+SYNTHETIC_FEATURES = ["MOLLE compatible", "Water resistant", "Quick release buckles", "Made in USA",
+                      "Lifetime warranty", "NIJ certified", "Reinforced stitching", "Ambidextrous design"]
+SYNTHETIC_FIRST_NAMES = ["James", "Maria", "Robert", "Linda", "Michael", "Sarah", "David", "Karen", "Daniel",
+                         "Angela", "Carlos", "Emily", "Kevin", "Jessica", "Brian", "Nicole", "Anthony", "Rachel",
+                         "Marcus", "Olivia", "Tyrone", "Mei", "Samuel", "Priya"]
+SYNTHETIC_LAST_NAMES = ["Smith", "Garcia", "Johnson", "Nguyen", "Williams", "Martinez", "Brown", "Lee", "Davis",
+                        "Lopez", "Miller", "Patel", "Wilson", "Clark", "Moore", "Hall", "Taylor", "Young",
+                        "Anderson", "King", "Thomas", "Wright", "Jackson", "Scott"]
+SYNTHETIC_LOCATIONS = [("Phoenix", "AZ", "85001"), ("San Diego", "CA", "92101"), ("Denver", "CO", "80202"),
+                       ("Tampa", "FL", "33602"), ("Atlanta", "GA", "30303"), ("Chicago", "IL", "60601"),
+                       ("Louisville", "KY", "40202"), ("Baltimore", "MD", "21201"), ("Detroit", "MI", "48226"),
+                       ("Charlotte", "NC", "28202"), ("Columbus", "OH", "43215"), ("Portland", "OR", "97204"),
+                       ("Nashville", "TN", "37203"), ("Houston", "TX", "77002"), ("Norfolk", "VA", "23510"),
+                       ("Seattle", "WA", "98101")]
+SYNTHETIC_ORGANISATIONS = ["Police Department", "Sheriff's Office", "Security Services LLC", "Fire & Rescue",
+                           "Protective Group", "Corrections Department", "Training Academy", "Emergency Management"]
+SYNTHETIC_INTENDED_USES = ["law_enforcement", "military", "security_services", "training", "personal"]
+SYNTHETIC_COMPANY_SIZES = ["1-10", "11-50", "51-200", "201-1000", "1000+"]
+SYNTHETIC_BUDGET_RANGES = ["Under $5000", "$5000-$15000", "$15000-$50000", "$50000+"]
+SYNTHETIC_QUOTE_STATUSES = (["pending", "reviewed", "approved", "declined"], [40, 25, 25, 10])
+SYNTHETIC_USER_MESSAGES = [
+    "Do you offer bulk pricing for {noun}s?",
+    "What is the lead time on the {noun}?",
+    "Can the {noun} be ordered in {color}?",
+    "We need about {quantity} units for our team, is that in stock?",
+    "Following up on our quote, any update?",
+    "Is there a government discount on this order?"
+]
+SYNTHETIC_ADMIN_MESSAGES = [
+    "Thanks for reaching out! Let me check that for you.",
+    "Yes, orders of {quantity}+ units qualify for volume pricing.",
+    "The {noun} ships within 5-7 business days.",
+    "I've updated your quote with the revised pricing.",
+    "We can do {color}; I'll confirm availability with the warehouse."
+]
+
+def synthetic_id(seed: int, kind: str, index: int) -> str:
+    """Stable UUID for the index-th entity of a kind, so references can be rebuilt"""
+    digest = hashlib.blake2b(f"{seed}:{kind}:{index}".encode(), digest_size=16).digest()
+    return str(uuid.UUID(bytes=digest, version=4))
+
+def synthetic_rng(seed: int, kind: str, index: int) -> random.Random:
+    return random.Random(f"{seed}:{kind}:{index}")
+
+def zipf_index(rng: random.Random, n: int) -> int:
+    """Index in [0, n) drawn with probability roughly proportional to 1 / (index + 1)"""
+    return min(n - 1, int((n + 1) ** rng.random()) - 1)
+
+def synthetic_name(options: List[str], index: int) -> str:
+    """index-th name from a fixed list, numbered once the list runs out"""
+    name = options[index % len(options)]
+    return name if index < len(options) else f"{name} {index // len(options) + 1}"
+
+def synthetic_category(index: int) -> Tuple[str, List[str]]:
+    name, nouns = SYNTHETIC_CATEGORIES[index % len(SYNTHETIC_CATEGORIES)]
+    return synthetic_name(SYNTHETIC_CATEGORY_NAMES, index), nouns
+
+def synthetic_brand(index: int) -> str:
+    return synthetic_name(SYNTHETIC_BRAND_NAMES, index)
+
+def synthetic_price(rng: random.Random) -> float:
+    """Log-normal shelf price; must be the first draw from a product's RNG"""
+    return round(min(4999.0, max(5.0, round(rng.lognormvariate(4.5, 1.0)))) - 0.01, 2)
+
+def synthetic_product_price(seed: int, index: int) -> float:
+    return synthetic_price(synthetic_rng(seed, "product", index))
+
+def synthetic_person(seed: int, index: int) -> Tuple[str, str]:
+    rng = synthetic_rng(seed, "user", index)
+    return rng.choice(SYNTHETIC_FIRST_NAMES), rng.choice(SYNTHETIC_LAST_NAMES)
+
+def synthetic_line_items(spec: SyntheticDataSpec, rng: random.Random, max_lines: int) -> List[Dict]:
+    """Distinct products, skewed towards the popular end of the catalogue"""
+    lines = {}
+    for _ in range(min(max_lines, int(rng.paretovariate(1.5)))):
+        index = zipf_index(rng, spec.products)
+        lines[index] = {
+            "product_id": synthetic_id(spec.seed, "product", index),
+            "quantity": rng.choice([1, 1, 1, 2, 2, 5, 10, 25]),
+            "price": synthetic_product_price(spec.seed, index)
+        }
+    return list(lines.values())
+
+def generate_categories(spec: SyntheticDataSpec):
+    for i in range(spec.categories):
+        name, nouns = synthetic_category(i)
+        yield {
+            "id": synthetic_id(spec.seed, "category", i),
+            "name": name,
+            "slug": name.lower().replace(' ', '-').replace('&', 'and'),
+            "description": f"{', '.join(nouns)} and more for professional users",
+            "image_url": f"https://images.example.com/categories/{i}.jpg",
+            "product_count": 0
+        }
+
+def generate_brands(spec: SyntheticDataSpec):
+    for i in range(spec.brands):
+        name = synthetic_brand(i)
+        slug = name.lower().replace(' ', '-')
+        yield {
+            "id": synthetic_id(spec.seed, "brand", i),
+            "name": name,
+            "logo_url": f"https://images.example.com/brands/{slug}.png",
+            "description": f"{name} builds duty-grade equipment for professionals",
+            "website": f"https://{slug}.example.com"
+        }
+
+def generate_products(spec: SyntheticDataSpec):
+    span = int(timedelta(days=730).total_seconds())
+    for i in range(spec.products):
+        rng = synthetic_rng(spec.seed, "product", i)
+        price = synthetic_price(rng)
+        category, nouns = synthetic_category(zipf_index(rng, spec.categories))
+        brand = synthetic_brand(zipf_index(rng, spec.brands))
+        noun = rng.choice(nouns)
+        original_price = round(price * rng.uniform(1.1, 1.5), 2) if rng.random() < 0.25 else None
+        in_stock = rng.random() >= spec.out_of_stock_ratio
+        specifications = {
+            "material": rng.choice(SYNTHETIC_MATERIALS),
+            "color": rng.choice(SYNTHETIC_COLORS),
+            "weight": f"{rng.uniform(0.2, 25):.1f} lb",
+            "warranty": f"{rng.choice([1, 2, 5])} years"
+        }
+        created_at = SYNTHETIC_BASE_TIME - timedelta(seconds=rng.randrange(span))
+        sku = f"SYN-{spec.seed}-{i:07d}"
+        yield {
+            "id": synthetic_id(spec.seed, "product", i),
+            "sku": sku,
+            "name": f"{brand} {rng.choice(SYNTHETIC_ADJECTIVES)} {noun} {rng.choice('ABCDEFGHJKMX')}{rng.randint(1, 99)}",
+            "description": f"{noun} in {specifications['color'].lower()} {specifications['material'].lower()}. "
+                           + " ".join(rng.sample(SYNTHETIC_FEATURES, 3)) + ".",
+            "price": price,
+            "original_price": original_price,
+            "discount_percent": discount_percent(price, original_price),
+            "category": category,
+            "subcategory": rng.choice(SYNTHETIC_SUBCATEGORIES),
+            "brand": brand,
+            "image_url": f"https://images.example.com/products/{sku}.jpg",
+            "gallery_images": [f"https://images.example.com/products/{sku}-{n}.jpg" for n in range(rng.randint(0, 4))],
+            "rating": round(3 + 2 * rng.betavariate(5, 2), 1),
+            # Popular SKUs collect most of the reviews
+            "review_count": int(2000 / (i + 1) ** 0.7 * rng.uniform(0.5, 1.5)),
+            "in_stock": in_stock,
+            "stock_quantity": rng.randint(max(spec.stock_min, 1), max(spec.stock_max, spec.stock_min, 1)) if in_stock else 0,
+            "specifications": specifications,
+            "spec_terms": specification_terms(specifications),
+            "features": rng.sample(SYNTHETIC_FEATURES, rng.randint(2, 5)),
+            "tags": rng.sample(SYNTHETIC_TAGS, rng.randint(1, 3)),
+            "is_restricted": rng.random() < 0.05,
+            "weight": specifications["weight"],
+            "dimensions": None,
+            "created_at": created_at,
+            "updated_at": created_at
+        }
+
+def generate_users(spec: SyntheticDataSpec, password_hash: str):
+    for i in range(spec.users):
+        first_name, last_name = synthetic_person(spec.seed, i)
+        rng = synthetic_rng(spec.seed, "user-profile", i)
+        city, state, zip_code = rng.choice(SYNTHETIC_LOCATIONS)
+        yield {
+            "id": synthetic_id(spec.seed, "user", i),
+            "email": f"{first_name}.{last_name}.{spec.seed}-{i}@example.com".lower(),
+            "password": password_hash,
+            "first_name": first_name,
+            "last_name": last_name,
+            "company_name": f"{city} {rng.choice(SYNTHETIC_ORGANISATIONS)}",
+            "phone": f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            "address": f"{rng.randint(1, 9999)} {rng.choice(SYNTHETIC_LAST_NAMES)} Street",
+            "city": city,
+            "state": state,
+            "zip_code": zip_code,
+            "country": "United States",
+            "is_active": rng.random() >= 0.02,
+            "created_at": SYNTHETIC_BASE_TIME - timedelta(days=rng.uniform(0, 730))
+        }
+
+def generate_dealers(spec: SyntheticDataSpec, password_hash: str):
+    for i in range(spec.dealers):
+        rng = synthetic_rng(spec.seed, "dealer", i)
+        company = f"{synthetic_brand(rng.randrange(1000))} {rng.choice(['Wholesale', 'Distribution', 'Supply Co'])}"
+        city, state, zip_code = rng.choice(SYNTHETIC_LOCATIONS)
+        yield {
+            "id": synthetic_id(spec.seed, "dealer", i),
+            "email": f"dealer.{spec.seed}-{i}@example.com",
+            "password": password_hash,
+            "company_name": company,
+            "contact_name": f"{rng.choice(SYNTHETIC_FIRST_NAMES)} {rng.choice(SYNTHETIC_LAST_NAMES)}",
+            "phone": f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            "address": f"{rng.randint(1, 9999)} Commerce Drive, {city}, {state} {zip_code}",
+            "license_number": f"FFL-{spec.seed}-{i:06d}",
+            "is_approved": rng.random() < 0.8,
+            "is_active": True,
+            "created_at": SYNTHETIC_BASE_TIME - timedelta(days=rng.uniform(0, 730))
+        }
+
+def generate_carts(spec: SyntheticDataSpec):
+    """Carts last touched up to three days ago, so they hold no stock
+
+    Their reservations would have lapsed long ago under
+    CART_RESERVATION_TTL_SECONDS, so none are generated and product stock
+    stays whole. Changing a line or quoting the cart reserves its stock then,
+    exactly as for a real cart whose holds have expired.
+    """
+    if not spec.products:
+        return
+    for i in range(min(spec.carts, spec.users)):
+        rng = synthetic_rng(spec.seed, "cart", i)
+        items = synthetic_line_items(spec, rng, 8)
+        updated_at = SYNTHETIC_BASE_TIME - timedelta(hours=rng.uniform(0, 72))
+        yield {
+            "id": synthetic_id(spec.seed, "cart", i),
+            "user_id": synthetic_id(spec.seed, "user", i),
+            "items": items,
+            "total": round(sum(item["price"] * item["quantity"] for item in items), 2),
+            "created_at": updated_at - timedelta(hours=rng.uniform(0, 240)),
+            "updated_at": updated_at
+        }
+
+def generate_quotes(spec: SyntheticDataSpec):
+    if not spec.products or not spec.users:
+        return
+    statuses, weights = SYNTHETIC_QUOTE_STATUSES
+    for i in range(spec.quotes):
+        rng = synthetic_rng(spec.seed, "quote", i)
+        # Heavy quoters: a few accounts place most of the quotes
+        user_index = zipf_index(rng, spec.users)
+        items = [dict(item, notes=None) for item in synthetic_line_items(spec, rng, 12)]
+        city, state, zip_code = rng.choice(SYNTHETIC_LOCATIONS)
+        address = f"{rng.randint(1, 9999)} {rng.choice(SYNTHETIC_LAST_NAMES)} Street, {city}, {state} {zip_code}"
+        quote_status = rng.choices(statuses, weights)[0]
+        created_at = SYNTHETIC_BASE_TIME - timedelta(days=rng.uniform(0, 365))
+        yield {
+            "id": synthetic_id(spec.seed, "quote", i),
+            "user_id": synthetic_id(spec.seed, "user", user_index),
+            "items": items,
+            "total_amount": round(sum(item["price"] * item["quantity"] for item in items), 2),
+            "project_name": f"{rng.choice(['Q1', 'Q2', 'Q3', 'Q4'])} {rng.choice(['Equipment Refresh', 'Team Upgrade', 'Academy Intake', 'Replacement Order'])}",
+            "intended_use": rng.choice(SYNTHETIC_INTENDED_USES),
+            "delivery_date": created_at + timedelta(days=rng.randint(7, 90)),
+            "delivery_address": address,
+            "billing_address": address,
+            "company_size": rng.choice(SYNTHETIC_COMPANY_SIZES),
+            "budget_range": rng.choice(SYNTHETIC_BUDGET_RANGES),
+            "additional_requirements": None,
+            "status": quote_status,
+            "admin_notes": "Pricing confirmed with procurement." if quote_status in ("reviewed", "approved") else None,
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(days=rng.uniform(0, 5)) if quote_status != "pending" else created_at
+        }
+
+def generate_chat_messages(spec: SyntheticDataSpec):
+    for thread in range(min(spec.chat_threads, spec.users)):
+        rng = synthetic_rng(spec.seed, "chat", thread)
+        user_id = synthetic_id(spec.seed, "user", thread)
+        user_name = " ".join(synthetic_person(spec.seed, thread))
+        # Pareto(1.5) has mean 3; most threads are short, a few run very long
+        length = min(SYNTHETIC_MAX_THREAD_LENGTH, max(1, int(rng.paretovariate(1.5) * spec.mean_thread_length / 3)))
+        sent_at = SYNTHETIC_BASE_TIME - timedelta(days=rng.uniform(0, 180))
+        sender_type = "user"
+        for n in range(length):
+            _, nouns = synthetic_category(zipf_index(rng, spec.categories))
+            templates = SYNTHETIC_USER_MESSAGES if sender_type == "user" else SYNTHETIC_ADMIN_MESSAGES
+            yield {
+                "id": synthetic_id(spec.seed, f"chat-{thread}", n),
+                "user_id": user_id,
+                "sender_type": sender_type,
+                "sender_name": user_name if sender_type == "user" else "Support Team",
+                "message": rng.choice(templates).format(
+                    noun=rng.choice(nouns).lower(), color=rng.choice(SYNTHETIC_COLORS),
+                    quantity=rng.choice([10, 15, 20, 50, 100])
+                ),
+                "created_at": sent_at
+            }
+            sent_at += timedelta(minutes=rng.expovariate(1 / 90))
+            if rng.random() < 0.7:
+                sender_type = "admin" if sender_type == "user" else "user"
+
+def batched(documents, size: int):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def insert_generated(collection, documents, batch_size: int = SYNTHETIC_BATCH_SIZE,
+                           workers: int = SYNTHETIC_WORKERS) -> Dict[str, int]:
+    """Stream generated documents into a collection with concurrent insert_many workers
+
+    Batches are built in a worker thread so the event loop keeps serving
+    requests; the bounded queue keeps memory flat at any scale. Duplicate keys
+    (re-running a seed without ``replace``) are counted and skipped.
+    """
+    report = {"inserted": 0, "duplicates": 0}
+    batches = batched(documents, batch_size)
+    pending: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def produce():
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            await pending.put(batch)
+        for _ in range(workers):
+            await pending.put(None)
+
+    async def consume():
+        while (batch := await pending.get()) is not None:
+            try:
+                result = await collection.insert_many(batch, ordered=False)
+                report["inserted"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                details = e.details
+                if any(write_error.get("code") != 11000 for write_error in details.get("writeErrors", [])):
+                    raise
+                report["inserted"] += details.get("nInserted", 0)
+                report["duplicates"] += len(details.get("writeErrors", []))
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return report
+
+def synthetic_spec(scale: Optional[str] = None, overrides: Optional[Dict] = None) -> SyntheticDataSpec:
+    """Spec for a named scale preset, with explicitly given fields taking precedence"""
+    if scale is not None and scale not in SYNTHETIC_SCALES:
+        raise ValueError(f"Unknown scale '{scale}', expected one of {', '.join(SYNTHETIC_SCALES)}")
+    return SyntheticDataSpec(**{**SYNTHETIC_SCALES.get(scale, {}), **(overrides or {})})
+
+async def generate_synthetic_data(spec: SyntheticDataSpec) -> Dict:
+    """Write a synthetic dataset described by ``spec`` and rebuild derived state"""
+    started = time.perf_counter()
+    if spec.replace:
+        for name in SYNTHETIC_COLLECTIONS + ["conversations", "stock_reservations"]:
+            await db[name].delete_many({})
+    await reconcile_indexes()
+
+    # Every synthetic account shares one hash so seeding costs a single scrypt
+    password_hash = await password_hasher.hash(SYNTHETIC_PASSWORD)
+    generators = {
+        "categories": generate_categories(spec),
+        "brands": generate_brands(spec),
+        "products": generate_products(spec),
+        "users": generate_users(spec, password_hash),
+        "dealers": generate_dealers(spec, password_hash),
+        "carts": generate_carts(spec),
+        "quotes": generate_quotes(spec),
+        "chat_messages": generate_chat_messages(spec)
+    }
+    collections = {}
+    for name, documents in generators.items():
+        collection_started = time.perf_counter()
+        collections[name] = await insert_generated(db[name], documents)
+        collections[name]["seconds"] = round(time.perf_counter() - collection_started, 2)
+        logger.info(f"Synthetic data: {name} {collections[name]}")
+
+    await rebuild_conversation_summaries()
+    await reconcile_dashboard_stats()
+    invalidate_catalog()
+    invalidate_principals()
+    return {
+        "seed": spec.seed,
+        "spec": spec.dict(),
+        "collections": collections,
+        "password": SYNTHETIC_PASSWORD,
+        "elapsed_seconds": round(time.perf_counter() - started, 2)
+    }
+
+def seed_command(argv: List[str]) -> None:
+    """``python server.py seed``: generate synthetic data in DB_NAME"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="server.py seed", description="Generate synthetic data in DB_NAME")
+    parser.add_argument("--scale", choices=SYNTHETIC_SCALES, default="10k")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--replace", action="store_true", default=None, help="wipe the generated collections first")
+    for field in ("categories", "brands", "products", "users", "dealers", "carts", "quotes", "chat_threads",
+                  "stock_min", "stock_max"):
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field, type=int)
+    parser.add_argument("--mean-thread-length", type=float)
+    parser.add_argument("--out-of-stock-ratio", type=float)
+    args = vars(parser.parse_args(argv))
+    scale = args.pop("scale")
+    spec = synthetic_spec(scale, {key: value for key, value in args.items() if value is not None})
+    report = asyncio.run(generate_synthetic_data(spec))
+    print(json.dumps(report, indent=2, default=str))
 
 # Initialize empty collections
 @api_router.post("/initialize-collections")
 async def initialize_collections():
     """Initialize empty collections for the application"""
     # Create empty collections with proper indexes
-    collections = ["products", "categories", "brands", "users", "dealers", "admins", "quotes", "chat_messages", "carts", "status_checks"]
+    collections = ["products", "categories", "brands", "users", "dealers", "admins", "quotes", "chat_messages", "conversations", "carts", "stock_reservations", "status_checks"]
     
     for collection_name in collections:
         if collection_name not in await db.list_collection_names():
             await db.create_collection(collection_name)
     
     # Create indexes for better performance
-    await db.products.create_index([("category", 1)])
-    await db.products.create_index([("brand", 1)])
-    await db.products.create_index([("price", 1)])
-    await db.products.create_index([("in_stock", 1)])
-    await db.categories.create_index([("slug", 1)], unique=True)
-    await db.brands.create_index([("name", 1)], unique=True)
-    await db.users.create_index([("email", 1)], unique=True)
-    await db.dealers.create_index([("email", 1)], unique=True)
-    await db.admins.create_index([("email", 1)], unique=True)
-    await db.admins.create_index([("username", 1)], unique=True)
-    await db.quotes.create_index([("user_id", 1)])
-    await db.quotes.create_index([("status", 1)])
-    await db.chat_messages.create_index([("user_id", 1)])
-    await db.carts.create_index([("user_id", 1)], unique=True)
-    
-    return {"message": "Collections initialized successfully with indexes"}
+    index_report = await reconcile_indexes()
+    
+    # Backfill searchable specification terms for products created before search indexing
+    updates = []
+    async for product in db.products.find({"spec_terms": {"$exists": False}}, {"specifications": 1}):
+        updates.append(UpdateOne(
+            {"_id": product["_id"]},
+            {"$set": {"spec_terms": specification_terms(product.get("specifications"))}}
+        ))
+        if len(updates) >= 1000:
+            await db.products.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db.products.bulk_write(updates, ordered=False)
+    await db.products.update_many({"discount_percent": {"$exists": False}}, [PRODUCT_DISCOUNT_STAGE])
+    
+    return {"message": "Collections initialized successfully with indexes", "indexes": index_report}
 
 # Sample Users Creation Endpoint
 @api_router.post("/create-sample-users")
 async def create_sample_users():
+    """Fixed demo accounts; POST /admin/synthetic-data or ``python server.py seed`` generate data at scale"""
     # Clear existing users and dealers
     await db.users.delete_many({})
     await db.dealers.delete_many({})
@@ -498,7 +3375,7 @@ async def create_sample_users():
     sample_users = [
         {
             "email": "john.doe@company.com",
-            "password": hash_password("password123"),
+            "password": "password123",
             "first_name": "John",
             "last_name": "Doe",
             "company_name": "Tactical Solutions LLC",
@@ -512,7 +3389,7 @@ async def create_sample_users():
         },
         {
             "email": "sarah.wilson@defense.gov",
-            "password": hash_password("password123"),
+            "password": "password123",
             "first_name": "Sarah",
             "last_name": "Wilson",
             "company_name": "Defense Department",
@@ -526,7 +3403,7 @@ async def create_sample_users():
         },
         {
             "email": "mike.johnson@police.org",
-            "password": hash_password("password123"),
+            "password": "password123",
             "first_name": "Mike",
             "last_name": "Johnson",
             "company_name": "Metro Police Department",
@@ -540,18 +3417,19 @@ async def create_sample_users():
         }
     ]
     
-    for user_data in sample_users:
-        user_dict = {k: v for k, v in user_data.items() if k != "password"}
-        user = User(**user_dict)
-        user_with_password = user.dict()
-        user_with_password["password"] = user_data["password"]
-        await db.users.insert_one(user_with_password)
+    passwords = ("password123", "dealer123", "admin123", "support123")
+    hashes = dict(zip(passwords, await asyncio.gather(*(password_hasher.hash(password) for password in passwords))))
+    
+    await db.users.insert_many([
+        {**User(**{k: v for k, v in user_data.items() if k != "password"}).dict(), "password": hashes[user_data["password"]]}
+        for user_data in sample_users
+    ])
     
     # Create sample dealers
     sample_dealers = [
         {
             "email": "dealer@tactical-wholesale.com",
-            "password": hash_password("dealer123"),
+            "password": "dealer123",
             "company_name": "Tactical Wholesale Partners",
             "contact_name": "Robert Smith",
             "phone": "555-111-2222",
@@ -562,7 +3440,7 @@ async def create_sample_users():
         },
         {
             "email": "admin@tactical-supply.com", 
-            "password": hash_password("dealer123"),
+            "password": "dealer123",
             "company_name": "Tactical Supply Co",
             "contact_name": "Lisa Anderson",
             "phone": "555-333-4444",
@@ -573,12 +3451,12 @@ async def create_sample_users():
         }
     ]
     
-    for dealer_data in sample_dealers:
-        dealer_dict = {k: v for k, v in dealer_data.items() if k != "password"}
-        dealer = Dealer(**dealer_dict)
-        dealer_with_password = dealer.dict()
-        dealer_with_password["password"] = dealer_data["password"]
-        await db.dealers.insert_one(dealer_with_password)
+    await db.dealers.insert_many([
+        {**Dealer(**{k: v for k, v in dealer_data.items() if k != "password"}).dict(), "password": hashes[dealer_data["password"]]}
+        for dealer_data in sample_dealers
+    ])
+    # Cached principals for the deleted accounts would otherwise keep authenticating
+    invalidate_principals()
     
     # Create some sample quotes for demo
     users = await db.users.find().to_list(length=None)
@@ -620,9 +3498,7 @@ async def create_sample_users():
             }
         ]
         
-        for quote_data in sample_quotes:
-            quote = Quote(**quote_data)
-            await db.quotes.insert_one(quote.dict())
+        await db.quotes.insert_many([Quote(**quote_data).dict() for quote_data in sample_quotes])
     
     # Create sample chat messages
     if users:
@@ -653,34 +3529,33 @@ async def create_sample_users():
             }
         ]
         
-        for msg_data in sample_messages:
-            message = ChatMessage(**msg_data)
-            await db.chat_messages.insert_one(message.dict())
+        await db.chat_messages.insert_many([ChatMessage(**msg_data).dict() for msg_data in sample_messages])
     
     # Create sample admin accounts
     sample_admins = [
         {
             "email": "admin@oehtraders.com",
-            "password": hash_password("admin123"),
+            "password": "admin123",
             "username": "admin",
             "is_super_admin": True,
             "is_active": True
         },
         {
             "email": "support@oehtraders.com", 
-            "password": hash_password("support123"),
+            "password": "support123",
             "username": "support",
             "is_super_admin": False,
             "is_active": True
         }
     ]
     
-    for admin_data in sample_admins:
-        admin_dict = {k: v for k, v in admin_data.items() if k != "password"}
-        admin = Admin(**admin_dict)
-        admin_with_password = admin.dict()
-        admin_with_password["password"] = admin_data["password"]
-        await db.admins.insert_one(admin_with_password)
+    await db.admins.insert_many([
+        {**Admin(**{k: v for k, v in admin_data.items() if k != "password"}).dict(), "password": hashes[admin_data["password"]]}
+        for admin_data in sample_admins
+    ])
+
+    await reconcile_dashboard_stats()
+    await rebuild_conversation_summaries()
 
     return {
         "message": "Sample users, dealers, quotes, chat messages, and admin accounts created successfully",
@@ -691,6 +3566,70 @@ async def create_sample_users():
         "chat_messages_created": 4
     }
 
+_synthetic_data_tasks: set = set()
+
+async def run_synthetic_data_job(job_id: str, spec: SyntheticDataSpec):
+    """Generate a dataset and record the outcome on its job document"""
+    try:
+        report = await generate_synthetic_data(spec)
+    except Exception as e:
+        logger.exception(f"Synthetic data job {job_id} failed")
+        outcome = {"status": "failed", "error": str(e)}
+    else:
+        outcome = {"status": "completed", "report": report}
+    await db.synthetic_data_jobs.update_one(
+        {"id": job_id},
+        {"$set": {**outcome, "finished_at": datetime.now(timezone.utc)}}
+    )
+
+@api_router.post("/admin/synthetic-data", status_code=status.HTTP_202_ACCEPTED)
+async def create_synthetic_data(
+    spec: SyntheticDataSpec = SyntheticDataSpec(),
+    scale: Optional[str] = Query(default=None, description=f"Preset: {', '.join(SYNTHETIC_SCALES)}"),
+    current_admin: Admin = Depends(get_current_admin)
+):
+    """Start generating a deterministic synthetic dataset for capacity testing (Admin only)
+
+    Disabled unless SYNTHETIC_DATA_ENABLED is set. ``scale`` picks preset
+    counts; fields given in the body override them. With ``replace`` the
+    generated collections are wiped first, which is only allowed when DB_NAME
+    is listed in SYNTHETIC_REPLACE_DATABASES; otherwise re-running a seed skips
+    the documents it already wrote. Generation runs in the background: poll
+    GET /admin/synthetic-data/{job_id} for the report.
+    """
+    if not SYNTHETIC_DATA_ENABLED:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Synthetic data generation is disabled")
+    try:
+        spec = synthetic_spec(scale, spec.dict(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if spec.replace and db.name not in SYNTHETIC_REPLACE_DATABASES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"replace would wipe '{db.name}', which is not listed in SYNTHETIC_REPLACE_DATABASES"
+        )
+
+    job = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "spec": spec.dict(),
+        "requested_by": current_admin.id,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.synthetic_data_jobs.insert_one(job)
+    task = asyncio.create_task(run_synthetic_data_job(job["id"], spec))
+    _synthetic_data_tasks.add(task)
+    task.add_done_callback(_synthetic_data_tasks.discard)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@api_router.get("/admin/synthetic-data/{job_id}")
+async def get_synthetic_data_job(job_id: str, current_admin: Admin = Depends(get_current_admin)):
+    """Status of a synthetic data job, with its report once completed (Admin only)"""
+    job = await db.synthetic_data_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Synthetic data job not found")
+    return job
+
 # User Authentication Endpoints
 @api_router.post("/users/register")
 async def register_user(user_data: UserCreate):
@@ -704,7 +3643,7 @@ async def register_user(user_data: UserCreate):
     
     # Create new user
     user_dict = user_data.dict()
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     user = User(**{k: v for k, v in user_dict.items() if k != "password"})
     
     # Store with password
@@ -712,13 +3651,15 @@ async def register_user(user_data: UserCreate):
     user_with_password["password"] = hashed_password
     
     await db.users.insert_one(user_with_password)
+    await bump_dashboard_stats(total_users=1)
     
     return {"message": "User registration successful"}
 
 @api_router.post("/users/login")
 async def login_user(login_data: UserLogin):
     user = await db.users.find_one({"email": login_data.email})
-    if not user or not verify_password(login_data.password, user["password"]):
+    password_ok = await password_hasher.verify(login_data.password, user.get("password") if user else None)
+    if not user or not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -730,6 +3671,7 @@ async def login_user(login_data: UserLogin):
             detail="User account is inactive"
         )
     
+    await upgrade_password_hash(db.users, user, login_data.password)
     token = create_jwt_token(user["id"], "user")
     return {
         "access_token": token,
@@ -754,7 +3696,7 @@ async def register_dealer(dealer_data: DealerCreate):
     
     # Create new dealer
     dealer_dict = dealer_data.dict()
-    hashed_password = hash_password(dealer_data.password)
+    hashed_password = await password_hasher.hash(dealer_data.password)
     dealer = Dealer(**{k: v for k, v in dealer_dict.items() if k != "password"})
     
     # Store with password
@@ -762,13 +3704,15 @@ async def register_dealer(dealer_data: DealerCreate):
     dealer_with_password["password"] = hashed_password
     
     await db.dealers.insert_one(dealer_with_password)
+    await bump_dashboard_stats(total_dealers=1, pending_dealers=1)
     
     return {"message": "Dealer registration successful. Awaiting approval."}
 
 @api_router.post("/dealers/login")
 async def login_dealer(login_data: DealerLogin):
     dealer = await db.dealers.find_one({"email": login_data.email})
-    if not dealer or not verify_password(login_data.password, dealer["password"]):
+    password_ok = await password_hasher.verify(login_data.password, dealer.get("password") if dealer else None)
+    if not dealer or not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
@@ -786,6 +3730,7 @@ async def login_dealer(login_data: DealerLogin):
             detail="Dealer account is inactive"
         )
     
+    await upgrade_password_hash(db.dealers, dealer, login_data.password)
     token = create_jwt_token(dealer["id"], "dealer")
     return {
         "access_token": token,
@@ -801,7 +3746,8 @@ async def get_dealer_profile(current_dealer: Dealer = Depends(get_current_dealer
 @api_router.post("/admin/login")
 async def login_admin(login_data: AdminLogin):
     admin = await db.admins.find_one({"username": login_data.username})
-    if not admin or not verify_password(login_data.password, admin["password"]):
+    password_ok = await password_hasher.verify(login_data.password, admin.get("password") if admin else None)
+    if not admin or not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
@@ -813,6 +3759,7 @@ async def login_admin(login_data: AdminLogin):
             detail="Admin account is inactive"
         )
     
+    await upgrade_password_hash(db.admins, admin, login_data.password)
     token = create_jwt_token(admin["id"], "admin")
     return {
         "access_token": token,
@@ -826,67 +3773,148 @@ async def get_admin_profile(current_admin: Admin = Depends(get_current_admin)):
 
 # Enhanced Admin Endpoints for Dealer Management
 @api_router.get("/admin/dealers/pending")
-async def get_pending_dealers(current_admin: Admin = Depends(get_current_admin)):
+async def get_pending_dealers(
+    current_admin: Admin = Depends(get_current_admin),
+    export_format: str = Query(default="json", alias="format", pattern=EXPORT_FORMAT_PATTERN)
+):
     """Get all dealers pending approval"""
-    dealers = await db.dealers.find({"is_approved": False, "is_active": True}).to_list(length=None)
+    filter_query = {"is_approved": False, "is_active": True}
+    if export_format != "json":
+        fields = list(DealerResponse.model_fields)
+        cursor = db.dealers.find(filter_query, export_projection(fields))
+        return streaming_export(cursor, fields, export_format, "pending-dealers")
+    
+    dealers = await db.dealers.find(filter_query).to_list(length=None)
     return [DealerResponse(**{k: v for k, v in dealer.items() if k != "_id" and k != "password"}) for dealer in dealers]
 
 @api_router.get("/admin/dealers")
-async def get_all_dealers(current_admin: Admin = Depends(get_current_admin)):
+async def get_all_dealers(
+    current_admin: Admin = Depends(get_current_admin),
+    export_format: str = Query(default="json", alias="format", pattern=EXPORT_FORMAT_PATTERN)
+):
     """Get all dealers with their status"""
+    if export_format != "json":
+        fields = list(DealerResponse.model_fields)
+        cursor = db.dealers.find({}, export_projection(fields))
+        return streaming_export(cursor, fields, export_format, "dealers")
+    
     dealers = await db.dealers.find().to_list(length=None)
     return [DealerResponse(**{k: v for k, v in dealer.items() if k != "_id" and k != "password"}) for dealer in dealers]
 
 @api_router.put("/admin/dealers/{dealer_id}/approve")
 async def approve_dealer(dealer_id: str, current_admin: Admin = Depends(get_current_admin)):
     """Approve a dealer registration"""
-    result = await db.dealers.update_one(
+    previous = await db.dealers.find_one_and_update(
         {"id": dealer_id},
-        {"$set": {"is_approved": True}}
+        {"$set": {"is_approved": True}},
+        projection={"is_approved": 1, "is_active": 1}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Dealer not found")
     
+    invalidate_principal("dealer", dealer_id)
+    if previous.get("is_active") and not previous.get("is_approved"):
+        await bump_dashboard_stats(pending_dealers=-1, approved_dealers=1)
+    
     return {"message": "Dealer approved successfully"}
 
 @api_router.put("/admin/dealers/{dealer_id}/reject")
 async def reject_dealer(dealer_id: str, current_admin: Admin = Depends(get_current_admin)):
     """Reject a dealer registration"""
-    result = await db.dealers.update_one(
+    previous = await db.dealers.find_one_and_update(
         {"id": dealer_id},
-        {"$set": {"is_active": False}}
+        {"$set": {"is_active": False}},
+        projection={"is_approved": 1, "is_active": 1}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Dealer not found")
     
+    invalidate_principal("dealer", dealer_id)
+    if previous.get("is_active"):
+        if previous.get("is_approved"):
+            await bump_dashboard_stats(approved_dealers=-1)
+        else:
+            await bump_dashboard_stats(pending_dealers=-1)
+    
     return {"message": "Dealer rejected successfully"}
 
 # Enhanced Admin Endpoints for User Management
 @api_router.get("/admin/users")
-async def get_all_users(current_admin: Admin = Depends(get_current_admin)):
+async def get_all_users(
+    current_admin: Admin = Depends(get_current_admin),
+    export_format: str = Query(default="json", alias="format", pattern=EXPORT_FORMAT_PATTERN)
+):
     """Get all users"""
+    if export_format != "json":
+        fields = list(UserResponse.model_fields)
+        cursor = db.users.find({}, export_projection(fields))
+        return streaming_export(cursor, fields, export_format, "users")
+    
     users = await db.users.find().to_list(length=None)
     return [UserResponse(**{k: v for k, v in user.items() if k != "_id" and k != "password"}) for user in users]
 
+@api_router.put("/admin/users/{user_id}/deactivate")
+async def deactivate_user(user_id: str, current_admin: Admin = Depends(get_current_admin)):
+    """Deactivate a user account"""
+    result = await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"is_active": False}}
+    )
+    
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    invalidate_principal("user", user_id)
+    return {"message": "User deactivated successfully"}
+
 @api_router.get("/admin/stats")
 async def get_admin_stats(current_admin: Admin = Depends(get_current_admin)):
     """Get admin dashboard statistics"""
-    stats = {
-        "total_users": await db.users.count_documents({}),
-        "total_dealers": await db.dealers.count_documents({}),
-        "pending_dealers": await db.dealers.count_documents({"is_approved": False, "is_active": True}),
-        "approved_dealers": await db.dealers.count_documents({"is_approved": True, "is_active": True}),
-        "total_quotes": await db.quotes.count_documents({}),
-        "pending_quotes": await db.quotes.count_documents({"status": "pending"}),
-        "approved_quotes": await db.quotes.count_documents({"status": "approved"}),
-        "total_products": await db.products.count_documents({}),
-        "total_categories": await db.categories.count_documents({}),
-        "total_brands": await db.brands.count_documents({}),
-        "chat_messages": await db.chat_messages.count_documents({})
+    stats = await db.stats.find_one({"_id": DASHBOARD_STATS_ID})
+    # Deltas applied before the first reconciliation only hold partial counts
+    if stats is None or "reconciled_at" not in stats:
+        return await reconcile_dashboard_stats()
+    return {name: stats.get(name, 0) for name in DASHBOARD_COUNTERS}
+
+@api_router.get("/admin/cache/stats")
+async def get_cache_stats(current_admin: Admin = Depends(get_current_admin)):
+    """Get hit/miss counters for the in-process caches and how they are kept in sync"""
+    return {"catalog": catalog_cache.stats(), "principals": principal_cache.stats(), "sync": cache_sync_state}
+
+@api_router.get("/admin/password-hasher/stats")
+async def get_password_hasher_stats(current_admin: Admin = Depends(get_current_admin)):
+    """Get concurrency and queue-depth counters for the password hashing pool"""
+    return password_hasher.stats()
+
+@api_router.get("/admin/indexes")
+async def get_index_report(current_admin: Admin = Depends(get_current_admin)):
+    """Diff the index manifest against the database without changing anything"""
+    return await reconcile_indexes(apply=False)
+
+@api_router.post("/admin/indexes/reconcile")
+async def reconcile_index_manifest(current_admin: Admin = Depends(get_current_admin)):
+    """Create any manifest index missing from the database"""
+    return await reconcile_indexes()
+
+@api_router.get("/admin/query-advisor")
+async def get_query_advisor_report(current_admin: Admin = Depends(get_current_admin)):
+    """Query shapes seen per route, flagged ones first (enable with QUERY_ADVISOR=true)"""
+    return {"enabled": QUERY_ADVISOR_ENABLED, "shapes": query_advisor.report()}
+
+@api_router.get("/admin/performance")
+async def get_performance_report(current_admin: Admin = Depends(get_current_admin)):
+    """Recent per-route latency quantiles, in-flight requests and event loop stalls"""
+    return {
+        "routes": {route: latency_quantiles(samples) for route, samples in sorted(route_latencies.items())},
+        "in_flight": {labels[0]: count for labels, count in HTTP_REQUESTS_IN_FLIGHT.snapshot().items() if count},
+        "slow_request_seconds": SLOW_REQUEST_SECONDS,
+        "event_loop": {
+            "stall_threshold_seconds": EVENT_LOOP_STALL_SECONDS,
+            "recent_stalls": list(event_loop_monitor.recent_stalls)
+        }
     }
-    return stats
 
 # ADMIN CATEGORY MANAGEMENT ENDPOINTS
 @api_router.post("/admin/categories", response_model=Category)
@@ -914,6 +3942,8 @@ async def create_category(category_data: CategoryCreate, current_admin: Admin =
         
         # Insert into database
         await db.categories.insert_one(category.dict())
+        invalidate_catalog()
+        await bump_dashboard_stats(total_categories=1)
         
         return category
         
@@ -999,6 +4029,7 @@ async def update_category(category_id: str, category_data: CategoryUpdate, curre
             {"id": category_id},
             {"$set": update_data}
         )
+        invalidate_catalog()
         
         # Return updated category
         updated_category = await db.categories.find_one({"id": category_id})
@@ -1033,6 +4064,8 @@ async def delete_category(category_id: str, current_admin: Admin = Depends(get_c
         result = await db.categories.delete_one({"id": category_id})
         
         if result.deleted_count == 1:
+            invalidate_catalog()
+            await bump_dashboard_stats(total_categories=-1)
             return {"message": "Category deleted successfully"}
         else:
             raise HTTPException(
@@ -1066,6 +4099,8 @@ async def create_brand(brand_data: BrandCreate, current_admin: Admin = Depends(g
         
         # Insert into database
         await db.brands.insert_one(brand.dict())
+        invalidate_catalog()
+        await bump_dashboard_stats(total_brands=1)
         
         return brand
         
@@ -1148,6 +4183,7 @@ async def update_brand(brand_id: str, brand_data: BrandUpdate, current_admin: Ad
             {"id": brand_id},
             {"$set": update_data}
         )
+        invalidate_catalog()
         
         # Return updated brand
         updated_brand = await db.brands.find_one({"id": brand_id})
@@ -1182,6 +4218,8 @@ async def delete_brand(brand_id: str, current_admin: Admin = Depends(get_current
         result = await db.brands.delete_one({"id": brand_id})
         
         if result.deleted_count == 1:
+            invalidate_catalog()
+            await bump_dashboard_stats(total_brands=-1)
             return {"message": "Brand deleted successfully"}
         else:
             raise HTTPException(
@@ -1226,12 +4264,15 @@ async def create_product(product_data: ProductCreate, current_admin: Admin = Dep
         product = Product(
             id=product_id,
             **product_data.dict(),
+            discount_percent=discount_percent(product_data.price, product_data.original_price),
             created_at=now,
             updated_at=now
         )
         
         # Insert into database
-        await db.products.insert_one(product.dict())
+        await db.products.insert_one({**product.dict(), "spec_terms": specification_terms(product.specifications)})
+        invalidate_catalog()
+        await bump_dashboard_stats(total_products=1)
         
         return product
         
@@ -1271,14 +4312,17 @@ async def update_product(product_id: str, product_data: ProductUpdate, current_a
                 )
         
         # Prepare update data
-        update_data = product_data.dict(exclude_unset=True)
+        update_data = admin_stock_fields(product_data.dict(exclude_unset=True))
         update_data["updated_at"] = datetime.now(timezone.utc)
+        if "specifications" in update_data:
+            update_data["spec_terms"] = specification_terms(update_data["specifications"])
         
         # Update product in database
         await db.products.update_one(
             {"id": product_id},
-            {"$set": update_data}
+            [literal_set(update_data), PRODUCT_DISCOUNT_STAGE]
         )
+        invalidate_catalog()
         
         # Return updated product
         updated_product = await db.products.find_one({"id": product_id})
@@ -1305,6 +4349,8 @@ async def delete_product(product_id: str, current_admin: Admin = Depends(get_cur
         result = await db.products.delete_one({"id": product_id})
         
         if result.deleted_count == 1:
+            invalidate_catalog()
+            await bump_dashboard_stats(total_products=-1)
             return {"message": "Product deleted successfully"}
         else:
             raise HTTPException(
@@ -1320,6 +4366,202 @@ async def delete_product(product_id: str, current_admin: Admin = Depends(get_cur
             detail=f"Failed to delete product: {str(e)}"
         )
 
+@api_router.post("/admin/products/import")
+async def import_products(
+    file: UploadFile = File(...),
+    import_format: Optional[str] = Query(default=None, alias="format", pattern="^(csv|ndjson)$"),
+    upsert_key: str = Query(default="sku", pattern="^(sku|id)$"),
+    batch_size: int = Query(default=1000, ge=1, le=10000),
+    ordered: bool = False,
+    current_admin: Admin = Depends(get_current_admin)
+):
+    """Bulk create or update products from a CSV or NDJSON upload (Admin only)
+
+    Rows are validated against existing categories and brands and written
+    with bulk_write in batches, upserting on ``sku`` or ``id``. With
+    ``ordered=true`` the import stops at the first failing row.
+    """
+    if import_format is None:
+        filename = (file.filename or "").lower()
+        if filename.endswith(".csv"):
+            import_format = "csv"
+        elif filename.endswith((".ndjson", ".jsonl")):
+            import_format = "ndjson"
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot detect import format; pass format=csv or format=ndjson"
+            )
+    
+    category_names, brand_names = await asyncio.gather(
+        db.categories.distinct("name"),
+        db.brands.distinct("name")
+    )
+    category_names, brand_names = set(category_names), set(brand_names)
+    
+    report = {"processed": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    
+    def record_error(row_number: int, error: str):
+        report["failed"] += 1
+        if len(report["errors"]) < PRODUCT_IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "error": error})
+    
+    async def flush(operations: List[UpdateOne], row_numbers: List[int]) -> bool:
+        try:
+            result = await db.products.bulk_write(operations, ordered=ordered)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get("writeErrors", []):
+                record_error(row_numbers[write_error["index"]], write_error.get("errmsg", "Write failed"))
+        report["inserted"] += details.get("nUpserted", 0)
+        report["updated"] += details.get("nMatched", 0)
+        return not (ordered and details.get("writeErrors"))
+    
+    rows = iter_import_rows(file, import_format)
+    now = datetime.now(timezone.utc)
+    
+    while chunk := await asyncio.to_thread(
+        read_import_chunk, rows, batch_size, upsert_key, category_names, brand_names, now
+    ):
+        operations: List[UpdateOne] = []
+        row_numbers: List[int] = []
+        for row_number, operation, error in chunk:
+            report["processed"] += 1
+            if error is not None:
+                record_error(row_number, error)
+                if ordered:
+                    break
+            else:
+                operations.append(operation)
+                row_numbers.append(row_number)
+        
+        # Rows before a failing one are still written, as with an ordered bulk_write
+        if operations and not await flush(operations, row_numbers):
+            break
+        if ordered and report["failed"]:
+            break
+    
+    if report["inserted"] or report["updated"]:
+        invalidate_catalog()
+        await bump_dashboard_stats(total_products=report["inserted"])
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
+@api_router.post("/admin/products/bulk-update")
+async def bulk_update_products(
+    request: ProductBulkUpdateRequest,
+    batch_size: int = Query(default=1000, ge=1, le=10000),
+    current_admin: Admin = Depends(get_current_admin)
+):
+    """Patch many products at once, or reprice every product matching a filter (Admin only)
+
+    ``patches`` are per-product field updates keyed by ``id``; ``filter`` plus
+    ``price_change`` applies a percent or absolute price change server-side;
+    a filter with no criteria is refused unless ``all`` is set. Both go through single round trips per batch, and the catalog cache is
+    invalidated once at the end.
+    """
+    if not request.patches and request.price_change is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide patches or a price_change"
+        )
+    if request.filter is not None and request.price_change is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A filter needs a price_change to apply"
+        )
+    
+    report = {"matched": 0, "modified": 0, "failed": 0, "errors": []}
+    
+    def record_error(product_id: str, error: str):
+        report["failed"] += 1
+        if len(report["errors"]) < PRODUCT_IMPORT_MAX_ERRORS:
+            report["errors"].append({"id": product_id, "error": error})
+    
+    now = datetime.now(timezone.utc)
+    
+    if request.patches:
+        # Later patches for the same product win, field by field
+        patches: Dict[str, Dict] = {}
+        for patch in request.patches:
+            fields = patch.dict(exclude_unset=True)
+            fields.pop("id")
+            patches.setdefault(patch.id, {}).update(fields)
+        
+        category_names, brand_names, existing_ids = await asyncio.gather(
+            db.categories.distinct("name"),
+            db.brands.distinct("name"),
+            db.products.distinct("id", {"id": {"$in": list(patches)}})
+        )
+        category_names, brand_names, existing_ids = set(category_names), set(brand_names), set(existing_ids)
+        
+        operations: List[UpdateOne] = []
+        operation_ids: List[str] = []
+        for product_id, fields in patches.items():
+            if product_id not in existing_ids:
+                record_error(product_id, "Product not found")
+                continue
+            if "category" in fields and fields["category"] not in category_names:
+                record_error(product_id, f"Category '{fields['category']}' does not exist")
+                continue
+            if "brand" in fields and fields["brand"] not in brand_names:
+                record_error(product_id, f"Brand '{fields['brand']}' does not exist")
+                continue
+            admin_stock_fields(fields)
+            if "specifications" in fields:
+                fields["spec_terms"] = specification_terms(fields["specifications"])
+            fields["updated_at"] = now
+            operations.append(UpdateOne({"id": product_id}, [literal_set(fields), PRODUCT_DISCOUNT_STAGE]))
+            operation_ids.append(product_id)
+        
+        for start in range(0, len(operations), batch_size):
+            try:
+                result = await db.products.bulk_write(operations[start:start + batch_size], ordered=False)
+                details = result.bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+                for write_error in details.get("writeErrors", []):
+                    record_error(operation_ids[start + write_error["index"]], write_error.get("errmsg", "Write failed"))
+            report["matched"] += details.get("nMatched", 0)
+            report["modified"] += details.get("nModified", 0)
+    
+    if request.price_change is not None:
+        product_filter = request.filter or ProductBulkFilter()
+        filter_query = build_product_filter(
+            category=product_filter.category,
+            brand=product_filter.brand,
+            min_price=product_filter.min_price,
+            max_price=product_filter.max_price,
+            in_stock=product_filter.in_stock
+        )
+        if product_filter.ids is not None:
+            filter_query["id"] = {"$in": product_filter.ids}
+        if not filter_query and not product_filter.all:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="An empty filter matches every product; set filter.all to reprice the whole catalog"
+            )
+        
+        if request.price_change.mode == "percent":
+            new_price = {"$multiply": ["$price", 1 + request.price_change.value / 100]}
+        else:
+            new_price = {"$add": ["$price", request.price_change.value]}
+        result = await db.products.update_many(filter_query, [
+            {"$set": {
+                "price": {"$round": [{"$max": [new_price, 0]}, 2]},
+                "updated_at": {"$literal": now}
+            }},
+            PRODUCT_DISCOUNT_STAGE
+        ])
+        report["matched"] += result.matched_count
+        report["modified"] += result.modified_count
+    
+    if report["modified"]:
+        invalidate_catalog()
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
 @api_router.get("/admin/products")
 async def get_all_products_admin(
     current_admin: Admin = Depends(get_current_admin),
@@ -1328,38 +4570,59 @@ async def get_all_products_admin(
     search: Optional[str] = None,
     category: Optional[str] = None,
     brand: Optional[str] = None,
-    in_stock: Optional[bool] = None
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: Optional[bool] = None,
+    sort: Optional[str] = Query(default=None, pattern=PRODUCT_SORT_PATTERN),
+    cursor: Optional[str] = None,
+    total: str = Query(default="estimated", pattern="^(exact|estimated|none)$"),
+    fields: Optional[str] = None
 ):
-    """Get all products with pagination and filtering (Admin only)"""
+    """Get all products with pagination and filtering (Admin only)
+
+    Passing ``sort`` or ``cursor`` switches from skip/limit to keyset
+    pagination; follow ``next_cursor``/``prev_cursor`` to move between pages.
+    Products are summaries unless ``fields`` asks for more. ``total_count``
+    is estimated by default (collection metadata, or a capped count when
+    filtering, with ``total_is_capped`` set once the cap is reached); ask for
+    ``total=exact`` to pay for a full count.
+    """
     try:
-        filter_query = {}
+        filter_query = build_product_filter(category, brand, min_price, max_price, search, in_stock)
+        projection = product_projection(parse_product_fields(fields))
         
-        if search:
-            filter_query["$or"] = [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"description": {"$regex": search, "$options": "i"}},
-                {"tags": {"$in": [search.lower()]}}
-            ]
-        
-        if category:
-            filter_query["category"] = category
-            
-        if brand:
-            filter_query["brand"] = brand
-            
-        if in_stock is not None:
-            filter_query["in_stock"] = in_stock
+        next_cursor = prev_cursor = None
+        if sort or cursor:
+            products, next_cursor, prev_cursor = await fetch_product_page(filter_query, sort, cursor, limit, projection)
+        else:
+            products = await find_products(filter_query, projection).skip(skip).limit(limit).to_list(length=None)
         
-        products = await db.products.find(filter_query).skip(skip).limit(limit).to_list(length=None)
-        total_count = await db.products.count_documents(filter_query)
+        total_is_capped = False
+        if total == "exact":
+            total_count = await db.products.count_documents(filter_query)
+        elif total == "estimated":
+            if filter_query:
+                # One past the cap tells "exactly the cap" apart from "at least"
+                total_count = await db.products.count_documents(filter_query, limit=ESTIMATED_COUNT_CAP + 1)
+                total_is_capped = total_count > ESTIMATED_COUNT_CAP
+                total_count = min(total_count, ESTIMATED_COUNT_CAP)
+            else:
+                total_count = await db.products.estimated_document_count()
+        else:
+            total_count = None
         
-        return {
-            "products": [Product(**product) for product in products],
+        return list_response({
+            "products": shape_documents(ProductSummary, products),
             "total_count": total_count,
+            "total_is_capped": total_is_capped,
             "skip": skip,
-            "limit": limit
-        }
+            "limit": limit,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor
+        })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1394,43 +4657,21 @@ async def add_to_cart(request: AddToCartRequest, current_user: User = Depends(ge
     if not product["in_stock"] or product["stock_quantity"] < request.quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock")
     
-    # Find or create cart for user
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    
-    if not cart:
-        cart = Cart(user_id=current_user.id, items=[])
-        cart_dict = cart.dict()
-    else:
-        # Remove MongoDB _id field
-        cart_dict = {k: v for k, v in cart.items() if k != "_id"}
-    
-    # Check if item already in cart
-    item_found = False
-    for item in cart_dict["items"]:
-        if item["product_id"] == request.product_id:
-            item["quantity"] += request.quantity
-            item_found = True
-            break
-    
-    if not item_found:
-        cart_dict["items"].append({
-            "product_id": request.product_id,
-            "quantity": request.quantity,
-            "price": product["price"]
-        })
-    
-    # Calculate total
-    cart_dict["total"] = sum(item["quantity"] * item["price"] for item in cart_dict["items"])
-    cart_dict["updated_at"] = datetime.now(timezone.utc)
-    
-    # Save cart
-    await db.carts.replace_one(
-        {"user_id": current_user.id},
-        cart_dict,
-        upsert=True
+    # Hold the units for this cart; the check above is only a fast path
+    reservation = await reserve_stock(
+        request.product_id, request.quantity, current_user.id, "cart", ttl_seconds=CART_RESERVATION_TTL_SECONDS
     )
+    if reservation is None:
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+    
+    # Create the cart if needed and add or increment the line in one atomic update
+    try:
+        cart = await update_cart(current_user.id, [cart_add_stage(request.product_id, request.quantity, product["price"])])
+    except Exception:
+        await release_reservations({"id": reservation["id"]})
+        raise
     
-    return {"message": "Item added to cart", "cart": cart_dict}
+    return {"message": "Item added to cart", "cart": cart}
 
 @api_router.get("/cart")
 async def get_cart(current_user: User = Depends(get_current_user)):
@@ -1438,10 +4679,10 @@ async def get_cart(current_user: User = Depends(get_current_user)):
     if not cart:
         return {"items": [], "total": 0.0}
     
-    # Get product details for each item
+    # Get product details for all items in one query
+    products = await DocumentLoader(db.products).load_many([item["product_id"] for item in cart["items"]])
     enriched_items = []
-    for item in cart["items"]:
-        product = await db.products.find_one({"id": item["product_id"]})
+    for item, product in zip(cart["items"], products):
         if product:
             # Remove MongoDB _id field to avoid serialization issues
             product_dict = {k: v for k, v in product.items() if k != "_id"}
@@ -1457,26 +4698,55 @@ async def get_cart(current_user: User = Depends(get_current_user)):
 
 @api_router.delete("/cart/item/{product_id}")
 async def remove_from_cart(product_id: str, current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id})
+    cart = await update_cart(current_user.id, [cart_remove_stage(product_id)], upsert=False)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    # Remove MongoDB _id field
-    cart_dict = {k: v for k, v in cart.items() if k != "_id"}
-    cart_dict["items"] = [item for item in cart_dict["items"] if item["product_id"] != product_id]
-    cart_dict["total"] = sum(item["quantity"] * item["price"] for item in cart_dict["items"])
-    cart_dict["updated_at"] = datetime.now(timezone.utc)
-    
-    await db.carts.replace_one({"user_id": current_user.id}, cart_dict)
+    await release_reservations({"user_id": current_user.id, "source": "cart", "product_id": product_id})
     return {"message": "Item removed from cart"}
 
+@api_router.put("/cart/items")
+async def set_cart_quantities(request: SetCartQuantitiesRequest, current_user: User = Depends(get_current_user)):
+    """Set the quantity of many cart lines at once (0 removes a line)"""
+    quantities = {item.product_id: item.quantity for item in request.items}
+    products = await DocumentLoader(
+        db.products, projection={"id": 1, "price": 1, "in_stock": 1, "stock_quantity": 1}
+    ).load_many(list(quantities))
+    
+    held = await reserved_cart_quantities(current_user.id, list(quantities))
+    
+    prices = {}
+    for product_id, product in zip(quantities, products):
+        if not product:
+            raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+        # Units the cart already holds count towards the new quantity; only growth needs free stock
+        delta = quantities[product_id] - held.get(product_id, 0)
+        if delta > 0 and (not product["in_stock"] or product["stock_quantity"] < delta):
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for product {product_id}")
+        prices[product_id] = product["price"]
+    
+    # Grow lines first: a shortfall anywhere leaves every hold and the cart untouched
+    taken = await reserve_cart_increases(current_user.id, quantities, held)
+    try:
+        cart = await update_cart(current_user.id, [cart_set_quantities_stage(quantities, prices)])
+    except Exception:
+        if taken:
+            await release_reservations({"id": {"$in": [reservation["id"] for reservation in taken]}})
+        raise
+    
+    # Shrinking lines only ever hand units back, so they go last and cannot fail for lack of stock
+    await release_cart_surplus(current_user.id, quantities, held)
+    return {"message": "Cart updated", "cart": cart}
+
 # Quote System Endpoints
 @api_router.post("/quotes")
 async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get_current_user)):
     total_amount = 0
     # Assign actual product price to each item
-    for item in quote_data.items:
-        product = await db.products.find_one({"id": item.product_id})
+    products = await DocumentLoader(db.products, projection={"id": 1, "price": 1}).load_many(
+        [item.product_id for item in quote_data.items]
+    )
+    for item, product in zip(quote_data.items, products):
         if product and "price" in product:
             item.price = product["price"]  # <-- assign actual price
             total_amount += product["price"] * item.quantity
@@ -1498,7 +4768,15 @@ async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get
         additional_requirements=quote_data.additional_requirements
     )
     
+    # Move the stock held by the cart onto the quote; quote holds don't expire
+    needed: Dict[str, int] = {}
+    for item, product in zip(quote_data.items, products):
+        if product:
+            needed[item.product_id] = needed.get(item.product_id, 0) + item.quantity
+    await move_cart_holds_to_quote(current_user.id, quote.id, needed)
+    
     await db.quotes.insert_one(quote.dict())
+    await bump_dashboard_stats(total_quotes=1, **quote_status_deltas(None, quote.status))
     
     # Clear user's cart after quote submission
     await db.carts.delete_one({"user_id": current_user.id})
@@ -1509,7 +4787,7 @@ async def create_quote(quote_data: QuoteCreate, current_user: User = Depends(get
 async def get_user_quotes(current_user: User = Depends(get_current_user)):
     quotes = await db.quotes.find({"user_id": current_user.id}).sort("created_at", -1).to_list(length=None)
     
-    quote_responses = []
+    quote_dicts = []
     for quote in quotes:
         quote_dict = {k: v for k, v in quote.items() if k != "_id"}
         
@@ -1517,44 +4795,78 @@ async def get_user_quotes(current_user: User = Depends(get_current_user)):
         if quote_dict.get("status") != "approved":
             quote_dict["total_amount"] = 0  # or None
 
-        quote_responses.append(QuoteResponse(
+        quote_dicts.append({
             **quote_dict,
-            user_name=f"{current_user.first_name} {current_user.last_name}",
-            user_email=current_user.email,
-            company_name=current_user.company_name
-        ))
+            "user_name": f"{current_user.first_name} {current_user.last_name}",
+            "user_email": current_user.email,
+            "company_name": current_user.company_name
+        })
     
-    return quote_responses
+    return list_response(shape_documents(QuoteResponse, quote_dicts))
 
 # Admin Endpoints for Quote Management
 @api_router.get("/admin/quotes", response_model=List[QuoteResponse])
-async def get_all_quotes():
+async def get_all_quotes(
+    export_format: str = Query(default="json", alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    current_admin: Admin = Depends(get_current_admin)
+):
+    if export_format != "json":
+        fields = list(QuoteResponse.model_fields)
+        quote_fields = [field for field in fields if field not in ("user_name", "user_email", "company_name")]
+        cursor = db.quotes.find({}, export_projection(quote_fields + ["user_id"])).sort("created_at", -1)
+        
+        async def add_users(batch: List[Dict]) -> List[Dict]:
+            users = await DocumentLoader(db.users, projection={"password": 0}).load_many(
+                [quote["user_id"] for quote in batch]
+            )
+            return [
+                {
+                    **quote,
+                    "user_name": f"{user['first_name']} {user['last_name']}",
+                    "user_email": user["email"],
+                    "company_name": user.get("company_name")
+                }
+                for quote, user in zip(batch, users) if user
+            ]
+        
+        return streaming_export(cursor, fields, export_format, "quotes", enrich_batch=add_users)
+    
     quotes = await db.quotes.find().sort("created_at", -1).to_list(length=None)
-    quote_responses = []
-    for quote in quotes:
-        user = await db.users.find_one({"id": quote["user_id"]})
+    users = await DocumentLoader(db.users, projection={"password": 0}).load_many([quote["user_id"] for quote in quotes])
+    quote_dicts = []
+    for quote, user in zip(quotes, users):
         quote_dict = {k: v for k, v in quote.items() if k != "_id"}  # ✅ keeps total_amount too
         if user:
-            quote_responses.append(QuoteResponse(
+            quote_dicts.append({
                 **quote_dict,
-                user_name=f"{user['first_name']} {user['last_name']}",
-                user_email=user["email"],
-                company_name=user.get("company_name")
-            ))
-    return quote_responses
+                "user_name": f"{user['first_name']} {user['last_name']}",
+                "user_email": user["email"],
+                "company_name": user.get("company_name")
+            })
+    return list_response(shape_documents(QuoteResponse, quote_dicts))
 
 @api_router.put("/admin/quotes/{quote_id}/status")
-async def update_quote_status(quote_id: str, status: str, admin_notes: str = ""):
-    quote = await db.quotes.find_one({"id": quote_id})
-    if not quote:
-        raise HTTPException(status_code=404, detail="Quote not found")
-
+async def update_quote_status(
+    quote_id: str,
+    status: QuoteStatus,
+    admin_notes: str = "",
+    current_admin: Admin = Depends(get_current_admin)
+):
+    """Move a quote to a new status, settling its stock holds (Admin only)"""
     update_data = {
         "status": status,
         "admin_notes": admin_notes
     }
 
-    await db.quotes.update_one({"id": quote_id}, {"$set": update_data})
+    previous = await db.quotes.find_one_and_update(
+        {"id": quote_id},
+        {"$set": update_data},
+        projection={"status": 1}
+    )
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    await bump_dashboard_stats(**quote_status_deltas(previous.get("status"), status))
+    await settle_quote_reservations(quote_id, status)
     return {"message": "Quote status updated successfully"}
 
 # Chat System Endpoints
@@ -1569,20 +4881,49 @@ async def send_message(message_data: ChatMessageCreate, current_user: User = Dep
     )
     
     await db.chat_messages.insert_one(message.dict())
+    chat_broker.publish(message.dict())
+    await record_conversation_message(message, current_user.dict())
+    await bump_dashboard_stats(chat_messages=1)
     return {"message": "Message sent successfully"}
 
+@api_router.post("/chat/read")
+async def mark_chat_read(current_user: User = Depends(get_current_user)):
+    """Mark the admin's messages in the user's conversation as read"""
+    await db.conversations.update_one({"user_id": current_user.id}, {"$set": {"unread_by_user": 0}})
+    return {"message": "Conversation marked as read"}
+
+@api_router.get("/chat/stream")
+async def stream_chat_messages(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(default=None),
+    resume_after: Optional[str] = None
+):
+    """Push new messages in the user's conversation as Server-Sent Events"""
+    return chat_event_stream(current_user.id, last_event_id or resume_after, lambda: get_current_user(credentials))
+
 @api_router.get("/chat/{user_id}")
-async def get_chat_messages(user_id: str, current_user: User = Depends(get_current_user)):
+async def get_chat_messages(
+    user_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200)
+):
     # Users can only access their own chat
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    messages = await db.chat_messages.find({"user_id": user_id}).sort("created_at", 1).to_list(length=None)
-    return [ChatMessage(**{k: v for k, v in msg.items() if k != "_id"}) for msg in messages]
+    return await fetch_chat_history(user_id, before, since, limit, response)
 
 @api_router.post("/admin/chat/send")
 async def admin_send_message(message_data: ChatMessageCreate, current_admin: Admin = Depends(get_current_admin)):
     # Admin sends message with proper authentication
+    user = await db.users.find_one({"id": message_data.user_id}, {"first_name": 1, "last_name": 1, "email": 1, "company_name": 1})
+    if not user:
+        # Would otherwise start an inbox conversation with no name or email
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     message = ChatMessage(
         user_id=message_data.user_id,
         sender_type="admin",
@@ -1590,36 +4931,60 @@ async def admin_send_message(message_data: ChatMessageCreate, current_admin: Adm
         message=message_data.message
     )
     await db.chat_messages.insert_one(message.dict())
+    chat_broker.publish(message.dict())
+    await record_conversation_message(message, user)
+    await bump_dashboard_stats(chat_messages=1)
     return {"message": "Admin message sent successfully"}
 
+@api_router.get("/admin/chat/stream")
+async def admin_stream_chat_messages(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_admin: Admin = Depends(get_current_admin),
+    user_id: Optional[str] = None,
+    last_event_id: Optional[str] = Header(default=None),
+    resume_after: Optional[str] = None
+):
+    """Push new messages from every conversation, or only ``user_id``'s, as Server-Sent Events"""
+    return chat_event_stream(user_id, last_event_id or resume_after, lambda: get_current_admin(credentials))
+
 @api_router.get("/admin/chat/conversations")
-async def get_all_conversations(current_admin: Admin = Depends(get_current_admin)):
-    """Get all chat conversations with users"""
-    # Get unique user IDs who have sent messages
-    pipeline = [
-        {"$group": {"_id": "$user_id", "last_message": {"$last": "$$ROOT"}, "message_count": {"$sum": 1}}},
-        {"$sort": {"last_message.created_at": -1}}
-    ]
-    
-    conversations = await db.chat_messages.aggregate(pipeline).to_list(length=None)
-    
-    # Enrich with user data
-    enriched_conversations = []
-    for conv in conversations:
-        user = await db.users.find_one({"id": conv["_id"]})
-        if user:
-            enriched_conversations.append({
-                "user_id": conv["_id"],
-                "user_name": f"{user['first_name']} {user['last_name']}",
-                "user_email": user["email"],
-                "company_name": user.get("company_name", ""),
-                "last_message": conv["last_message"]["message"],
-                "last_message_time": conv["last_message"]["created_at"],
-                "last_sender": conv["last_message"]["sender_type"],
-                "message_count": conv["message_count"]
-            })
+async def get_all_conversations(
+    current_admin: Admin = Depends(get_current_admin),
+    skip: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, le=200)
+):
+    """Get chat conversations with users, most recently active first"""
+    conversations = await db.conversations.find({}, {"_id": 0}).sort(
+        "last_message_time", -1
+    ).skip(skip).limit(limit).to_list(length=None)
     
-    return enriched_conversations
+    return [
+        {
+            "user_id": conv["user_id"],
+            "user_name": conv.get("user_name"),
+            "user_email": conv.get("user_email"),
+            "company_name": conv.get("company_name", ""),
+            "last_message": conv["last_message"],
+            "last_message_time": conv["last_message_time"],
+            "last_sender": conv["last_sender"],
+            "message_count": conv["message_count"],
+            "unread_by_admin": conv.get("unread_by_admin", 0),
+            "unread_by_user": conv.get("unread_by_user", 0)
+        }
+        for conv in conversations
+    ]
+
+@api_router.post("/admin/chat/conversations/rebuild")
+async def rebuild_conversations(current_admin: Admin = Depends(get_current_admin)):
+    """Recompute conversation summaries from the full message history"""
+    await rebuild_conversation_summaries()
+    return {"message": "Conversation summaries rebuilt successfully"}
+
+@api_router.post("/admin/chat/{user_id}/read")
+async def admin_mark_chat_read(user_id: str, current_admin: Admin = Depends(get_current_admin)):
+    """Mark the user's messages in a conversation as read by the admin team"""
+    await db.conversations.update_one({"user_id": user_id}, {"$set": {"unread_by_admin": 0}})
+    return {"message": "Conversation marked as read"}
 
 @api_router.post("/admin/quotes/{quote_id}/send-email")
 async def send_quote_email(quote_id: str, current_admin: Admin = Depends(get_current_admin)):
@@ -1680,10 +5045,14 @@ async def update_quote_pricing(quote_id: str, pricing_data: dict, current_admin:
                     item["price"] = item_prices[i]
             update_data["items"] = items
         
-        await db.quotes.update_one(
+        previous = await db.quotes.find_one_and_update(
             {"id": quote_id},
-            {"$set": update_data}
+            {"$set": update_data},
+            projection={"status": 1}
         )
+        if previous is not None:
+            await bump_dashboard_stats(**quote_status_deltas(previous.get("status"), update_data["status"]))
+        await settle_quote_reservations(quote_id, update_data["status"])
         
         return {"message": "Quote pricing updated successfully"}
         
@@ -1691,10 +5060,16 @@ async def update_quote_pricing(quote_id: str, pricing_data: dict, current_admin:
         raise HTTPException(status_code=500, detail=f"Failed to update quote pricing: {str(e)}")
 
 @api_router.get("/admin/chat/{user_id}/messages")
-async def get_user_chat_messages(user_id: str, current_admin: Admin = Depends(get_current_admin)):
-    """Get all messages for a specific user conversation"""
-    messages = await db.chat_messages.find({"user_id": user_id}).sort("created_at", 1).to_list(length=None)
-    return [ChatMessage(**{k: v for k, v in msg.items() if k != "_id"}) for msg in messages]
+async def get_user_chat_messages(
+    user_id: str,
+    response: Response,
+    current_admin: Admin = Depends(get_current_admin),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200)
+):
+    """Get a page of messages for a specific user conversation (use before/since to scroll)"""
+    return await fetch_chat_history(user_id, before, since, limit, response)
 
 @api_router.get("/admin/chat/{user_id}/quote-context")
 async def get_user_quote_context(user_id: str, current_admin: Admin = Depends(get_current_admin)):
@@ -1738,8 +5113,9 @@ async def get_user_quote_context(user_id: str, current_admin: Admin = Depends(ge
         raise HTTPException(status_code=500, detail=f"Failed to get quote context: {str(e)}")
 
 # Enhanced Product endpoints with stock filtering (existing)
-@api_router.get("/products", response_model=List[Product])
+@api_router.get("/products", response_model=List[ProductSummary])
 async def get_products(
+    response: Response,
     category: Optional[str] = None,
     brand: Optional[str] = None,
     min_price: Optional[float] = None,
@@ -1747,118 +5123,220 @@ async def get_products(
     search: Optional[str] = None,
     in_stock: Optional[bool] = None,
     limit: int = Query(default=20, le=100),
-    skip: int = Query(default=0, ge=0)
+    skip: int = Query(default=0, ge=0),
+    sort: Optional[str] = Query(default=None, pattern=PRODUCT_SORT_PATTERN),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("products"))
 ):
-    filter_query = {}
-    
-    if category:
-        filter_query["category"] = category
-    if brand:
-        filter_query["brand"] = brand
-    if min_price is not None:
-        filter_query["price"] = {"$gte": min_price}
-    if max_price is not None:
-        if "price" in filter_query:
-            filter_query["price"]["$lte"] = max_price
-        else:
-            filter_query["price"] = {"$lte": max_price}
-    if search:
-        filter_query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}},
-            {"tags": {"$in": [search.lower()]}}
-        ]
-    if in_stock is not None:
-        filter_query["in_stock"] = in_stock
+    if not_modified is not None:
+        return not_modified
+    filter_query = build_product_filter(category, brand, min_price, max_price, search, in_stock)
+    projection = product_projection(parse_product_fields(fields))
     
-    products = await db.products.find(filter_query).skip(skip).limit(limit).to_list(length=None)
-    return [Product(**product) for product in products]
+    if sort or cursor:
+        # Keyset pagination; page tokens are returned in X-Next-Cursor / X-Prev-Cursor
+        products, next_cursor, prev_cursor = await fetch_product_page(filter_query, sort, cursor, limit, projection)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        if prev_cursor:
+            response.headers["X-Prev-Cursor"] = prev_cursor
+    else:
+        products = await find_products(filter_query, projection).skip(skip).limit(limit).to_list(length=None)
+    return list_response(shape_documents(ProductSummary, products), response)
+
+@api_router.get("/products/facets")
+async def get_products_facets(
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("products"))
+):
+    """Get category, brand, subcategory, stock and price counts for the current product filter"""
+    if not_modified is not None:
+        return not_modified
+    filter_query = build_product_filter(category, brand, min_price, max_price, search, in_stock)
+    return await get_product_facets(filter_query)
 
 @api_router.get("/categories/with-counts", response_model=List[CategoryWithCount])
-async def get_categories_with_counts():
-    # Get all categories
-    categories = await db.categories.find().to_list(length=None)
+async def get_categories_with_counts(not_modified: Optional[Response] = Depends(catalog_conditional("with-counts"))):
+    if not_modified is not None:
+        return not_modified
     
-    # Count products for each category
-    categories_with_counts = []
-    for category in categories:
-        count = await db.products.count_documents({"category": category["name"]})
-        category_dict = {k: v for k, v in category.items() if k != "_id"}
-        category_dict["product_count"] = count
-        categories_with_counts.append(CategoryWithCount(**category_dict))
+    async def load():
+        # Get all categories and the product counts in parallel
+        categories, facets = await asyncio.gather(
+            db.categories.find().to_list(length=None),
+            get_product_facets({})
+        )
+        
+        categories_with_counts = []
+        for category in categories:
+            category_dict = {k: v for k, v in category.items() if k != "_id"}
+            category_dict["product_count"] = facets["categories"].get(category["name"], 0)
+            categories_with_counts.append(CategoryWithCount(**category_dict))
+        
+        return categories_with_counts
     
-    return categories_with_counts
+    return await catalog_cache.get_or_load("categories-with-counts", load)
 
 @api_router.get("/brands/with-counts", response_model=List[BrandWithCount])
-async def get_brands_with_counts():
-    # Get all brands
-    brands = await db.brands.find().to_list(length=None)
+async def get_brands_with_counts(not_modified: Optional[Response] = Depends(catalog_conditional("with-counts"))):
+    if not_modified is not None:
+        return not_modified
     
-    # Count products for each brand
-    brands_with_counts = []
-    for brand in brands:
-        count = await db.products.count_documents({"brand": brand["name"]})
-        brand_dict = {k: v for k, v in brand.items() if k != "_id"}
-        brand_dict["product_count"] = count
-        brands_with_counts.append(BrandWithCount(**brand_dict))
+    async def load():
+        # Get all brands and the product counts in parallel
+        brands, facets = await asyncio.gather(
+            db.brands.find().to_list(length=None),
+            get_product_facets({})
+        )
+        
+        brands_with_counts = []
+        for brand in brands:
+            brand_dict = {k: v for k, v in brand.items() if k != "_id"}
+            brand_dict["product_count"] = facets["brands"].get(brand["name"], 0)
+            brands_with_counts.append(BrandWithCount(**brand_dict))
+        
+        return brands_with_counts
     
-    return brands_with_counts
+    return await catalog_cache.get_or_load("brands-with-counts", load)
 
 @api_router.get("/products/price-range")
-async def get_price_range():
-    pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "min_price": {"$min": "$price"},
-                "max_price": {"$max": "$price"}
+async def get_price_range(not_modified: Optional[Response] = Depends(catalog_conditional("products"))):
+    if not_modified is not None:
+        return not_modified
+    
+    async def load():
+        pipeline = [
+            {
+                "$group": {
+                    "_id": None,
+                    "min_price": {"$min": "$price"},
+                    "max_price": {"$max": "$price"}
+                }
             }
-        }
-    ]
+        ]
+        
+        result = await db.products.aggregate(pipeline).to_list(1)
+        if result:
+            return {"min_price": result[0]["min_price"], "max_price": result[0]["max_price"]}
+        else:
+            return {"min_price": 0, "max_price": 1000}
     
-    result = await db.products.aggregate(pipeline).to_list(1)
-    if result:
-        return {"min_price": result[0]["min_price"], "max_price": result[0]["max_price"]}
-    else:
-        return {"min_price": 0, "max_price": 1000}
+    return await catalog_cache.get_or_load("price-range", load)
 
-@api_router.get("/products/featured", response_model=List[Product])
-async def get_featured_products():
-    products = await db.products.find({"rating": {"$gte": 4.7}}).limit(8).to_list(length=None)
-    return [Product(**product) for product in products]
+@api_router.get("/products/featured", response_model=List[ProductSummary])
+async def get_featured_products(
+    response: Response,
+    fields: Optional[str] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("shelves"))
+):
+    if not_modified is not None:
+        return not_modified
+    extra_fields = parse_product_fields(fields)
+    
+    async def load():
+        products = await db.products.find({"rating": {"$gte": 4.7}}, product_projection(extra_fields)).limit(8).to_list(length=None)
+        return shape_documents(ProductSummary, products)
+    
+    return list_response(await catalog_cache.get_or_load(("featured", extra_fields), load), response)
 
-@api_router.get("/products/trending", response_model=List[Product])
-async def get_trending_products():
-    products = await db.products.find({"review_count": {"$gte": 100}}).limit(6).to_list(length=None)
-    return [Product(**product) for product in products]
+@api_router.get("/products/trending", response_model=List[ProductSummary])
+async def get_trending_products(
+    response: Response,
+    fields: Optional[str] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("shelves"))
+):
+    if not_modified is not None:
+        return not_modified
+    extra_fields = parse_product_fields(fields)
+    
+    async def load():
+        products = await db.products.find({"review_count": {"$gte": 100}}, product_projection(extra_fields)).limit(6).to_list(length=None)
+        return shape_documents(ProductSummary, products)
+    
+    return list_response(await catalog_cache.get_or_load(("trending", extra_fields), load), response)
 
-@api_router.get("/products/deals", response_model=List[Product])
-async def get_deals():
-    products = await db.products.find({"original_price": {"$exists": True, "$ne": None}}).limit(6).to_list(length=None)
-    return [Product(**product) for product in products]
+@api_router.get("/products/deals", response_model=List[ProductSummary])
+async def get_deals(
+    response: Response,
+    fields: Optional[str] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("shelves"))
+):
+    if not_modified is not None:
+        return not_modified
+    extra_fields = parse_product_fields(fields)
+    
+    async def load():
+        products = await db.products.find({"original_price": {"$exists": True, "$ne": None}}, product_projection(extra_fields)).limit(6).to_list(length=None)
+        return shape_documents(ProductSummary, products)
+    
+    return list_response(await catalog_cache.get_or_load(("deals", extra_fields), load), response)
 
-@api_router.get("/products/new-arrivals", response_model=List[Product])
-async def get_new_arrivals():
-    # Get products sorted by creation date (newest first)
-    products = await db.products.find({}).sort("created_at", -1).limit(8).to_list(length=None)
-    return [Product(**product) for product in products]
+@api_router.get("/products/new-arrivals", response_model=List[ProductSummary])
+async def get_new_arrivals(
+    response: Response,
+    fields: Optional[str] = None,
+    not_modified: Optional[Response] = Depends(catalog_conditional("shelves"))
+):
+    if not_modified is not None:
+        return not_modified
+    extra_fields = parse_product_fields(fields)
+    
+    async def load():
+        # Get products sorted by creation date (newest first)
+        products = await db.products.find({}, product_projection(extra_fields)).sort("created_at", -1).limit(8).to_list(length=None)
+        return shape_documents(ProductSummary, products)
+    
+    return list_response(await catalog_cache.get_or_load(("new-arrivals", extra_fields), load), response)
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
+async def get_product(
+    request: Request,
+    product_id: str,
+    not_modified: Optional[Response] = Depends(catalog_conditional("product"))
+):
+    # A matching ETag was issued for this very product in the current catalog
+    # version, so it still exists and no lookup is needed. "*" and
+    # If-Modified-Since alone name no product and are checked against it
+    if not_modified is not None and request.headers.get("if-none-match", "*").strip() != "*":
+        return not_modified
+    
+    async def load():
+        return await db.products.find_one({"id": product_id}, {"_id": 0})
+    
+    product = await catalog_cache.get_or_load(("product", product_id), load)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    if not_modified is not None:
+        return not_modified
     return Product(**product)
 
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories():
-    categories = await db.categories.find().to_list(length=None)
-    return [Category(**category) for category in categories]
+async def get_categories(not_modified: Optional[Response] = Depends(catalog_conditional("categories"))):
+    if not_modified is not None:
+        return not_modified
+    
+    async def load():
+        categories = await db.categories.find().to_list(length=None)
+        return [Category(**category) for category in categories]
+    
+    return await catalog_cache.get_or_load("categories", load)
 
 @api_router.get("/brands", response_model=List[Brand])
-async def get_brands():
-    brands = await db.brands.find().to_list(length=None)
-    return [Brand(**brand) for brand in brands]
+async def get_brands(not_modified: Optional[Response] = Depends(catalog_conditional("brands"))):
+    if not_modified is not None:
+        return not_modified
+    
+    async def load():
+        brands = await db.brands.find().to_list(length=None)
+        return [Brand(**brand) for brand in brands]
+    
+    return await catalog_cache.get_or_load("brands", load)
 
 # Original status endpoints
 class StatusCheck(BaseModel):
@@ -1909,12 +5387,15 @@ async def health_check():
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(RequestContextMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Has-More"],
 )
 
 # Configure logging
@@ -1924,8 +5405,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
     client.close()
 
 # Add startup delay for Railway health checks
@@ -1938,11 +5423,23 @@ async def startup_event():
         # Test database connection
         await db.command("ping")
         logger.info("✅ Successfully connected to MongoDB")
+        if INDEX_RECONCILE_ON_STARTUP:
+            index_report = await reconcile_indexes()
+            if index_report["created"]:
+                logger.info(f"Created indexes: {', '.join(index_report['created'])}")
+            for problem in ("extra", "conflicting", "failed"):
+                if index_report[problem]:
+                    logger.warning(f"Indexes {problem}: {index_report[problem]}")
         logger.info("✅ FastAPI application started successfully on port 8000")
     except Exception as e:
         logger.error(f"❌ Failed to connect to MongoDB: {e}")
         # Don't exit in production, just log the error
         logger.info("⚠️  Continuing without database connection")
+    
+    background_tasks.append(asyncio.create_task(run_stats_reconciliation()))
+    background_tasks.append(asyncio.create_task(run_reservation_sweeper()))
+    background_tasks.append(asyncio.create_task(run_cache_sync()))
+    background_tasks.append(asyncio.create_task(event_loop_monitor.run()))
 
 # Add a simple immediate response endpoint
 @api_router.get("/ready")
@@ -1969,6 +5466,9 @@ async def health_check():
         }
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["seed"]:
+        seed_command(sys.argv[2:])
+        sys.exit(0)
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(
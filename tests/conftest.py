@@ -0,0 +1,97 @@
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+# server.py reads these at import time; the tests swap in an in-memory database
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "oeh_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import mongomock_motor
+import pytest
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(server, "db", client["oeh_test"])
+    server.principal_cache.clear()
+    return server.db
+
+
+@pytest.fixture
+def run():
+    return asyncio.run
+
+
+@pytest.fixture
+def api(db):
+    # Not used as a context manager, so the startup jobs never run
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def user(db, run):
+    user_id = str(uuid.uuid4())
+    run(db.users.insert_one({
+        "id": user_id, "email": f"{user_id}@example.com", "first_name": "Test", "last_name": "User",
+        "is_active": True
+    }))
+    return {"id": user_id, "headers": {"Authorization": f"Bearer {server.create_jwt_token(user_id, 'user')}"}}
+
+
+@pytest.fixture
+def product(db, run):
+    def create(stock: int, price: float = 10.0) -> str:
+        product_id = str(uuid.uuid4())
+        run(db.products.insert_one({
+            "id": product_id, "name": "Test product", "description": "For tests", "price": price,
+            "category": "Testing", "subcategory": "Fixtures", "brand": "Acme", "image_url": "", "rating": 4.0,
+            "review_count": 0, "in_stock": stock > 0, "stock_quantity": stock, "specifications": {},
+            "features": [], "tags": []
+        }))
+        return product_id
+    return create
+
+
+@pytest.fixture
+def admin(db, run):
+    admin_id = str(uuid.uuid4())
+    run(db.admins.insert_one({
+        "id": admin_id, "email": f"{admin_id}@example.com", "username": "admin", "is_super_admin": True,
+        "is_active": True
+    }))
+    return {"id": admin_id, "headers": {"Authorization": f"Bearer {server.create_jwt_token(admin_id, 'admin')}"}}
+
+
+@pytest.fixture
+def live_db(monkeypatch):
+    """Runs a coroutine against a scratch database on the server at TEST_MONGO_URL
+
+    For pipeline updates mongomock can't evaluate ($mergeObjects, expressions
+    inside array literals, $sum over a $map). Each call gets its own event
+    loop, client and database, dropped afterwards.
+    """
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("set TEST_MONGO_URL to run pipeline tests against a real MongoDB")
+
+    def run_live(scenario):
+        async def main():
+            client = AsyncIOMotorClient(url)
+            database = client[f"oeh_test_{uuid.uuid4().hex[:12]}"]
+            monkeypatch.setattr(server, "db", database)
+            try:
+                await server.reconcile_indexes()
+                return await scenario(database)
+            finally:
+                await client.drop_database(database.name)
+                client.close()
+        return asyncio.run(main())
+    return run_live
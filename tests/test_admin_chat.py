@@ -0,0 +1,8 @@
+def test_admin_message_to_unknown_user_is_rejected(api, db, run, admin):
+    response = api.post("/api/admin/chat/send", headers=admin["headers"], json={
+        "user_id": "no-such-user", "sender_type": "admin", "sender_name": "Admin", "message": "Hello"
+    })
+
+    assert response.status_code == 404
+    assert run(db.chat_messages.count_documents({})) == 0
+    assert run(db.conversations.count_documents({})) == 0
@@ -0,0 +1,48 @@
+import server
+
+
+def test_bulk_reprice_refuses_an_empty_filter(api, db, run, admin, product):
+    product_id = product(5, price=10.0)
+
+    for body in ({"filter": {}, "price_change": {"mode": "percent", "value": 10}},
+                 {"price_change": {"mode": "percent", "value": 10}}):
+        response = api.post("/api/admin/products/bulk-update", headers=admin["headers"], json=body)
+        assert response.status_code == 400
+
+    assert run(db.products.find_one({"id": product_id}))["price"] == 10.0
+
+
+def test_admin_stock_writes_derive_in_stock():
+    assert server.admin_stock_fields({"stock_quantity": 0})["in_stock"] is False
+    assert server.admin_stock_fields({"stock_quantity": 3})["in_stock"] is True
+    assert server.admin_stock_fields({"stock_quantity": 3, "in_stock": False})["in_stock"] is False
+    assert "in_stock" not in server.admin_stock_fields({"price": 1.0})
+
+
+def test_admin_listing_estimates_the_total_by_default(api, db, admin, product, monkeypatch):
+    product(5)
+    product(5)
+
+    async def exact_count(*args, **kwargs):
+        raise AssertionError("exact count without total=exact")
+
+    monkeypatch.setattr(type(db.products), "count_documents", exact_count)
+
+    response = api.get("/api/admin/products", headers=admin["headers"])
+
+    assert response.status_code == 200
+    assert response.json()["total_count"] == 2
+
+
+def test_estimated_total_flags_a_capped_count(api, admin, product, monkeypatch):
+    monkeypatch.setattr(server, "ESTIMATED_COUNT_CAP", 2)
+    for _ in range(2):
+        product(5, price=10.0)
+
+    body = api.get("/api/admin/products", headers=admin["headers"], params={"category": "Testing"}).json()
+    assert (body["total_count"], body["total_is_capped"]) == (2, False)
+
+    product(5, price=10.0)
+
+    body = api.get("/api/admin/products", headers=admin["headers"], params={"category": "Testing"}).json()
+    assert (body["total_count"], body["total_is_capped"]) == (2, True)
@@ -0,0 +1,30 @@
+import server
+
+
+def test_malformed_scrypt_hash_fails_verification():
+    assert server.verify_password("secret", "scrypt$not-a-number$8$1$zz$00") is False
+    assert server.verify_password("secret", "scrypt$truncated") is False
+
+
+def test_unknown_email_still_checks_a_password(api, monkeypatch):
+    checked = []
+    real_verify = server.verify_password
+    monkeypatch.setattr(server, "verify_password", lambda password, hashed: checked.append(hashed) or real_verify(password, hashed))
+
+    response = api.post("/api/users/login", json={"email": "nobody@example.com", "password": "secret"})
+
+    assert response.status_code == 401
+    assert checked == [None, server.DUMMY_PASSWORD_HASH]
+
+
+def test_sample_account_reset_drops_cached_principals(api, user, monkeypatch):
+    async def rebuild():
+        pass
+
+    # Mongomock has no $merge
+    monkeypatch.setattr(server, "rebuild_conversation_summaries", rebuild)
+    assert api.get("/api/cart", headers=user["headers"]).status_code == 200
+
+    assert api.post("/api/create-sample-users").status_code == 200
+
+    assert api.get("/api/cart", headers=user["headers"]).status_code == 401
@@ -0,0 +1,71 @@
+import asyncio
+
+import server
+
+
+def lines(cart):
+    return {item["product_id"]: (item["quantity"], item["price"]) for item in cart["items"]}
+
+
+def test_adding_appends_then_merges_into_one_line(live_db):
+    async def scenario(db):
+        await server.update_cart("u1", [server.cart_add_stage("p1", 2, 5.0)])
+        await server.update_cart("u1", [server.cart_add_stage("p2", 1, 3.0)])
+        return await server.update_cart("u1", [server.cart_add_stage("p1", 3, 5.0)])
+
+    cart = live_db(scenario)
+
+    assert lines(cart) == {"p1": (5, 5.0), "p2": (1, 3.0)}
+    assert cart["total"] == 28.0
+    assert cart["user_id"] == "u1" and cart["id"]
+
+
+def test_product_ids_are_stored_literally(live_db):
+    async def scenario(db):
+        await server.update_cart("u1", [server.cart_add_stage("$items", 1, 2.0)])
+        return await server.update_cart("u1", [server.cart_add_stage("$items", 1, 2.0)])
+
+    assert lines(live_db(scenario)) == {"$items": (2, 2.0)}
+
+
+def test_setting_quantities_updates_adds_and_removes_at_zero(live_db):
+    async def scenario(db):
+        await server.update_cart("u1", [server.cart_add_stage("p1", 2, 5.0)])
+        await server.update_cart("u1", [server.cart_add_stage("p2", 1, 3.0)])
+        return await server.update_cart("u1", [server.cart_set_quantities_stage(
+            {"p1": 4, "p2": 0, "p3": 1}, {"p1": 6.0, "p2": 3.0, "p3": 7.5}
+        )])
+
+    cart = live_db(scenario)
+
+    # Existing lines keep the price they were added at
+    assert lines(cart) == {"p1": (4, 5.0), "p3": (1, 7.5)}
+    assert cart["total"] == 27.5
+
+
+def test_removing_a_line_and_missing_carts(live_db):
+    async def scenario(db):
+        await server.update_cart("u1", [server.cart_add_stage("p1", 2, 5.0)])
+        await server.update_cart("u1", [server.cart_add_stage("p2", 1, 3.0)])
+        removed = await server.update_cart("u1", [server.cart_remove_stage("p1")], upsert=False)
+        missing = await server.update_cart("nobody", [server.cart_remove_stage("p1")], upsert=False)
+        return removed, missing, await db.carts.count_documents({})
+
+    removed, missing, carts = live_db(scenario)
+
+    assert lines(removed) == {"p2": (1, 3.0)}
+    assert removed["total"] == 3.0
+    assert missing is None and carts == 1
+
+
+def test_concurrent_adds_to_one_line_are_all_counted(live_db):
+    async def scenario(db):
+        # The first writes race to create the cart as well as the line
+        await asyncio.gather(*(server.update_cart("u1", [server.cart_add_stage("p1", 1, 5.0)]) for _ in range(25)))
+        return await db.carts.find({"user_id": "u1"}).to_list(None)
+
+    carts = live_db(scenario)
+
+    assert len(carts) == 1
+    assert lines(carts[0]) == {"p1": (25, 5.0)}
+    assert carts[0]["total"] == 125.0
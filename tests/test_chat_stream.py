@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+import server
+
+
+async def authorized():
+    pass
+
+
+def insert_messages(run, db, user_id, count):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    messages = [
+        {"id": f"m{i:02d}", "user_id": user_id, "sender_type": "user", "sender_name": "Test User",
+         "message": f"hello {i}", "created_at": start + timedelta(seconds=i)}
+        for i in range(count)
+    ]
+    run(db.chat_messages.insert_many(messages))
+    return [message["id"] for message in messages]
+
+
+def first_events(run, response, count):
+    async def collect():
+        events = []
+        iterator = response.body_iterator
+        try:
+            while len(events) < count:
+                events.append(await iterator.__anext__())
+        finally:
+            await iterator.aclose()
+        return events
+    return run(collect())
+
+
+def test_reconnect_backfills_every_missed_message_across_pages(db, run, monkeypatch):
+    monkeypatch.setattr(server, "CHAT_STREAM_BACKFILL_PAGE_SIZE", 3)
+    ids = insert_messages(run, db, "u1", 8)
+
+    events = first_events(run, server.chat_event_stream("u1", ids[0], authorized), 7)
+
+    assert [event.split("\n")[0] for event in events] == [f"id: {message_id}" for message_id in ids[1:]]
+
+
+def test_unknown_last_event_id_sends_reset(db, run):
+    insert_messages(run, db, "u1", 2)
+
+    events = first_events(run, server.chat_event_stream("u1", "gone", authorized), 1)
+
+    assert events[0].startswith("event: reset")
+
+
+def test_last_event_id_from_another_conversation_sends_reset(db, run):
+    other_ids = insert_messages(run, db, "u2", 1)
+
+    events = first_events(run, server.chat_event_stream("u1", other_ids[0], authorized), 1)
+
+    assert events[0].startswith("event: reset")
+
+
+def test_stream_ends_once_the_account_is_deactivated(db, run, user, monkeypatch):
+    monkeypatch.setattr(server, "CHAT_STREAM_HEARTBEAT_SECONDS", 0.01)
+    token = user["headers"]["Authorization"].removeprefix("Bearer ")
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    response = server.chat_event_stream(user["id"], None, lambda: server.get_current_user(credentials))
+
+    async def collect():
+        events = [await response.body_iterator.__anext__()]
+        await db.users.update_one({"id": user["id"]}, {"$set": {"is_active": False}})
+        server.invalidate_principal("user", user["id"])
+        async for event in response.body_iterator:
+            events.append(event)
+        return events
+
+    events = run(asyncio.wait_for(collect(), timeout=5))
+
+    assert events[0] == ": keep-alive\n\n"
+    assert all(event == ": keep-alive\n\n" for event in events)
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import server
+
+
+def test_etag_follows_the_shared_version_not_the_local_one(monkeypatch):
+    monkeypatch.setattr(server.catalog_cache, "shared_version", 0)
+    server.observe_cache_versions({"catalog": 7, "catalog_modified_at": datetime(2025, 1, 1)})
+    etag, _ = server.catalog_validators()
+
+    server.catalog_cache.bump_version()
+    assert server.catalog_validators()[0] == etag
+
+    server.observe_cache_versions({"catalog": 8})
+    assert server.catalog_validators()[0] != etag
+
+
+def test_caching_disabled_sends_no_validators(api, monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_CACHE_TTL_SECONDS", 0)
+
+    response = api.get("/api/categories")
+
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+
+
+def test_unknown_product_is_404_even_with_a_current_etag(api, product):
+    product_id = product(5)
+    etag = api.get(f"/api/products/{product_id}").headers["etag"]
+
+    assert api.get(f"/api/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert api.get("/api/products/missing", headers={"If-None-Match": etag}).status_code == 404
+
+
+def test_matching_product_etag_is_answered_without_mongo(api, db, product, monkeypatch):
+    product_id = product(5)
+    etag = api.get(f"/api/products/{product_id}").headers["etag"]
+    server.catalog_cache.clear()
+
+    async def find_one(*args, **kwargs):
+        raise AssertionError("conditional hit queried Mongo")
+
+    monkeypatch.setattr(type(db.products), "find_one", find_one)
+
+    assert api.get(f"/api/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_invalidation_moves_the_etag_before_the_publish_lands():
+    etag, _ = server.catalog_validators("/api/categories")
+
+    server.invalidate_catalog()
+
+    assert server.catalog_validators("/api/categories")[0] != etag
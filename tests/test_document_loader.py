@@ -0,0 +1,36 @@
+import server
+
+
+class Collection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return self
+
+    async def to_list(self, length=None):
+        keys = self.queries[-1]["id"]["$in"]
+        return [doc for doc in self.docs if doc["id"] in keys]
+
+
+def test_load_many_resolves_keys_in_order_with_one_query(run):
+    collection = Collection([{"id": "a"}, {"id": "b"}])
+
+    documents = run(server.DocumentLoader(collection).load_many(["b", "missing", "a", "b"]))
+
+    assert documents == [{"id": "b"}, None, {"id": "a"}, {"id": "b"}]
+    assert collection.queries == [{"id": {"$in": ["b", "missing", "a"]}}]
+
+
+def test_load_many_queries_only_unseen_keys(run):
+    collection = Collection([{"id": "a"}, {"id": "b"}])
+    loader = server.DocumentLoader(collection)
+
+    run(loader.load_many(["a", "missing"]))
+    documents = run(loader.load_many(["a", "b", "missing"]))
+
+    assert documents == [{"id": "a"}, {"id": "b"}, None]
+    assert collection.queries[1] == {"id": {"$in": ["b"]}}
+    assert len(collection.queries) == 2
@@ -0,0 +1,4 @@
+def test_quote_listing_and_exports_require_admin(api, admin):
+    for export_format in ("json", "csv", "ndjson"):
+        assert api.get("/api/admin/quotes", params={"format": export_format}).status_code in (401, 403)
+        assert api.get("/api/admin/quotes", params={"format": export_format}, headers=admin["headers"]).status_code == 200
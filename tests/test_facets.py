@@ -0,0 +1,15 @@
+import server
+
+
+def test_unpriced_products_get_their_own_price_bucket(db, run, product):
+    product(5, price=20.0)
+    product(5, price=4000.0)
+    product(5, price=-1.0)
+    unpriced = product(5)
+    run(db.products.update_one({"id": unpriced}, {"$unset": {"price": ""}}))
+
+    buckets = {bucket["label"]: bucket for bucket in run(server.compute_product_facets({}))["price_buckets"]}
+
+    assert buckets["0-50"]["count"] == 1
+    assert buckets["2500+"] == {"label": "2500+", "min_price": 2500, "max_price": None, "count": 1}
+    assert buckets["unpriced"] == {"label": "unpriced", "min_price": None, "max_price": None, "count": 2}
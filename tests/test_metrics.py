@@ -0,0 +1,18 @@
+import server
+
+
+def test_metrics_need_a_configured_token(api, monkeypatch):
+    assert api.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(server, "METRICS_TOKEN", "scrape-secret")
+
+    assert api.get("/metrics").status_code == 401
+    assert api.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = api.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "http_requests_in_flight" in response.text
+
+
+def test_route_template_resolves_path_parameters():
+    assert server.route_template({"method": "GET", "path": "/api/products/abc"}) == "GET /api/products/{product_id}"
+    assert server.route_template({"method": "GET", "path": "/nowhere"}) == "GET unmatched"
@@ -0,0 +1,25 @@
+import server
+
+
+def test_stall_stacks_are_logged_once_per_interval(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(server.logger, "warning", warnings.append)
+    monitor = server.EventLoopMonitor(0.1, 1.0)
+
+    for _ in range(3):
+        monitor._log_stall("GET /api/products", 1.5, ["frame\n"])
+    assert len(warnings) == 1
+
+    monitor._stall_logs["GET /api/products"][0] -= server.EVENT_LOOP_STALL_LOG_INTERVAL_SECONDS
+    monitor._log_stall("GET /api/products", 1.5, ["frame\n"])
+
+    assert len(warnings) == 2
+    assert "(2 more since last logged)" in warnings[1]
+
+
+def test_performance_report_lists_in_flight_requests(api, admin, monkeypatch):
+    monkeypatch.setattr(server.HTTP_REQUESTS_IN_FLIGHT, "values", {("GET /api/slow",): 2})
+
+    report = api.get("/api/admin/performance", headers=admin["headers"]).json()
+
+    assert report["in_flight"]["GET /api/slow"] == 2
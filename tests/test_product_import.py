@@ -0,0 +1,49 @@
+import pytest
+
+HEADER = "sku,name,description,price,category,subcategory,brand,image_url\n"
+
+
+def row(sku, price="10.0", category="Testing"):
+    return f"{sku},Vest {sku},Test vest,{price},{category},Fixtures,Acme,https://images.example.com/{sku}.jpg\n"
+
+
+@pytest.fixture
+def catalog(db, run):
+    run(db.categories.insert_one({"id": "c1", "name": "Testing", "slug": "testing"}))
+    run(db.brands.insert_one({"id": "b1", "name": "Acme"}))
+
+
+def upload(api, admin, body, **params):
+    return api.post("/api/admin/products/import", headers=admin["headers"], params=params,
+                    files={"file": ("products.csv", body, "text/csv")})
+
+
+def test_mixed_import_writes_valid_rows_and_reports_the_rest(api, db, run, admin, catalog):
+    body = HEADER + row("A-1") + row("A-2", price="free") + row("A-3", category="Nope") + row("") + row("A-5")
+
+    report = upload(api, admin, body, batch_size=2).json()
+
+    assert (report["processed"], report["inserted"], report["updated"], report["failed"]) == (5, 2, 0, 3)
+    assert [error["row"] for error in report["errors"]] == [3, 4, 5]
+    assert "price" in report["errors"][0]["error"]
+    assert "Nope" in report["errors"][1]["error"]
+    assert report["errors"][2]["error"] == "Missing sku"
+    assert run(db.products.count_documents({"sku": {"$in": ["A-1", "A-5"]}})) == 2
+
+
+def test_reimport_updates_existing_skus(api, db, run, admin, catalog):
+    upload(api, admin, HEADER + row("A-1"))
+
+    report = upload(api, admin, HEADER + row("A-1", price="12.5") + row("A-6")).json()
+
+    assert (report["inserted"], report["updated"], report["failed"]) == (1, 1, 0)
+    assert run(db.products.count_documents({})) == 2
+
+
+def test_ordered_import_stops_at_the_first_bad_row(api, db, run, admin, catalog):
+    body = HEADER + row("A-1") + row("A-2", price="free") + row("A-3")
+
+    report = upload(api, admin, body, ordered="true").json()
+
+    assert (report["processed"], report["inserted"], report["failed"]) == (2, 1, 1)
+    assert run(db.products.count_documents({"sku": "A-3"})) == 0
@@ -0,0 +1,189 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def stock(run, db, product_id):
+    return run(db.products.find_one({"id": product_id}))["stock_quantity"]
+
+
+def held(run, user_id, product_id):
+    return run(server.reserved_cart_quantities(user_id, [product_id])).get(product_id, 0)
+
+
+def test_lowering_a_sold_out_line_keeps_the_remaining_units(api, db, run, user, product):
+    product_id = product(3)
+    assert api.post("/api/cart/add", headers=user["headers"], json={"product_id": product_id, "quantity": 3}).status_code == 200
+    assert stock(run, db, product_id) == 0
+
+    response = api.put("/api/cart/items", headers=user["headers"], json={"items": [{"product_id": product_id, "quantity": 1}]})
+
+    assert response.status_code == 200
+    assert held(run, user["id"], product_id) == 1
+    assert stock(run, db, product_id) == 2
+
+
+def test_growing_a_line_only_needs_stock_for_the_difference(api, db, run, user, product):
+    product_id = product(4)
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": product_id, "quantity": 3})
+
+    response = api.put("/api/cart/items", headers=user["headers"], json={"items": [{"product_id": product_id, "quantity": 4}]})
+
+    assert response.status_code == 200
+    assert held(run, user["id"], product_id) == 4
+    assert stock(run, db, product_id) == 0
+
+
+def test_shrinking_releases_only_the_surplus(db, run, user, product):
+    product_id = product(10)
+    run(server.reserve_stock(product_id, 2, user["id"], "cart"))
+    run(server.reserve_stock(product_id, 3, user["id"], "cart"))
+
+    run(server.release_cart_surplus(user["id"], {product_id: 1}, {product_id: 5}))
+
+    assert held(run, user["id"], product_id) == 1
+    assert stock(run, db, product_id) == 9
+
+
+def test_release_units_splits_the_last_reservation(db, run, user, product):
+    product_id = product(10)
+    run(server.reserve_stock(product_id, 2, user["id"], "cart"))
+    run(server.reserve_stock(product_id, 3, user["id"], "cart"))
+
+    released = run(server.release_units({"user_id": user["id"], "product_id": product_id}, 4))
+
+    assert released == 4
+    assert held(run, user["id"], product_id) == 1
+    assert stock(run, db, product_id) == 9
+
+
+def test_a_failed_line_rolls_back_earlier_increases(db, run, user, product):
+    plenty, scarce = product(10), product(1)
+
+    with pytest.raises(HTTPException) as error:
+        run(server.reserve_cart_increases(user["id"], {plenty: 5, scarce: 3}, {}))
+
+    assert error.value.status_code == 400
+    assert stock(run, db, plenty) == 10
+    assert stock(run, db, scarce) == 1
+    assert held(run, user["id"], plenty) == 0
+
+
+def test_insufficient_stock_leaves_existing_holds_alone(api, db, run, user, product):
+    plenty, scarce = product(10), product(2)
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": plenty, "quantity": 4})
+
+    response = api.put("/api/cart/items", headers=user["headers"], json={"items": [
+        {"product_id": plenty, "quantity": 1},
+        {"product_id": scarce, "quantity": 5}
+    ]})
+
+    assert response.status_code == 400
+    assert held(run, user["id"], plenty) == 4
+    assert stock(run, db, plenty) == 6
+
+
+def quote_request(user_id, *items):
+    return {
+        "user_id": user_id,
+        "items": [{"product_id": product_id, "quantity": quantity, "price": 0} for product_id, quantity in items],
+        "project_name": "Test", "intended_use": "training",
+        "delivery_address": "1 Street", "billing_address": "1 Street"
+    }
+
+
+def test_quote_converts_cart_holds_in_place(api, db, run, user, product):
+    product_id = product(5)
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": product_id, "quantity": 3})
+    cart_reservation = run(db.stock_reservations.find_one({"user_id": user["id"]}))
+
+    response = api.post("/api/quotes", headers=user["headers"], json=quote_request(user["id"], (product_id, 4)))
+
+    assert response.status_code == 200
+    quote_id = response.json()["quote_id"]
+    converted = run(db.stock_reservations.find_one({"id": cart_reservation["id"]}))
+    assert converted["status"] == "active" and converted["source"] == "quote" and converted["quote_id"] == quote_id
+    assert "expires_at" not in converted
+    assert run(server.reserved_quantities({"quote_id": quote_id})) == {product_id: 4}
+    assert stock(run, db, product_id) == 1
+
+
+def test_quote_releases_cart_surplus_and_unquoted_lines(api, db, run, user, product):
+    quoted, dropped = product(5), product(5)
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": quoted, "quantity": 4})
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": dropped, "quantity": 2})
+
+    response = api.post("/api/quotes", headers=user["headers"], json=quote_request(user["id"], (quoted, 1)))
+
+    assert response.status_code == 200
+    assert run(server.reserved_quantities({"quote_id": response.json()["quote_id"]})) == {quoted: 1}
+    assert run(server.reserved_quantities({"user_id": user["id"], "source": "cart"})) == {}
+    assert stock(run, db, quoted) == 4
+    assert stock(run, db, dropped) == 5
+
+
+def test_failed_quote_gives_the_cart_its_holds_back(api, db, run, user, product):
+    held_product, scarce = product(5), product(1)
+    api.post("/api/cart/add", headers=user["headers"], json={"product_id": held_product, "quantity": 3})
+
+    response = api.post("/api/quotes", headers=user["headers"], json=quote_request(user["id"], (held_product, 3), (scarce, 2)))
+
+    assert response.status_code == 400
+    assert held(run, user["id"], held_product) == 3
+    assert stock(run, db, held_product) == 2
+    assert stock(run, db, scarce) == 1
+    restored = run(db.stock_reservations.find_one({"user_id": user["id"], "status": "active"}))
+    assert restored["source"] == "cart" and restored["quote_id"] is None and restored["expires_at"] is not None
+
+
+def test_release_restores_in_stock_only_after_a_reservation_sell_out(db, run, user, product):
+    product_id = product(2)
+    reservation = run(server.reserve_stock(product_id, 2, user["id"], "cart"))
+    assert run(db.products.find_one({"id": product_id}))["in_stock"] is False
+
+    run(server.release_reservations({"id": reservation["id"]}))
+
+    restored = run(db.products.find_one({"id": product_id}))
+    assert restored["in_stock"] is True and restored["stock_quantity"] == 2
+
+
+def test_release_keeps_an_admin_out_of_stock_flag(db, run, user, product):
+    product_id = product(5)
+    reservation = run(server.reserve_stock(product_id, 2, user["id"], "cart"))
+    run(db.products.update_one({"id": product_id}, {"$set": server.admin_stock_fields({"in_stock": False})}))
+
+    run(server.release_reservations({"id": reservation["id"]}))
+
+    restored = run(db.products.find_one({"id": product_id}))
+    assert restored["in_stock"] is False and restored["stock_quantity"] == 5
+
+
+def test_non_positive_quantities_are_rejected(api, db, run, user, product):
+    product_id = product(2)
+
+    for quantity in (-100, 0):
+        response = api.post("/api/cart/add", headers=user["headers"], json={"product_id": product_id, "quantity": quantity})
+        assert response.status_code == 422
+    response = api.post("/api/quotes", headers=user["headers"], json=quote_request(user["id"], (product_id, -5)))
+    assert response.status_code == 422
+    assert stock(run, db, product_id) == 2
+
+    with pytest.raises(ValueError):
+        run(server.reserve_stock(product_id, -100, user["id"], "quote"))
+    assert stock(run, db, product_id) == 2
+
+
+def test_quote_status_changes_need_an_admin_and_a_known_status(api, db, run, user, admin, product):
+    product_id = product(5)
+    quote_id = api.post("/api/quotes", headers=user["headers"], json=quote_request(user["id"], (product_id, 3))).json()["quote_id"]
+    url = f"/api/admin/quotes/{quote_id}/status"
+
+    assert api.put(url, params={"status": "declined"}).status_code in (401, 403)
+    assert api.put(url, params={"status": "declined"}, headers=user["headers"]).status_code in (401, 403)
+    assert api.put(url, params={"status": "bogus"}, headers=admin["headers"]).status_code == 422
+    assert stock(run, db, product_id) == 2
+
+    assert api.put(url, params={"status": "declined"}, headers=admin["headers"]).status_code == 200
+    assert stock(run, db, product_id) == 5
+    assert api.put("/api/admin/quotes/missing/status", params={"status": "declined"}, headers=admin["headers"]).status_code == 404
@@ -0,0 +1,26 @@
+import server
+
+
+def test_replace_refused_unless_database_is_allow_listed(api, admin, monkeypatch):
+    monkeypatch.setattr(server, "SYNTHETIC_DATA_ENABLED", True)
+    monkeypatch.setattr(server, "SYNTHETIC_REPLACE_DATABASES", {"oeh_scratch"})
+
+    response = api.post("/api/admin/synthetic-data", json={"replace": True}, headers=admin["headers"])
+
+    assert response.status_code == 403
+    assert "oeh_test" in response.json()["detail"]
+
+
+def test_job_records_the_report(db, run, admin, api, monkeypatch):
+    async def generate(spec):
+        return {"seed": spec.seed}
+
+    monkeypatch.setattr(server, "generate_synthetic_data", generate)
+    run(db.synthetic_data_jobs.insert_one({"id": "job-1", "status": "running"}))
+
+    run(server.run_synthetic_data_job("job-1", server.SyntheticDataSpec(seed=7)))
+
+    job = api.get("/api/admin/synthetic-data/job-1", headers=admin["headers"]).json()
+    assert job["status"] == "completed"
+    assert job["report"] == {"seed": 7}
+    assert api.get("/api/admin/synthetic-data/missing", headers=admin["headers"]).status_code == 404